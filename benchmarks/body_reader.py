@@ -0,0 +1,128 @@
+"""
+Compare the old readexactly(MAX_BODY_SIZE) body reader against
+BaseResponse.get_body().
+
+Each case runs in a fresh subprocess so that the peak RSS reported for
+one reader isn't inflated by memory left behind from another.
+
+Usage:
+    python -m benchmarks.body_reader
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from asyncio.exceptions import IncompleteReadError
+
+from geminiportal.protocols import SpartanRequest
+from geminiportal.protocols.base import (
+    CHUNK_SIZE,
+    MAX_BODY_SIZE,
+    ProxyResponseSizeError,
+)
+from geminiportal.protocols.spartan import SpartanResponse
+from geminiportal.urls import URLReference
+
+SIZES = {
+    "10KB": 10 * 1024,
+    "500KB": 500 * 1024,
+    "1MB": MAX_BODY_SIZE - 1,
+}
+
+ITERATIONS = 50
+
+
+async def feed(reader: asyncio.StreamReader, size: int) -> None:
+    """
+    Simulate a network connection delivering the body in chunks.
+    """
+    chunk = b"a" * CHUNK_SIZE
+    remaining = size
+    while remaining > 0:
+        reader.feed_data(chunk[:remaining])
+        remaining -= CHUNK_SIZE
+        await asyncio.sleep(0)
+    reader.feed_eof()
+
+
+def build_response(reader: asyncio.StreamReader) -> SpartanResponse:
+    request = SpartanRequest(URLReference("spartan://mozz.us/"))
+    return SpartanResponse(request, reader, None, "2", "text/plain")
+
+
+async def read_before(response: SpartanResponse) -> bytes:
+    try:
+        await response.reader.readexactly(MAX_BODY_SIZE)
+    except IncompleteReadError as e:
+        return e.partial
+    else:
+        raise ProxyResponseSizeError()
+
+
+async def read_after(response: SpartanResponse) -> bytes:
+    return await response.get_body()
+
+
+READERS = {"before": read_before, "after": read_after}
+
+
+async def run_case(name: str, size: int) -> dict[str, float]:
+    read = READERS[name]
+
+    elapsed = 0.0
+    for i in range(ITERATIONS + 1):
+        reader = asyncio.StreamReader()
+        response = build_response(reader)
+        task = asyncio.create_task(feed(reader, size))
+
+        if i == ITERATIONS:
+            # Measure allocations on a single extra pass, outside of the timing
+            tracemalloc.start()
+            body = await read(response)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            body = await read(response)
+            elapsed += time.perf_counter() - start
+
+        await task
+        assert len(body) == size
+        del body
+
+    return {
+        "time_ms": elapsed / ITERATIONS * 1000,
+        "alloc_peak_kb": peak / 1024,
+        "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> None:
+    print(
+        f"{'size':>6} {'reader':>7} {'time (ms)':>10} {'alloc peak (KB)':>16} {'peak RSS (MB)':>14}"
+    )
+    for label, size in SIZES.items():
+        for name in READERS:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.body_reader", name, str(size)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output)
+            print(
+                f"{label:>6} {name:>7} {result['time_ms']:>10.3f} "
+                f"{result['alloc_peak_kb']:>16.1f} {result['rss_peak_mb']:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        print(json.dumps(asyncio.run(run_case(sys.argv[1], int(sys.argv[2])))))
+    else:
+        main()
@@ -0,0 +1,240 @@
+"""
+Compare the old if/elif gemtext state machine against the handlers that
+render from the gemtext parser, in lines of gemtext rendered per second.
+
+The corpus is made up of the kinds of documents that are most often
+requested through the portal: capsule index pages, long-form gemlog
+posts, feed aggregators that are mostly links, and pages with large
+preformatted blocks.
+
+Usage:
+    python -m benchmarks.gemtext_parser
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+
+from quart import escape
+
+from geminiportal.app import app
+from geminiportal.gemtext import RABBIT_ART, RABBIT_INLINE, RABBIT_STANDALONE
+from geminiportal.handlers.gemini import GeminiFlowedHandler, GeminiFlowedHandler2
+from geminiportal.urls import URLReference
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data")
+
+ITERATIONS = 20
+
+PARAGRAPH = (
+    "Gemini is a new internet technology supporting an electronic library of "
+    "interconnected text documents. That's not a new idea, but it's not old "
+    "fashioned either. It's timeless, and deserves tools which treat it as a "
+    "first class concept, not a vestigial corner case."
+)
+
+
+def build_index() -> str:
+    lines = ["# My Capsule", "", "Welcome to my little corner of geminispace!", ""]
+    for section in ["Gemlog", "Projects", "Links"]:
+        lines += [f"## {section}", ""]
+        for i in range(30):
+            lines.append(f"=> /{section.lower()}/{i:03d}.gmi 2023-01-{i % 28 + 1:02d} Post {i}")
+        lines.append("")
+    lines += ["=> gemini://geminiprotocol.net/ Project Gemini", "=> https://mozz.us/ Web"]
+    return "\n".join(lines)
+
+
+def build_post() -> str:
+    lines = ["# A long post", "", "## Introduction", ""]
+    for i in range(40):
+        lines += [PARAGRAPH, ""]
+        if i % 5 == 0:
+            lines += [f"### Part {i}", ""]
+        if i % 7 == 0:
+            lines += ["* first point", "* second point", "* third point", ""]
+        if i % 9 == 0:
+            lines += ["> A quote from someone else,", "> spanning multiple lines.", ""]
+    lines += ["=> ../ Back to the index"]
+    return "\n".join(lines)
+
+
+def build_feed() -> str:
+    lines = ["# Antenna", "", "=: /submit Submit a feed", ""]
+    for i in range(500):
+        lines.append(
+            f"=> gemini://capsule{i % 50}.example.org/gemlog/{i}.gmi "
+            f"2023-02-{i % 28 + 1:02d} - Author {i % 50}: Entry title number {i}"
+        )
+    return "\n".join(lines)
+
+
+def build_preformatted() -> str:
+    lines = ["# ASCII art gallery", ""]
+    for i in range(20):
+        lines += [f"```art {i}", *RABBIT_ART.splitlines(), "```", "", f"Piece {i}", ""]
+    lines += [RABBIT_STANDALONE, f"Hop {RABBIT_INLINE} hop"]
+    return "\n".join(lines)
+
+
+def load_corpus() -> dict[str, bytes]:
+    with open(os.path.join(DATA_DIR, "sample.gmi"), "rb") as fp:
+        sample = fp.read()
+
+    return {
+        "sample": sample * 50,
+        "index": build_index().encode(),
+        "post": build_post().encode(),
+        "feed": build_feed().encode(),
+        "preformatted": build_preformatted().encode(),
+    }
+
+
+class LegacyFlowedHandler(GeminiFlowedHandler):
+    """
+    The gemtext renderer from before the parser was split out.
+    """
+
+    _rabbit_re = re.compile(RABBIT_INLINE)
+
+    async def get_body(self) -> str:
+        for line in self.text.splitlines(keepends=False):
+            self.feed(line)
+        self.flush()
+
+        body = "\n".join(self.sections)
+        return f'<div class="gemini">{body}</div>\n'
+
+    @staticmethod
+    def parse_link_line(line: str, base: URLReference) -> tuple[URLReference, str]:
+        parts = line.split(maxsplit=1)
+        if len(parts) == 0:
+            link, link_text = "", ""
+        elif len(parts) == 1:
+            link, link_text = parts[0], parts[0]
+        else:
+            link, link_text = parts
+
+        url = base.join(link)
+        return url, link_text
+
+    def feed(self, line: str) -> None:
+        line = line.rstrip()
+        line = self._rabbit_re.sub("🐇", line)
+        if line.startswith("```"):
+            self.flush()
+            self.preformat_mode = not self.preformat_mode
+        elif self.preformat_mode:
+            if line == RABBIT_STANDALONE:
+                line = RABBIT_ART
+            self.buffer.append(escape(line))
+        elif line == RABBIT_STANDALONE:
+            self.flush()
+            self.sections.append(f"<pre>{RABBIT_ART}</pre>")
+        elif line.startswith("=>"):
+            self.flush()
+            url, link_text = self.parse_link_line(line[2:], self.url)
+            gemini_link, link_text = self.parse_link_line(line[2:], self.url)
+            mime_type = url.guess_mimetype()
+            if self.inline_images and mime_type and mime_type.startswith("image"):
+                image_url = url.get_proxy_url(raw=True)
+                self.sections.append(
+                    f'<figure><a href="{escape(image_url)}">'
+                    f'<img src="{escape(image_url)}" alt="{escape(link_text)}">'
+                    f"</a><figcaption>{escape(link_text)}</figcaption></figure>"
+                )
+            else:
+                image_url = url.get_proxy_url()
+                self.sections.append(
+                    f'<a href="{escape(image_url)}">⇒ {escape(link_text)}</a><br/>'
+                )
+        elif line.startswith("=:"):
+            self.flush()
+            url, link_text = self.parse_link_line(line[2:], self.url)
+            proxy_url = url.get_proxy_url()
+            self.sections.append(
+                f'<form method="get" action="{escape(proxy_url)}" class="input-line">'
+                f"<label>{escape(link_text)}"
+                '<textarea name="q" rows="1" placeholder="Enter text..."></textarea>'
+                "</label>"
+                '<input type="submit" value="Submit">'
+                "</form>"
+            )
+        elif line.startswith("###"):
+            self.flush()
+            text = line[3:].lstrip()
+            anchor = self.get_anchor(text)
+            self.sections.append(f"<h3 id={anchor}>{escape(text)}</h3>")
+        elif line.startswith("##"):
+            self.flush()
+            text = line[2:].lstrip()
+            anchor = self.get_anchor(text)
+            self.sections.append(f"<h2 id={anchor}>{escape(text)}</h2>")
+        elif line.startswith("#"):
+            self.flush()
+            text = line[1:].lstrip()
+            anchor = self.get_anchor(text)
+            self.sections.append(f"<h1 id={anchor}>{escape(text)}</h1>")
+        elif line.startswith("* "):
+            if not self.list_mode:
+                self.flush()
+                self.list_mode = True
+            self.buffer.append(f"<li>{escape(line[1:].lstrip())}</li>")
+        elif line.startswith(">"):
+            if not self.quote_mode:
+                self.flush()
+                self.quote_mode = True
+            self.buffer.append(escape(line[1:]))
+        else:
+            if self.list_mode or self.quote_mode:
+                self.flush()
+            self.buffer.append(escape(line) + "\n")
+
+
+class LegacyFlowedHandler2(LegacyFlowedHandler):
+    inline_images = True
+
+
+HANDLERS = {
+    "before": LegacyFlowedHandler,
+    "after": GeminiFlowedHandler,
+}
+
+INLINE_HANDLERS = {
+    "before": LegacyFlowedHandler2,
+    "after": GeminiFlowedHandler2,
+}
+
+
+async def run_case(handler_class: type[GeminiFlowedHandler], data: bytes) -> tuple[float, str]:
+    url = URLReference("gemini://mozz.us/docs/page.gmi")
+
+    # Report the fastest pass, which is the least affected by other noise
+    # on the machine.
+    best = float("inf")
+    for _ in range(ITERATIONS):
+        handler = handler_class(url, data, "text/gemini", "UTF-8")
+        start = time.perf_counter()
+        body = await handler.get_body()
+        best = min(best, time.perf_counter() - start)
+
+    return len(data.splitlines()) / best, body
+
+
+async def main() -> None:
+    app.config["SERVER_NAME"] = "portal.mozz.us"
+
+    print(f"{'document':>12} {'inline':>7} {'before (lines/s)':>17} {'after (lines/s)':>16}")
+    async with app.app_context():
+        for name, data in load_corpus().items():
+            for inline, handlers in [("no", HANDLERS), ("yes", INLINE_HANDLERS)]:
+                before, expected = await run_case(handlers["before"], data)
+                after, body = await run_case(handlers["after"], data)
+                assert body == expected, name
+                print(f"{name:>12} {inline:>7} {before:>17,.0f} {after:>16,.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Compare resolving every link on a page with URLReference.join() and
+url_for() against the per-document LinkResolver and ProxyURLBuilder, on a
+synthetic page with 10,000 links.
+
+The links are a mix of absolute, root-relative, relative and parent
+references, with duplicates the way that directory listings and feed
+aggregators repeat the same hosts and files.
+
+Usage:
+    python -m benchmarks.link_resolver
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from geminiportal.app import app
+from geminiportal.urls import LinkResolver, URLReference
+
+LINK_COUNT = 10_000
+
+# Distinct targets on the page, the rest of the links are duplicates
+DISTINCT_LINKS = 2_500
+
+ITERATIONS = 10
+
+PREFIXES = ["", "./", "/files/", "../", "gemini://capsule.example.org/", "spartan://mozz.us/"]
+
+
+def build_links() -> list[str]:
+    links = []
+    for i in range(LINK_COUNT):
+        n = i % DISTINCT_LINKS
+        links.append(f"{PREFIXES[n % len(PREFIXES)]}dir{n % 50}/file{n}.gmi")
+    return links
+
+
+def resolve_before(base: URLReference, links: list[str]) -> list[str]:
+    return [base.join(link).get_proxy_url() for link in links]
+
+
+def resolve_after(base: URLReference, links: list[str]) -> list[str]:
+    resolver = LinkResolver(base)
+    return [resolver.get_proxy_url(link) for link in links]
+
+
+RESOLVERS = {"before": resolve_before, "after": resolve_after}
+
+
+async def main() -> None:
+    app.config["SERVER_NAME"] = "portal.mozz.us"
+
+    base = URLReference("gemini://mozz.us/docs/index.gmi")
+    links = build_links()
+
+    print(f"{'resolver':>8} {'time (ms)':>10} {'links/s':>12}")
+    async with app.app_context():
+        expected = resolve_before(base, links)
+        for name, resolve in RESOLVERS.items():
+            best = float("inf")
+            for _ in range(ITERATIONS):
+                start = time.perf_counter()
+                proxy_urls = resolve(base, links)
+                best = min(best, time.perf_counter() - start)
+
+            assert proxy_urls == expected, name
+            print(f"{name:>8} {best * 1000:>10.1f} {LINK_COUNT / best:>12,.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+"""
+Measure the cost of recording Prometheus metrics on the request path, as a
+share of the time it takes to proxy a page.
+
+Pages are fetched from a spartan server running on localhost and rendered
+through the whole app. Every page has a different URL so that the response
+and render caches never hit. The recorders are counted while the pages are
+rendered, and then timed on their own, because their cost is far below
+the run-to-run noise of comparing two end-to-end runs.
+
+Each mode runs in a fresh subprocess, because prometheus_client decides
+whether to write the values to shared files when it's first imported.
+
+    single       - one worker, values kept in memory
+    multiprocess - values written to files for gunicorn workers to share
+
+Usage:
+    python -m benchmarks.metrics
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from collections import Counter
+from collections.abc import Callable
+
+from geminiportal.app import app
+from geminiportal.metrics import proxy_metrics
+from geminiportal.protocols.base import ProxyError
+from geminiportal.protocols.spartan import SpartanResponse
+
+PAGES = 1000
+
+CALLS = 100_000
+
+PORT = 3000
+
+BODY = "\n".join(
+    ["# Benchmark", ""] + [f"=> /page/{i} Link number {i}" for i in range(20)] + ["Text " * 20] * 20
+).encode()
+
+# Every recorder, with typical arguments
+RECORDERS: dict[str, tuple] = {
+    "record_response": ("spartan", "2", SpartanResponse.STATUS_CODES),
+    "record_handler": ("GeminiFlowedHandler",),
+    "record_upstream_latency": ("spartan", 0.01),
+    "record_upstream_bytes": ("spartan", len(BODY)),
+    "record_error": (ProxyError(),),
+    "record_favicon": ("hit",),
+    "connection_opened": (),
+    "connection_closed": (),
+}
+
+
+async def handle_spartan(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    request = await reader.readline()
+    if b"/favicon.txt" in request:
+        writer.write(b"4 Not found\r\n")
+    else:
+        writer.write(b"2 text/gemini\r\n" + BODY)
+    await writer.drain()
+    writer.close()
+
+
+def count_calls(counts: Counter[str], name: str) -> Callable:
+    recorder = getattr(proxy_metrics, name)
+
+    def wrapper(*args, **kwargs):
+        counts[name] += 1
+        return recorder(*args, **kwargs)
+
+    return wrapper
+
+
+async def measure_pages(client, offset: int) -> float:
+    start = time.perf_counter()
+    for i in range(offset, offset + PAGES):
+        response = await client.get(f"/spartan/127.0.0.1:{PORT}/page/{i}")
+        await response.get_data()
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / PAGES
+
+
+def measure_recorder(name: str) -> float:
+    recorder = getattr(proxy_metrics, name)
+    args = RECORDERS[name]
+    return min(timeit.repeat(lambda: recorder(*args), number=CALLS, repeat=5)) / CALLS
+
+
+async def run_mode() -> dict[str, float]:
+    logging.getLogger("geminiportal").setLevel(logging.WARNING)
+    app.config["SERVER_NAME"] = "portal.mozz.us"
+
+    server = await asyncio.start_server(handle_spartan, "127.0.0.1", PORT)
+    client = app.test_client()
+
+    # Warm up the connection to the server and the favicon cache
+    await measure_pages(client, -PAGES)
+
+    counts: Counter[str] = Counter()
+    for name in RECORDERS:
+        setattr(proxy_metrics, name, count_calls(counts, name))
+    page_time = await measure_pages(client, 0)
+    for name in RECORDERS:
+        delattr(proxy_metrics, name)
+
+    server.close()
+
+    recorder_time = sum(counts[name] / PAGES * measure_recorder(name) for name in RECORDERS)
+    return {
+        "page_us": page_time * 1e6,
+        "calls": sum(counts.values()) / PAGES,
+        "metrics_us": recorder_time * 1e6,
+    }
+
+
+def main() -> None:
+    print(f"{'mode':>12} {'page (us)':>10} {'calls/page':>11} {'metrics (us)':>13} {'overhead':>9}")
+    for mode in ["single", "multiprocess"]:
+        env = dict(os.environ)
+        with tempfile.TemporaryDirectory() as tempdir:
+            if mode == "multiprocess":
+                env["PROMETHEUS_MULTIPROC_DIR"] = tempdir
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.metrics", mode],
+                check=True,
+                capture_output=True,
+                text=True,
+                env=env,
+            ).stdout
+
+        result = json.loads(output)
+        overhead = result["metrics_us"] / result["page_us"] * 100
+        print(
+            f"{mode:>12} {result['page_us']:>10,.0f} {result['calls']:>11.1f} "
+            f"{result['metrics_us']:>13.2f} {overhead:>8.2f}%"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        print(json.dumps(asyncio.run(run_mode())))
+    else:
+        main()
@@ -0,0 +1,120 @@
+"""
+Compare guessing mimetypes through the patched global mimetypes database
+against the frozen MimetypeTable.
+
+Two costs are measured:
+
+    per-link   - guessing the mimetype for every link on a page with
+                 inline images turned on, 100,000 links drawn from a pool
+                 of file names with a realistic mix of extensions
+    cold start - in a fresh interpreter, the time from importing
+                 geminiportal.urls to the first guess, which includes
+                 reading the mime.types files from the system
+
+Usage:
+    python -m benchmarks.mimetype_guess
+"""
+from __future__ import annotations
+
+import mimetypes
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+
+from geminiportal.urls import CUSTOM_MIMETYPES, mimetype_table
+
+LINK_COUNT = 100_000
+
+# Distinct file names on the pages
+POOL_SIZE = 2_000
+
+ITERATIONS = 10
+
+# Fresh interpreters started for the cold start measurement
+COLD_STARTS = 20
+
+# The dependencies of geminiportal.urls are imported before the timing
+# starts, so that only the mimetype setup differs between the snippets.
+COLD_START_SETUP = "import time, mimetypes, quart, werkzeug.urls"
+
+COLD_START_BEFORE = """
+import geminiportal.urls
+for ext, mimetype in geminiportal.urls.CUSTOM_MIMETYPES.items():
+    mimetypes.add_type(mimetype, ext)
+mimetypes.guess_type("/images/photo.png", strict=False)
+"""
+
+COLD_START_AFTER = """
+import geminiportal.urls
+geminiportal.urls.mimetype_table.guess_type("/images/photo.png", strict=False)
+"""
+
+EXTENSIONS = [".gmi", "/", ".png", ".jpg", ".txt", ".gif", ".tar.gz", "", ".pdf", ".webp"]
+
+
+def build_paths() -> list[str]:
+    pool = [f"/~user{i % 7}/files/{i}{EXTENSIONS[i % len(EXTENSIONS)]}" for i in range(POOL_SIZE)]
+    return [pool[(i * 7919) % POOL_SIZE] for i in range(LINK_COUNT)]
+
+
+def guess_before(path: str) -> str | None:
+    return mimetypes.guess_type(path, strict=False)[0]
+
+
+def guess_after(path: str) -> str | None:
+    return mimetype_table.guess_type(path, strict=False)
+
+
+def measure_per_link(guess: Callable[[str], str | None], paths: list[str]) -> float:
+    best = float("inf")
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        for path in paths:
+            guess(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_cold_start(snippet: str) -> float:
+    """
+    Return the median time in milliseconds to run the snippet in a fresh
+    interpreter.
+    """
+    script = "\n".join(
+        [
+            COLD_START_SETUP,
+            "start = time.perf_counter()",
+            snippet,
+            "print(time.perf_counter() - start)",
+        ]
+    )
+    timings = []
+    for _ in range(COLD_STARTS):
+        output = subprocess.check_output([sys.executable, "-c", script], text=True)
+        timings.append(float(output))
+    return statistics.median(timings) * 1000
+
+
+def main() -> None:
+    for ext, mimetype in CUSTOM_MIMETYPES.items():
+        mimetypes.add_type(mimetype, ext)
+
+    paths = build_paths()
+    for path in set(paths):
+        assert guess_before(path) == guess_after(path), path
+
+    print(f"{'per-link':>10} {'time (ms)':>10} {'links/s':>13}")
+    for name, guess in [("before", guess_before), ("after", guess_after)]:
+        elapsed = measure_per_link(guess, paths)
+        print(f"{name:>10} {elapsed * 1000:>10.1f} {LINK_COUNT / elapsed:>13,.0f}")
+
+    print()
+    print(f"{'cold start':>10} {'time (ms)':>10}")
+    for name, snippet in [("before", COLD_START_BEFORE), ("after", COLD_START_AFTER)]:
+        print(f"{name:>10} {measure_cold_start(snippet):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare rendering the certificate page (?crt=1) with the old openssl
+subprocess against the in-process certificate describer, in pages per
+second.
+
+The upstream request is the same either way, so only the work done by the
+portal is measured: describing the certificate and rendering the page.
+
+    before - fork an "openssl x509 -text" process for every page
+    cold   - parse every certificate in-process, the cache never hits
+    cached - repeated views of the same capsule's certificate
+
+Usage:
+    python -m benchmarks.tls_cert
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import subprocess
+import time
+from collections.abc import Awaitable, Callable
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from quart import g, render_template
+
+from geminiportal.app import app
+from geminiportal.urls import URLReference
+from geminiportal.utils import TLSCertDescriptionCache
+
+PAGES = 200
+
+
+async def describe_openssl(tls_cert: bytes) -> str:
+    """
+    The certificate describer from before the cryptography package was used.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *["openssl", "x509", "-inform", "DER", "-text"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = await proc.communicate(tls_cert)
+    return stdout.decode(errors="ignore")
+
+
+def build_cert(key: rsa.RSAPrivateKey) -> bytes:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "mozz.us")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("mozz.us")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+async def render_page(describe: Callable[[bytes], Awaitable[str]], tls_cert: bytes) -> str:
+    cert_description = await describe(tls_cert)
+    return await render_template(
+        "proxy/tls-context.html",
+        cert_description=cert_description,
+        raw_cert_url=g.url.get_proxy_url(raw_crt=1),
+        tls_close_notify_received=True,
+        tls_version="TLSv1.3",
+        tls_cipher="TLS_AES_256_GCM_SHA384",
+    )
+
+
+async def measure(describe: Callable[[bytes], Awaitable[str]], certs: list[bytes]) -> float:
+    start = time.perf_counter()
+    for tls_cert in certs:
+        await render_page(describe, tls_cert)
+    return PAGES / (time.perf_counter() - start)
+
+
+async def main() -> None:
+    app.config["SERVER_NAME"] = "portal.mozz.us"
+
+    # Generating keys is slow, so the distinct certificates share a key and
+    # only differ by serial number.
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    distinct = [build_cert(key) for _ in range(PAGES)]
+    repeated = [distinct[0]] * PAGES
+
+    async with app.test_request_context("/gemini/mozz.us/?crt=1"):
+        g.url = URLReference("gemini://mozz.us/")
+
+        cold_cache = TLSCertDescriptionCache(max_size=0)
+        warm_cache = TLSCertDescriptionCache()
+        await warm_cache.describe(distinct[0])
+
+        cases = [
+            ("before", describe_openssl, distinct),
+            ("cold", cold_cache.describe, distinct),
+            ("cached", warm_cache.describe, repeated),
+        ]
+
+        print(f"{'describer':>9} {'pages/s':>10}")
+        for name, describe, certs in cases:
+            print(f"{name:>9} {await measure(describe, certs):>10,.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
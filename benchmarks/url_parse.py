@@ -0,0 +1,162 @@
+"""
+Compare parsing 100,000 URLs with the old eager, __dict__ based URL
+reference against URLReference.
+
+Three workloads are measured:
+
+    distinct  - every URL is different, so the parse cache never hits
+    repeated  - URLs drawn from a small pool, the way that the same links
+                and page URLs come up again and again across requests
+    derived   - the values that the page template asks for on every
+                request (root, parent & proxy URLs)
+
+Usage:
+    python -m benchmarks.url_parse
+"""
+from __future__ import annotations
+
+import asyncio
+import gc
+import time
+import tracemalloc
+from collections.abc import Callable
+from urllib.parse import urljoin, urlparse
+
+from geminiportal.app import app
+from geminiportal.urls import URLReference
+
+URL_COUNT = 100_000
+
+# Distinct URLs in the repeated workload
+POOL_SIZE = 2_000
+
+
+class LegacyURLReference:
+    """
+    The constructor from before URLReference used __slots__ and lazy fields.
+    """
+
+    DEFAULT_PORTS = URLReference.DEFAULT_PORTS
+
+    def __init__(self, url: str, base: str | None = None):
+        self.original = url
+        self.base = base
+        if base:
+            url = urljoin(base, url)
+
+        url_parts = urlparse(url)
+
+        self.scheme = url_parts.scheme
+        self.port = url_parts.port or self.DEFAULT_PORTS.get(self.scheme, None)
+        self.hostname = url_parts.hostname
+
+        self.path = url_parts.path
+        self.params = url_parts.params
+        self.query = url_parts.query
+        self.fragment = url_parts.fragment
+
+        if self.path == "/":
+            self.path = ""
+
+        sections = url.split("/", maxsplit=3)
+
+        self.finger_request = ""
+        if self.scheme == "finger" and len(sections) == 4:
+            self.finger_request = sections[3]
+
+        self.gopher_item_type = ""
+        self.gopher_selector = ""
+        self.gopher_search = ""
+        if self.scheme in ("gopher", "gophers"):
+            if len(sections) < 4 or sections[3] == "":
+                self.gopher_item_type = "1"
+                self.gopher_selector = ""
+            else:
+                self.gopher_item_type = sections[3][0]
+                self.gopher_selector = sections[3][1:]
+
+        if "%09" in self.gopher_selector:
+            self.gopher_selector, self.gopher_search = self.gopher_selector.split("%09", maxsplit=1)
+            self.path = self.path.split("%09", maxsplit=1)[0]
+
+
+def build_urls(count: int) -> list[str]:
+    return [
+        f"gemini://capsule{i % 100}.example.org/~user{i % 7}/gemlog/{i}.gmi" for i in range(count)
+    ]
+
+
+def measure(parse: Callable[[str], object], urls: list[str]) -> tuple[float, float]:
+    """
+    Return the parse time in seconds and the memory held by the parsed
+    objects in MB.
+    """
+    URLReference._from_cache.cache_clear()
+    gc.collect()
+
+    start = time.perf_counter()
+    [parse(url) for url in urls]
+    elapsed = time.perf_counter() - start
+
+    URLReference._from_cache.cache_clear()
+    gc.collect()
+
+    tracemalloc.start()
+    parsed = [parse(url) for url in urls]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del parsed
+    return elapsed, size / 1024 / 1024
+
+
+def derive_legacy(url: str) -> None:
+    # Every call re-parses the URL and builds new objects, the same way
+    # that inject_context() used to.
+    for _ in range(2):
+        ref = URLReference.from_resolved(url, url, None)
+        ref.get_root_proxy_url()
+        ref.get_parent_proxy_url()
+        ref.get_proxy_url(raw=1)
+
+
+def derive(url: str) -> None:
+    for _ in range(2):
+        ref = URLReference(url)
+        ref.get_root_proxy_url()
+        ref.get_parent_proxy_url()
+        ref.get_proxy_url(raw=1)
+
+
+async def main() -> None:
+    app.config["SERVER_NAME"] = "portal.mozz.us"
+
+    distinct = build_urls(URL_COUNT)
+    pool = build_urls(POOL_SIZE)
+    repeated = [pool[(i * 7919) % POOL_SIZE] for i in range(URL_COUNT)]
+
+    print(f"{'workload':>9} {'reference':>10} {'time (ms)':>10} {'URLs/s':>11} {'memory (MB)':>12}")
+    for workload, urls in [("distinct", distinct), ("repeated", repeated)]:
+        for name, parse in [("before", LegacyURLReference), ("after", URLReference)]:
+            elapsed, size = measure(parse, urls)
+            print(
+                f"{workload:>9} {name:>10} {elapsed * 1000:>10.1f} "
+                f"{len(urls) / elapsed:>11,.0f} {size:>12.1f}"
+            )
+
+    urls = repeated[:10_000]
+    async with app.app_context():
+        for name, derive_url in [("before", derive_legacy), ("after", derive)]:
+            URLReference._from_cache.cache_clear()
+            start = time.perf_counter()
+            for url in urls:
+                derive_url(url)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{'derived':>9} {name:>10} {elapsed * 1000:>10.1f} "
+                f"{len(urls) / elapsed:>11,.0f} {'':>12}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,33 +1,93 @@
+import asyncio
 import logging
-from datetime import datetime
+import time
+from collections.abc import AsyncIterator
+from datetime import datetime, timezone
+from typing import cast
 from urllib.parse import quote
 
-from quart import Quart, Response, g, render_template, request
+from prometheus_client import CONTENT_TYPE_LATEST
+from quart import (
+    Quart,
+    Response,
+    abort,
+    g,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
 from quart.logging import default_handler
+from quart.signals import before_render_template, template_rendered
 from werkzeug.wrappers.response import Response as WerkzeugResponse
 
 from geminiportal.favicons import favicon_cache
 from geminiportal.handlers import handle_proxy_response
-from geminiportal.protocols import build_proxy_request
-from geminiportal.protocols.base import ProxyError, ProxyResponseSizeError
-from geminiportal.protocols.gemini import GeminiResponse
+from geminiportal.handlers.cache import render_cache
+from geminiportal.metrics import generate_metrics, proxy_metrics
+from geminiportal.protocols import base, build_proxy_request
+from geminiportal.protocols.backoff import backoff_table
+from geminiportal.protocols.base import (
+    BaseRequest,
+    ProxyBusyError,
+    ProxyError,
+    ProxyResponseSizeError,
+    ProxyTimeoutError,
+    timeout_counts,
+)
+from geminiportal.protocols.breaker import circuit_breaker
+from geminiportal.protocols.cache import response_cache
+from geminiportal.protocols.coalesce import request_coalescer
+from geminiportal.protocols.connect import connection_racer
+from geminiportal.protocols.dns import resolver
+from geminiportal.protocols.gemini import GeminiRequest, GeminiResponse
+from geminiportal.protocols.scheduler import upstream_scheduler
+from geminiportal.protocols.tls import tls_session_cache
+from geminiportal.protocols.tlsinfo import tls_info_store
+from geminiportal.timings import ClosingResponseBody
 from geminiportal.urls import URLReference
-from geminiportal.utils import describe_tls_cert
+from geminiportal.utils import describe_tls_cert, tls_cert_cache
 
 logger = logging.getLogger("geminiportal")
 logger.setLevel(logging.INFO)
 logger.addHandler(default_handler)
 
+# One line per proxied request, with the time spent in each phase
+access_logger = logging.getLogger("geminiportal.access")
+
+# Placeholder in the page template that early flush mode splits the page on
+FLUSH_MARKER = "<!-- flush -->"
+
 app = Quart(__name__)
 app.config.from_prefixed_env()
 
+# Upstream timeouts can be tuned from the environment, e.g. QUART_READ_TIMEOUT=10
+for key in ("CONNECT_TIMEOUT", "HEADER_TIMEOUT", "READ_TIMEOUT", "RESPONSE_TIMEOUT"):
+    if key in app.config:
+        setattr(base, key, app.config[key])
+
 
 @app.errorhandler(ProxyResponseSizeError)
 async def handle_proxy_size_error(e):
+    proxy_metrics.record_error(e)
     content = await render_template("proxy/errors/size-limit.html", error=e)
     return Response(content, status=500)
 
 
+@app.errorhandler(ProxyTimeoutError)
+async def handle_proxy_timeout_error(e):
+    proxy_metrics.record_error(e)
+    content = await render_template("proxy/errors/timeout.html", error=e)
+    return Response(content, status=504)
+
+
+@app.errorhandler(ProxyBusyError)
+async def handle_proxy_busy_error(e):
+    proxy_metrics.record_error(e)
+    content = await render_template("proxy/errors/busy.html", error=e)
+    return Response(content, status=503, headers={"Retry-After": str(round(e.retry_after))})
+
+
 @app.errorhandler(ValueError)
 async def handle_value_error(e) -> Response:
     content = await render_template("proxy/errors/gateway.html", error=e)
@@ -36,6 +96,7 @@ async def handle_value_error(e) -> Response:
 
 @app.errorhandler(ProxyError)
 async def handle_proxy_error(e):
+    proxy_metrics.record_error(e)
     content = await render_template("proxy/errors/gateway.html", error=e)
     return Response(content, status=500)
 
@@ -43,6 +104,8 @@ async def handle_proxy_error(e):
 @app.context_processor
 def inject_context():
     kwargs = {}
+    if g.get("early_flush"):
+        kwargs["flush_marker"] = render_flush_marker
     if "response" in g:
         kwargs["response"] = g.response
         kwargs["status"] = g.response.status_string
@@ -60,6 +123,75 @@ def inject_context():
     return kwargs
 
 
+def render_flush_marker() -> str:
+    # Only pages that include the marker can be spliced onto the streamed head
+    g.flush_marker_rendered = True
+    return FLUSH_MARKER
+
+
+@app.template_filter("datetime")
+def format_datetime(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def start_template_timer(sender, template, context) -> None:
+    g.template_start = time.perf_counter()
+
+
+def stop_template_timer(sender, template, context) -> None:
+    if "timings" in g and "template_start" in g:
+        g.timings.add("template", time.perf_counter() - g.pop("template_start"))
+
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(stop_template_timer, app)
+
+
+@app.after_request
+async def add_server_timing(response: Response) -> Response:
+    """
+    Report where the time went for proxied requests.
+
+    The header is sent before a streamed body, so it only covers the phases
+    up to that point. The access log line is written once the body has
+    been sent and includes every phase.
+    """
+    if "timings" not in g:
+        return response
+
+    timings = g.timings
+    response.headers["Server-Timing"] = timings.get_server_timing()
+
+    fields = {
+        "method": request.method,
+        "url": g.url.get_url(),
+        "status": str(response.status_code),
+        "upstream_status": g.response.status if "response" in g else "-",
+    }
+
+    def log_access() -> None:
+        fields.update(timings.get_log_fields())
+        access_logger.info(" ".join(f"{key}={value or '-'}" for key, value in fields.items()))
+
+    response.response = ClosingResponseBody(response.response, log_access)
+    return response
+
+
+@app.before_serving
+async def startup() -> None:
+    proxy_metrics.start()
+
+
+@app.after_serving
+async def shutdown() -> None:
+    proxy_metrics.shutdown()
+
+    # Let favicon fetches finish and save them before the worker exits
+    await favicon_cache.shutdown()
+    await tls_info_store.shutdown()
+    await backoff_table.shutdown()
+
+
 @app.route("/robots.txt")
 async def robots() -> Response:
     return await app.send_static_file("robots.txt")
@@ -78,6 +210,45 @@ async def changes() -> Response:
     return Response(content)
 
 
+@app.route("/stats")
+async def stats() -> Response:
+    """
+    Internal counters for tuning the proxy, disabled unless configured.
+    """
+    if not app.config.get("STATS_ENABLED"):
+        abort(404)
+
+    return jsonify(
+        {
+            "response_cache": response_cache.get_stats(),
+            "render_cache": render_cache.get_stats(),
+            "backoff": backoff_table.get_stats(),
+            "favicons": favicon_cache.get_stats(),
+            "request_coalescer": request_coalescer.get_stats(),
+            "tls_sessions": tls_session_cache.get_stats(),
+            "tls_certs": tls_cert_cache.get_stats(),
+            "tls_info": tls_info_store.get_stats(),
+            "dns": resolver.get_stats(),
+            "connections": connection_racer.get_stats(),
+            "circuit_breaker": circuit_breaker.get_stats(),
+            "scheduler": upstream_scheduler.get_stats(),
+            "timeouts": timeout_counts,
+        }
+    )
+
+
+@app.route("/metrics")
+async def metrics() -> Response:
+    """
+    Prometheus metrics, combined across every worker, disabled unless configured.
+    """
+    if not app.config.get("METRICS_ENABLED"):
+        abort(404)
+
+    content = await asyncio.to_thread(generate_metrics)
+    return Response(content, content_type=CONTENT_TYPE_LATEST)
+
+
 @app.route("/")
 async def home() -> Response | WerkzeugResponse:
     address = request.args.get("url")
@@ -109,27 +280,58 @@ async def proxy(
     query = request.args.get("q")
     if query:
         # Query was provided via the input box, redirect to the canonical endpoint
-        g.url.query = quote(query)
+        g.url = g.url.replace(query=quote(query))
         proxy_url = g.url.get_proxy_url(external=False)
         return app.redirect(proxy_url)
 
-    proxy_request = build_proxy_request(g.url)
+    proxy_request = build_proxy_request(g.url, request.remote_addr)
+    g.timings = proxy_request.timings
+
+    if app.config.get("EARLY_FLUSH") and not (
+        request.args.get("raw") or request.args.get("raw_crt") or request.args.get("crt")
+    ):
+        return await stream_proxy_response(proxy_request)
+
+    return await render_proxy_response(proxy_request)
+
+
+async def render_proxy_response(proxy_request: BaseRequest) -> Response | WerkzeugResponse:
+    """
+    Make the request to the upstream server and render the response.
+    """
+    if isinstance(proxy_request, GeminiRequest) and (
+        request.args.get("crt") or request.args.get("raw_crt")
+    ):
+        # The certificate was seen recently, so don't bother the server again
+        tls_info = await tls_info_store.get_fresh(proxy_request.host, proxy_request.port)
+        if tls_info is not None:
+            if "favicon" not in g:
+                g.favicon = await favicon_cache.check(g.url)
+
+            if request.args.get("raw_crt"):
+                return download_tls_cert(tls_info.cert)
+
+            return await render_tls_context(
+                proxy_request,
+                tls_cert=tls_info.cert,
+                tls_version=tls_info.version,
+                tls_cipher=tls_info.cipher,
+                tls_close_notify_received=bool(tls_info.close_notify),
+            )
+
     response = await proxy_request.get_response()
     g.response = response
+    proxy_metrics.record_response(proxy_request.url.scheme, response.status, response.STATUS_CODES)
 
-    g.favicon = favicon_cache.check(g.url)
+    if "favicon" not in g:
+        g.favicon = await favicon_cache.check(g.url)
 
     if request.args.get("raw_crt"):
         if not isinstance(response, GeminiResponse):
             raise ValueError("Cannot download certificate for non-TLS schemes")
 
-        return Response(
-            response.tls_cert,
-            content_type="application/x-x509-ca-cert",
-            headers={
-                "Content-Disposition": f"attachment; filename={request.host}.cer",
-            },
-        )
+        response.close()
+        return download_tls_cert(response.tls_cert)
 
     if request.args.get("crt"):
         if not hasattr(response, "tls_cert"):
@@ -138,17 +340,17 @@ async def proxy(
         # Consume the request, so we can check for the close_notify signal
         await response.get_body()
 
-        cert_description = await describe_tls_cert(response.tls_cert)
-
-        content = await render_template(
-            "proxy/tls-context.html",
-            cert_description=cert_description,
-            raw_cert_url=g.url.get_proxy_url(raw_crt=1),
-            tls_close_notify_received=response.tls_close_notify_received,
+        return await render_tls_context(
+            proxy_request,
+            tls_cert=response.tls_cert,
             tls_version=response.tls_version,
             tls_cipher=response.tls_cipher,
+            tls_close_notify_received=response.tls_close_notify_received,
         )
-        return Response(content)
+
+    if not response.is_success():
+        # The body will not be read, release the upstream connection
+        response.close()
 
     if response.is_input():
         is_secret = response.status == "11"
@@ -170,6 +372,101 @@ async def proxy(
     return Response(content)
 
 
+def download_tls_cert(tls_cert: bytes | None) -> Response:
+    return Response(
+        tls_cert,
+        content_type="application/x-x509-ca-cert",
+        headers={
+            "Content-Disposition": f"attachment; filename={request.host}.cer",
+        },
+    )
+
+
+async def render_tls_context(
+    proxy_request: BaseRequest,
+    tls_cert: bytes | None,
+    tls_version: str,
+    tls_cipher: str,
+    tls_close_notify_received: bool,
+) -> Response:
+    cert_description = await describe_tls_cert(tls_cert)
+    cert_history = await tls_info_store.get_history(proxy_request.host, proxy_request.port)
+
+    content = await render_template(
+        "proxy/tls-context.html",
+        cert_description=cert_description,
+        cert_history=cert_history,
+        raw_cert_url=g.url.get_proxy_url(raw_crt=1),
+        tls_close_notify_received=tls_close_notify_received,
+        tls_version=tls_version,
+        tls_cipher=tls_cipher,
+    )
+    return Response(content)
+
+
+async def stream_proxy_response(proxy_request: BaseRequest) -> Response:
+    """
+    Send the top of the page immediately, before the upstream server has
+    responded, and stream the rest of the page once the response arrives.
+
+    The HTTP status is committed to 200 before the response is known, so
+    redirects and anything other than a rendered page (e.g. raw HTML or
+    binary files from the upstream server) are followed with a meta refresh.
+    """
+    g.early_flush = True
+    g.favicon = await favicon_cache.check(g.url)
+
+    page = await render_template("proxy/base.html")
+    head, _, _ = page.partition(FLUSH_MARKER)
+
+    url, favicon, timings = g.url, g.favicon, g.timings
+
+    @stream_with_context
+    async def generate() -> AsyncIterator[bytes]:
+        # The streamed context starts with fresh globals
+        g.url, g.favicon, g.early_flush, g.timings = url, favicon, True, timings
+        g.flush_marker_rendered = False
+
+        yield head.encode()
+
+        try:
+            result = await render_proxy_response(proxy_request)
+        except Exception as e:
+            result = await app.make_response(await app.handle_user_exception(e))
+
+        # Redirects are created with app.response_class, despite the annotation
+        response = cast(Response, result)
+
+        if 300 <= response.status_code < 400:
+            location = response.headers["Location"]
+        elif not g.flush_marker_rendered:
+            location = g.url.get_proxy_url(raw=1)
+        else:
+            location = None
+
+        if location is not None:
+            # Release the upstream connection without reading the body
+            async with response.response:
+                pass
+            content = await render_template("proxy/redirect.html", location=location)
+            response = Response(content)
+
+        # Skip over the part of the page that was already sent
+        pending = b""
+        skipped = False
+        async for data in response.iter_encode():
+            if not skipped:
+                pending += data
+                _, marker, data = pending.partition(FLUSH_MARKER.encode())
+                if not marker:
+                    continue
+                skipped = True
+            yield data
+
+    headers = {"Link": "</static/site.css>; rel=preload; as=style"}
+    return Response(generate(), headers=headers)
+
+
 if __name__ == "__main__":
     app.config["DEBUG"] = True
     app.config["SERVER_NAME"] = None
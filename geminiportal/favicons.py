@@ -1,11 +1,17 @@
+from __future__ import annotations
+
 import asyncio
 import logging
 import os
-import shelve
+import sqlite3
 import tempfile
 import time
-from typing import cast
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass
 
+from geminiportal.metrics import proxy_metrics
 from geminiportal.protocols import build_proxy_request
 from geminiportal.protocols.base import ProxyError
 from geminiportal.urls import URLReference
@@ -13,58 +19,353 @@ from geminiportal.urls import URLReference
 _logger = logging.getLogger(__name__)
 
 
-DB_NAME = os.path.join(tempfile.gettempdir(), "gemini-portal-favicon-db")
+# The database is stored on the filesystem so that it's shared by every worker
+DB_NAME = os.path.join(tempfile.gettempdir(), "gemini-portal-favicons.sqlite3")
+
+# Maximum number of favicons to keep in memory
+FAVICON_CACHE_SIZE = 4096
+
+# Seconds to wait before writing new favicons to the database, so that
+# they're saved in batches instead of one transaction per capsule.
+FAVICON_FLUSH_INTERVAL = 1.0
+
+# Seconds to remember that a capsule doesn't have a favicon
+FAVICON_NEGATIVE_TTL = 60 * 30
+
+# Seconds that an expired favicon is still shown while it's being refreshed
+FAVICON_STALE_TTL = 60 * 60
+
+# Favicons that have been shown this many times are refreshed ahead of time
+FAVICON_POPULAR_HITS = 10
+
+# Seconds before a popular favicon expires that it's refreshed
+FAVICON_REFRESH_WINDOW = 60 * 15
+
+# Maximum number of favicons that are fetched at the same time, so that
+# they never take up a significant share of the upstream connections.
+FAVICON_MAX_FETCHES = 4
+
+# Seconds that a worker may hold the lease to fetch a favicon, before
+# another worker is allowed to try.
+FAVICON_LEASE_TIME = 60
+
+# Seconds between checking the database while another worker is fetching
+FAVICON_LEASE_POLL_INTERVAL = 2.0
+
+# Seconds to let pending fetches finish when the server is shutting down
+FAVICON_SHUTDOWN_TIMEOUT = 5.0
+
+
+@dataclass
+class FaviconEntry:
+    favicon: str | None
+    expires: float
+    hits: int = 0
+
+
+class FaviconStore:
+    """
+    Persistent favicon storage in a SQLite database, shared by every worker.
+
+    The database uses write-ahead logging so that readers in one worker
+    aren't blocked by another worker's writes. All of the methods do
+    blocking file I/O and should be called from a thread.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.initialized = False
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_name, timeout=5)
+        if not self.initialized:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS favicons "
+                "(url TEXT PRIMARY KEY, favicon TEXT, expires REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS favicon_leases "
+                "(url TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+            )
+            self.initialized = True
+        return db
+
+    def load(self, key: str) -> FaviconEntry | None:
+        with closing(self.connect()) as db:
+            row = db.execute(
+                "SELECT favicon, expires FROM favicons WHERE url = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return FaviconEntry(*row)
+
+    def save(self, entries: dict[str, FaviconEntry], owner: str) -> None:
+        """
+        Write a batch of entries in a single transaction, and release the
+        leases that were held to fetch them.
+
+        Another worker may have fetched the same favicon in the meantime,
+        so existing rows are only replaced by entries that expire later.
+        """
+        with closing(self.connect()) as db, db:
+            db.executemany(
+                "INSERT INTO favicons VALUES (?, ?, ?) ON CONFLICT (url) DO UPDATE "
+                "SET favicon = excluded.favicon, expires = excluded.expires "
+                "WHERE excluded.expires > expires",
+                [(key, entry.favicon, entry.expires) for key, entry in entries.items()],
+            )
+            db.executemany(
+                "DELETE FROM favicon_leases WHERE url = ? AND owner = ?",
+                [(key, owner) for key in entries],
+            )
+
+    def acquire_lease(self, key: str, owner: str, duration: float) -> bool:
+        """
+        Claim the right to fetch a favicon, unless another worker holds an
+        unexpired lease for it.
+        """
+        now = time.time()
+        with closing(self.connect()) as db, db:
+            cursor = db.execute(
+                "INSERT INTO favicon_leases VALUES (?, ?, ?) ON CONFLICT (url) DO UPDATE "
+                "SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE expires <= ? OR owner = excluded.owner",
+                (key, owner, now + duration, now),
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, key: str, owner: str) -> None:
+        with closing(self.connect()) as db, db:
+            db.execute("DELETE FROM favicon_leases WHERE url = ? AND owner = ?", (key, owner))
 
 
 class FaviconCache:
     """
-    Download favicon.txt files from sites in the background, and
-    stash the results in a temporary directory on the filesystem
-    using the shelve module.
+    Download favicon.txt files from sites in the background.
+
+    Favicons are kept in an in-memory LRU cache in front of a SQLite
+    database that's shared between workers. Checking a favicon that's in
+    memory never touches the disk, the database is only read for capsules
+    that this worker hasn't seen recently, and new favicons are written
+    back to it in batches. The database is always accessed from a thread
+    so that it doesn't block the event loop.
+
+    Workers take a lease in the database before fetching a favicon, so a
+    capsule only gets one request no matter how many workers want it.
+    Expired favicons keep being shown while they're refreshed, and popular
+    ones are refreshed shortly before they expire.
     """
 
     FAVICON_PATH = "/favicon.txt"
     EXPIRATION = 60 * 60 * 4
 
-    def __init__(self, db_name: str):
-        self.db_name = db_name
+    def __init__(
+        self,
+        db_name: str,
+        max_size: int = FAVICON_CACHE_SIZE,
+        flush_interval: float = FAVICON_FLUSH_INTERVAL,
+        negative_ttl: int = FAVICON_NEGATIVE_TTL,
+        stale_ttl: int = FAVICON_STALE_TTL,
+        max_fetches: int = FAVICON_MAX_FETCHES,
+        lease_time: float = FAVICON_LEASE_TIME,
+        lease_poll_interval: float = FAVICON_LEASE_POLL_INTERVAL,
+    ):
+        self.store = FaviconStore(db_name)
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.lease_time = lease_time
+        self.lease_poll_interval = lease_poll_interval
+
+        # Identifies this worker's leases in the shared database
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+        self.entries: OrderedDict[str, FaviconEntry] = OrderedDict()
 
         # References to coroutines that are currently fetching favicons
         self.tasks: dict[str, asyncio.Task] = {}
+        self.fetch_limit = asyncio.Semaphore(max_fetches)
+
+        # Favicons that are waiting to be written to the database
+        self.pending: dict[str, FaviconEntry] = {}
+        self.flush_task: asyncio.Task | None = None
 
-    def check(self, url: URLReference) -> str | None:
+        self.hits = 0
+        self.stale_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.fetches = 0
+        self.lease_waits = 0
+        self.writes = 0
+        self.errors = 0
+
+    async def check(self, url: URLReference) -> str | None:
         favicon_url = url.join(self.FAVICON_PATH)
         key = favicon_url.get_url()
-        with shelve.open(self.db_name) as db:
-            if key in db:
-                ttl, value = cast(tuple[float, str], db[key])
-                if time.time() < ttl:
-                    return value
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if (entry is None or now >= entry.expires) and key not in self.tasks:
+            # Another worker might have already downloaded it
+            entry = await self.load(key) or entry
+
+        if entry is None or now >= entry.expires + self.stale_ttl:
+            self.misses += 1
+            proxy_metrics.record_favicon("miss")
+            self.refresh(favicon_url)
+            return None
+
+        self.entries.move_to_end(key)
+        entry.hits += 1
+        if now >= entry.expires:
+            self.stale_hits += 1
+            proxy_metrics.record_favicon("stale")
+            self.refresh(favicon_url)
+        else:
+            self.hits += 1
+            proxy_metrics.record_favicon("hit")
+            if entry.hits >= FAVICON_POPULAR_HITS and now >= entry.expires - FAVICON_REFRESH_WINDOW:
+                self.refresh(favicon_url)
 
-        # Schedule a background task to download and save the favicon
+        return entry.favicon
+
+    def refresh(self, favicon_url: URLReference) -> None:
+        """
+        Schedule a background task to download and save the favicon.
+        """
         # Only make one request per-domain at a time to avoid spamming
+        key = favicon_url.get_url()
         if key not in self.tasks:
+            self.refreshes += 1
             self.tasks[key] = asyncio.create_task(self._update(favicon_url))
             self.tasks[key].add_done_callback(lambda *_: self.tasks.pop(key))
 
-        return None
+    async def load(self, key: str) -> FaviconEntry | None:
+        """
+        Load a favicon from the database into the memory cache.
+        """
+        try:
+            entry = await asyncio.to_thread(self.store.load, key)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to load favicon: {e}")
+            self.errors += 1
+            return None
 
-    def shutdown(self) -> None:
-        for _, task in self.tasks.items():
-            task.cancel()
+        if entry is not None:
+            self.db_hits += 1
+            self.remember(key, entry)
+        return entry
+
+    def remember(self, key: str, entry: FaviconEntry) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def shutdown(self, timeout: float = FAVICON_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Give the fetches in progress a chance to finish, and save everything
+        that hasn't been written to the database yet.
+        """
+        tasks = list(self.tasks.values())
+        if tasks:
+            _, not_done = await asyncio.wait(tasks, timeout=timeout)
+            for task in not_done:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.flush_task:
+            self.flush_task.cancel()
+        await self.flush()
 
     async def _update(self, favicon_url: URLReference) -> None:
-        favicon = None
+        key = favicon_url.get_url()
+
+        try:
+            leased = await asyncio.to_thread(
+                self.store.acquire_lease, key, self.owner, self.lease_time
+            )
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to acquire favicon lease: {e}")
+            self.errors += 1
+            leased = True
+
+        if not leased:
+            self.lease_waits += 1
+            await self._wait_for_lease(key)
+            return
+
+        saved = False
         try:
-            favicon = await self._fetch_favicon(favicon_url)
-        except ProxyError:
-            _logger.warning("Error fetching favicon")
+            favicon = None
+            async with self.fetch_limit:
+                self.fetches += 1
+                try:
+                    favicon = await self._fetch_favicon(favicon_url)
+                except ProxyError:
+                    _logger.warning("Error fetching favicon")
 
-        _logger.info(f"Favicon for {favicon_url}: {favicon}")
-        with shelve.open(self.db_name) as db:
-            key = favicon_url.get_url()
-            ttl = time.time() + self.EXPIRATION
-            db[key] = ttl, favicon
+            _logger.info(f"Favicon for {favicon_url}: {favicon}")
+            ttl = self.EXPIRATION if favicon else self.negative_ttl
+            entry = FaviconEntry(favicon, time.time() + ttl)
+            self.remember(key, entry)
+
+            # The lease is released when the entry is written
+            self.pending[key] = entry
+            saved = True
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush_later())
+        finally:
+            if not saved:
+                await self._release_lease(key)
+
+    async def _wait_for_lease(self, key: str) -> None:
+        """
+        Wait for the worker that holds the lease to save the favicon.
+        """
+        entry = self.entries.get(key)
+        expires = entry.expires if entry else 0.0
+
+        deadline = time.monotonic() + self.lease_time
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.lease_poll_interval)
+            entry = await self.load(key)
+            if entry is not None and entry.expires > expires:
+                return
+
+    async def _release_lease(self, key: str) -> None:
+        try:
+            await asyncio.to_thread(self.store.release_lease, key, self.owner)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to release favicon lease: {e}")
+            self.errors += 1
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write all of the pending favicons to the database.
+        """
+        if not self.pending:
+            return
+
+        entries, self.pending = self.pending, {}
+        try:
+            await asyncio.to_thread(self.store.save, entries, self.owner)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to save favicons: {e}")
+            self.errors += 1
+        else:
+            self.writes += len(entries)
 
     async def _fetch_favicon(self, favicon_url: URLReference) -> str | None:
         request = build_proxy_request(favicon_url)
@@ -78,5 +379,21 @@ class FaviconCache:
 
         return None
 
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "fetches": self.fetches,
+            "active_fetches": len(self.tasks),
+            "lease_waits": self.lease_waits,
+            "pending_writes": len(self.pending),
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
 
 favicon_cache = FaviconCache(DB_NAME)
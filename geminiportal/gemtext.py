@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+
+RABBIT_INLINE = ":rаbbiΤ:"
+RABBIT_STANDALONE = ";rаbbiΤ;"
+RABBIT_ART = r"""
+          /|
+    /\   //
+   |/\'-'/ .::.
+     /^Y^\::''.
+     \_ /=| `'
+    /`_)=( \
+    \ /=/'-/
+   {/ |/  \
+  __\  _  /__
+ '----' '----'
+"""
+
+
+class Line:
+    """
+    A single line of a gemtext document.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.text!r})"
+
+    def __eq__(self, other) -> bool:
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields())
+
+    @classmethod
+    def _fields(cls) -> list[str]:
+        return [name for klass in cls.__mro__ for name in getattr(klass, "__slots__", ())]
+
+
+class TextLine(Line):
+    __slots__ = ()
+
+
+class LinkLine(Line):
+    """
+    A "=> URL [label]" line, the text is the label or the URL if it's missing.
+    """
+
+    __slots__ = ("url",)
+
+    def __init__(self, url: str, text: str):
+        super().__init__(text)
+        self.url = url
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.url!r}, {self.text!r})"
+
+
+class PromptLine(LinkLine):
+    """
+    A "=: URL [label]" input prompt line.
+    """
+
+    __slots__ = ()
+
+
+class HeadingLine(Line):
+    __slots__ = ("level",)
+
+    def __init__(self, level: int, text: str):
+        super().__init__(text)
+        self.level = level
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.level!r}, {self.text!r})"
+
+
+class ListItemLine(Line):
+    __slots__ = ()
+
+
+class QuoteLine(Line):
+    __slots__ = ()
+
+
+class PreformatToggleLine(Line):
+    """
+    A "```" line, the text is the alt text that follows the backticks.
+    """
+
+    __slots__ = ()
+
+
+class PreformattedLine(Line):
+    __slots__ = ()
+
+
+class RabbitLine(Line):
+    __slots__ = ()
+
+
+def parse_link(text: str) -> tuple[str, str]:
+    """
+    Split the part of a link line after the "=>" into the URL and label.
+    """
+    parts = text.split(maxsplit=1)
+    if len(parts) == 0:
+        return "", ""
+    elif len(parts) == 1:
+        return parts[0], parts[0]
+    else:
+        return parts[0], parts[1]
+
+
+def parse_fixed_line(line: str) -> Line:
+    """
+    Parse a line for the fixed-width view, where only links are recognized.
+    """
+    line = line.rstrip()
+    if line[:2] == "=>":
+        return LinkLine(*parse_link(line[2:]))
+    return TextLine(line)
+
+
+class GemtextParser:
+    """
+    Parse gemtext into a list of lines in a single pass.
+
+    The type of each line is decided by looking up its first character, so
+    plain text lines (the vast majority in most documents) never go through
+    a chain of prefix comparisons.
+
+    Lines can also be fed one at a time while a document is being
+    streamed, the parser only needs to remember whether it's inside of a
+    preformatted block.
+    """
+
+    def __init__(self):
+        self.preformat = False
+
+    def parse(self, text: str) -> list[Line]:
+        parse_line = self.parse_line
+        return [parse_line(line) for line in text.splitlines()]
+
+    def parse_line(self, line: str) -> Line:
+        line = line.rstrip()
+        if RABBIT_INLINE in line:
+            line = line.replace(RABBIT_INLINE, "🐇")
+
+        if self.preformat:
+            if line[:3] == "```":
+                self.preformat = False
+                return PreformatToggleLine(line[3:])
+            elif line == RABBIT_STANDALONE:
+                return PreformattedLine(RABBIT_ART)
+            return PreformattedLine(line)
+
+        parse = self._dispatch.get(line[:1])
+        if parse is None:
+            return TextLine(line)
+        return parse(self, line)
+
+    def _parse_backtick(self, line: str) -> Line:
+        if line[:3] == "```":
+            self.preformat = True
+            return PreformatToggleLine(line[3:])
+        return TextLine(line)
+
+    def _parse_equals(self, line: str) -> Line:
+        prefix = line[1:2]
+        if prefix == ">":
+            return LinkLine(*parse_link(line[2:]))
+        elif prefix == ":":
+            return PromptLine(*parse_link(line[2:]))
+        return TextLine(line)
+
+    def _parse_heading(self, line: str) -> Line:
+        if line[:3] == "###":
+            return HeadingLine(3, line[3:].lstrip())
+        elif line[:2] == "##":
+            return HeadingLine(2, line[2:].lstrip())
+        return HeadingLine(1, line[1:].lstrip())
+
+    def _parse_asterisk(self, line: str) -> Line:
+        if line[1:2] == " ":
+            return ListItemLine(line[1:].lstrip())
+        return TextLine(line)
+
+    def _parse_quote(self, line: str) -> Line:
+        return QuoteLine(line[1:])
+
+    def _parse_semicolon(self, line: str) -> Line:
+        if line == RABBIT_STANDALONE:
+            return RabbitLine("")
+        return TextLine(line)
+
+    _dispatch: dict[str, Callable[[GemtextParser, str], Line]] = {
+        "`": _parse_backtick,
+        "=": _parse_equals,
+        "#": _parse_heading,
+        "*": _parse_asterisk,
+        ">": _parse_quote,
+        ";": _parse_semicolon,
+    }
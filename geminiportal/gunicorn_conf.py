@@ -0,0 +1,29 @@
+"""
+Settings for running the portal with several gunicorn workers, see
+tools/gunicorn.
+"""
+import glob
+import os
+import tempfile
+
+# Workers share their metrics through files in this directory. It has to be
+# set before prometheus_client is imported, which is why it's set here and
+# not in the app.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "gemini-portal-metrics")
+)
+
+
+def on_starting(server):
+    # Start from zero instead of adding to the counts from the last run
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for filename in glob.glob(os.path.join(path, "*.db")):
+        os.remove(filename)
+
+
+def child_exit(server, worker):
+    # Imported here so that the multiprocess directory is set first
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -9,6 +9,7 @@ from geminiportal.handlers.gemini import (
 )
 from geminiportal.handlers.image import ImageHandler
 from geminiportal.handlers.text import TextHandler
+from geminiportal.metrics import proxy_metrics
 from geminiportal.protocols.base import BaseResponse
 
 
@@ -41,5 +42,7 @@ async def handle_proxy_response(
     else:
         handler_class = StreamHandler
 
+    proxy_metrics.record_handler(handler_class.__name__)
     handler = await handler_class.from_response(response)
-    return await handler.render()
+    with response.request.timings.measure("handler"):
+        return await handler.render()
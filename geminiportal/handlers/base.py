@@ -1,11 +1,22 @@
 from __future__ import annotations
 
+import codecs
+import hashlib
 import re
+import time
 from collections.abc import AsyncIterator
 
-from quart import Response, render_template
+from quart import (
+    Response,
+    has_request_context,
+    render_template,
+    request,
+    stream_with_context,
+)
 
+from geminiportal.handlers.cache import RenderKey, render_cache
 from geminiportal.protocols.base import BaseResponse
+from geminiportal.timings import RequestTimings
 from geminiportal.urls import URLReference
 
 # Strip ANSI color characters from text responses
@@ -20,6 +31,57 @@ ANSI_ESCAPE = re.compile(
     re.VERBOSE,
 )
 
+# An escape sequence at the end of a chunk that may be finished by the next one
+ANSI_ESCAPE_PARTIAL = re.compile(r"\x1B(?:[@-_][0-?]*[ -/]*)?")
+
+# Placeholder that the page template is split on when streaming the body
+BODY_MARKER = "<!-- body -->"
+
+# When streaming, lines longer than this are broken up to keep memory bounded
+MAX_LINE_LENGTH = 2**16
+
+
+def get_url_root() -> str:
+    """
+    Return the root of the proxy links in the rendered HTML.
+
+    Without SERVER_NAME, links are built from the Host header of the
+    request, so the same body renders differently for each host.
+    """
+    if has_request_context():
+        return request.url_root
+    return ""
+
+
+class ANSIStripper:
+    """
+    Strip ANSI escape sequences from a stream of text, including sequences
+    that have been split across two chunks.
+    """
+
+    # Give up on holding back a sequence that never ends
+    MAX_PENDING = 256
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, text: str) -> str:
+        text = self.pending + text
+        self.pending = ""
+
+        # An escape sequence can't contain another ESC, so only the last one
+        # can be incomplete.
+        index = text.rfind("\x1b")
+        if index != -1 and len(text) - index <= self.MAX_PENDING:
+            if ANSI_ESCAPE_PARTIAL.fullmatch(text, index):
+                text, self.pending = text[:index], text[index:]
+
+        return ANSI_ESCAPE.sub("", text)
+
+    def flush(self) -> str:
+        text, self.pending = self.pending, ""
+        return text
+
 
 class BaseHandler:
     """
@@ -96,11 +158,13 @@ class TemplateHandler(BaseHandler):
         content: bytes,
         mimetype: str,
         charset: str | None = None,
+        timings: RequestTimings | None = None,
     ):
         self.url = url
         self.content = content
         self.mimetype = mimetype
         self.charset = charset
+        self.timings = timings or RequestTimings()
 
         self._text = None
 
@@ -113,8 +177,9 @@ class TemplateHandler(BaseHandler):
             raise RuntimeError("Cannot access text attribute without a defined charset")
 
         if self._text is None:
-            self._text = self.content.decode(encoding=self.charset, errors="replace")
-            self._text = ANSI_ESCAPE.sub("", self._text)
+            with self.timings.measure("decode"):
+                self._text = self.content.decode(encoding=self.charset, errors="replace")
+                self._text = ANSI_ESCAPE.sub("", self._text)
 
         return self._text
 
@@ -125,12 +190,42 @@ class TemplateHandler(BaseHandler):
 
     async def get_context(self) -> dict:
         context = {}
-        context["body"] = await self.get_body()
+        context["body"] = await self.get_cached_body()
         return context
 
+    async def get_cached_body(self) -> str:
+        """
+        Render the body, re-using the HTML from an identical response if
+        it's available in the render cache.
+        """
+        key = self.get_render_key(hashlib.sha256(self.content).digest())
+        body = render_cache.get(key)
+        if body is None:
+            start = time.perf_counter()
+            body = await self.get_body()
+            render_cache.store(key, body, time.perf_counter() - start)
+        return body
+
     async def get_body(self) -> str:
         raise NotImplementedError
 
+    def get_render_options(self) -> tuple:
+        """
+        Return any handler settings that change the HTML for the same body.
+        """
+        return ()
+
+    def get_render_key(self, digest: bytes) -> RenderKey:
+        return (
+            digest,
+            self.__class__.__name__,
+            self.get_render_options(),
+            self.url.get_url(),
+            self.mimetype,
+            self.charset,
+            get_url_root(),
+        )
+
     @classmethod
     async def from_response(cls, response: BaseResponse) -> TemplateHandler:
         return cls(
@@ -138,4 +233,186 @@ class TemplateHandler(BaseHandler):
             await response.get_body(),
             response.mimetype,
             response.charset,
+            timings=response.request.timings,
+        )
+
+
+class StreamingTemplateHandler(TemplateHandler):
+    """
+    Render the proxied response as HTML while it's still being downloaded,
+    sending each section of the page to the browser as soon as it's ready.
+
+    The handler can also be built from a complete body, in which case it
+    renders the same as a regular template handler.
+
+    The streamed body is hashed as it's read so that the rendered HTML can
+    be saved to the render cache. If the hash of the body is known before
+    it's read (i.e. for a response replayed from the response cache), the
+    cached HTML is sent without rendering anything.
+    """
+
+    def __init__(
+        self,
+        url: URLReference,
+        content: bytes,
+        mimetype: str,
+        charset: str | None = None,
+        content_iter: AsyncIterator[bytes] | None = None,
+        content_digest: bytes | None = None,
+        timings: RequestTimings | None = None,
+    ):
+        super().__init__(url, content, mimetype, charset, timings)
+        self.content_iter = content_iter
+        self.content_digest = content_digest
+
+        self.content_hash = hashlib.sha256()
+        self.wait_time = 0.0
+
+    async def render(self) -> Response:
+        if self.content_iter is None:
+            return await super().render()
+
+        # The escaped template variables can never contain the marker
+        page = await render_template(self.BASE_TEMPLATE, body=BODY_MARKER)
+        head, _, tail = page.partition(BODY_MARKER)
+
+        if self.content_digest is None:
+            render_cache.miss(self.__class__.__name__)
+            cached = None
+        else:
+            cached = render_cache.get(self.get_render_key(self.content_digest))
+
+        @stream_with_context
+        async def generate() -> AsyncIterator[str]:
+            yield head
+            if cached is not None:
+                yield cached
+                # Read through the rest of the stream so that the response
+                # is closed the same way as when it's rendered.
+                async for _ in self.iter_content():
+                    pass
+            else:
+                async for html in self.stream_and_cache_body():
+                    yield html
+            yield tail
+
+        return Response(generate())
+
+    async def stream_and_cache_body(self) -> AsyncIterator[str]:
+        """
+        Stream the body while collecting the HTML for the render cache.
+
+        The render time only counts the time spent inside of the handler,
+        not waiting on the upstream server or on the browser.
+        """
+        sections: list[str] | None = []
+        size = 0
+        elapsed = 0.0
+
+        start = time.perf_counter()
+        async for html in self.stream_body(self.iter_lines()):
+            elapsed += time.perf_counter() - start
+            if sections is not None:
+                size += len(html)
+                if size > render_cache.max_entry_size:
+                    sections = None
+                else:
+                    sections.append(html)
+            yield html
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+
+        if sections is not None:
+            key = self.get_render_key(self.content_hash.digest())
+            render_cache.store(key, "".join(sections), elapsed - self.wait_time)
+
+    async def iter_content(self) -> AsyncIterator[bytes]:
+        """
+        Read the content stream, hashing the body and keeping track of the
+        time spent waiting for the server to send it.
+        """
+        if self.content_iter is None:
+            raise RuntimeError("Cannot iterate lines without a content stream")
+
+        content_iter = aiter(self.content_iter)
+        while True:
+            start = time.perf_counter()
+            try:
+                data = await anext(content_iter)
+            except StopAsyncIteration:
+                break
+            finally:
+                self.wait_time += time.perf_counter() - start
+
+            self.content_hash.update(data)
+            yield data
+
+    async def iter_lines(self) -> AsyncIterator[list[str]]:
+        """
+        Decode the content stream and split it into lines, the same way
+        that text.splitlines() would for the complete body.
+
+        Lines are yielded in batches, one for each chunk received from the
+        server, so that the page is flushed as the data arrives.
+        """
+        decoder = codecs.getincrementaldecoder(self.charset or "UTF-8")(errors="replace")
+        stripper = ANSIStripper()
+
+        pending = ""
+        async for data in self.iter_content():
+            with self.timings.measure("decode"):
+                text = stripper.feed(decoder.decode(data))
+            lines = (pending + text).splitlines(keepends=True)
+            pending = ""
+            # Hold back an unterminated line, or a CR that may be followed by LF
+            if lines and (lines[-1].splitlines()[0] == lines[-1] or lines[-1].endswith("\r")):
+                pending = lines.pop()
+                while len(pending) > MAX_LINE_LENGTH:
+                    lines.append(pending[:MAX_LINE_LENGTH])
+                    pending = pending[MAX_LINE_LENGTH:]
+
+            yield [line.splitlines()[0] for line in lines]
+
+        with self.timings.measure("decode"):
+            pending += stripper.feed(decoder.decode(b"", final=True)) + stripper.flush()
+        yield pending.splitlines()
+
+    def stream_body(self, lines: AsyncIterator[list[str]]) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    @classmethod
+    async def from_response(cls, response: BaseResponse) -> StreamingTemplateHandler:
+        # The size limit doesn't apply, the body is never held in memory
+        return cls(
+            response.url,
+            b"",
+            response.mimetype,
+            response.charset,
+            content_iter=response.stream_body(),
+            content_digest=response.body_digest,
+            timings=response.request.timings,
         )
+
+
+class PreformattedHandler(StreamingTemplateHandler):
+    """
+    Render the response line-by-line inside of a single <pre> block.
+    """
+
+    async def get_body(self) -> str:
+        body = "\n".join(self.render_line(line) for line in self.text.splitlines())
+        return f"<pre>{body}</pre>\n"
+
+    async def stream_body(self, lines: AsyncIterator[list[str]]) -> AsyncIterator[str]:
+        yield "<pre>"
+
+        separator = ""
+        async for batch in lines:
+            if batch:
+                yield separator + "\n".join(self.render_line(line) for line in batch)
+                separator = "\n"
+
+        yield "</pre>\n"
+
+    def render_line(self, line: str) -> str:
+        raise NotImplementedError
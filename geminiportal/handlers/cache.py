@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# Upper bound on the total number of characters of HTML held in the cache
+RENDER_CACHE_MAX_SIZE = 2**25
+
+# Rendered bodies larger than this are sent without being cached
+RENDER_CACHE_MAX_ENTRY_SIZE = 2**21
+
+# (body sha256, handler class, handler options, base url, mimetype, charset, url root)
+RenderKey = tuple[bytes, str, tuple, str, str, str | None, str]
+
+
+@dataclass
+class RenderEntry:
+    """
+    The HTML that a handler rendered for a response body.
+    """
+
+    html: str
+
+    # Seconds that the handler spent producing the HTML
+    render_time: float
+
+    @property
+    def size(self) -> int:
+        return len(self.html)
+
+
+@dataclass
+class RenderStats:
+    hits: int = 0
+    misses: int = 0
+    time_saved: float = 0.0
+
+
+class RenderCache:
+    """
+    An in-memory LRU cache of rendered handler output, bounded by the total
+    size of the HTML that it holds.
+
+    Entries are keyed on a hash of the upstream body rather than on the URL,
+    so a page that hasn't changed skips decoding, ANSI stripping, link
+    resolution and escaping even after its response cache entry expires.
+    """
+
+    def __init__(
+        self,
+        max_size: int = RENDER_CACHE_MAX_SIZE,
+        max_entry_size: int = RENDER_CACHE_MAX_ENTRY_SIZE,
+    ):
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+
+        self.entries: OrderedDict[RenderKey, RenderEntry] = OrderedDict()
+        self.size = 0
+
+        self.handlers: dict[str, RenderStats] = {}
+        self.evictions = 0
+
+    def get_handler_stats(self, handler: str) -> RenderStats:
+        if handler not in self.handlers:
+            self.handlers[handler] = RenderStats()
+        return self.handlers[handler]
+
+    def get(self, key: RenderKey) -> str | None:
+        """
+        Return the cached HTML for the key, if there is any.
+        """
+        stats = self.get_handler_stats(key[1])
+
+        entry = self.entries.get(key)
+        if entry is None:
+            stats.misses += 1
+            return None
+
+        stats.hits += 1
+        stats.time_saved += entry.render_time
+        self.entries.move_to_end(key)
+        return entry.html
+
+    def miss(self, handler: str) -> None:
+        """
+        Count a render where the body wasn't known ahead of time, so the
+        cache couldn't be checked.
+        """
+        self.get_handler_stats(handler).misses += 1
+
+    def store(self, key: RenderKey, html: str, render_time: float) -> None:
+        if len(html) > self.max_entry_size:
+            return
+
+        self.remove(key)
+        entry = RenderEntry(html, render_time)
+        self.entries[key] = entry
+        self.size += entry.size
+        self.evict()
+
+    def remove(self, key: RenderKey) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def get_stats(self) -> dict:
+        handlers = {}
+        for name, stats in self.handlers.items():
+            lookups = stats.hits + stats.misses
+            handlers[name] = {
+                "hits": stats.hits,
+                "misses": stats.misses,
+                "hit_ratio": round(stats.hits / lookups, 3) if lookups else 0.0,
+                "time_saved": round(stats.time_saved, 3),
+            }
+
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+            "handlers": handlers,
+        }
+
+
+render_cache = RenderCache()
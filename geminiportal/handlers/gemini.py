@@ -1,72 +1,63 @@
 import re
 from collections import Counter
+from collections.abc import AsyncIterator, Callable
 
 from quart import escape
 
-from geminiportal.handlers.base import TemplateHandler
-from geminiportal.urls import URLReference
-
-RABBIT_INLINE = ":rаbbiΤ:"
-RABBIT_STANDALONE = ";rаbbiΤ;"
-RABBIT_ART = r"""
-          /|
-    /\   //
-   |/\'-'/ .::.
-     /^Y^\::''.
-     \_ /=| `'
-    /`_)=( \
-    \ /=/'-/
-   {/ |/  \
-  __\  _  /__
- '----' '----'
-"""
-
-
-def parse_link_line(line: str, base: URLReference) -> tuple[URLReference, str]:
-    parts = line.split(maxsplit=1)
-    if len(parts) == 0:
-        link, link_text = "", ""
-    elif len(parts) == 1:
-        link, link_text = parts[0], parts[0]
-    else:
-        link, link_text = parts
-
-    url = base.join(link)
-    return url, link_text
-
-
-class GeminiFixedHandler(TemplateHandler):
+from geminiportal.gemtext import (
+    RABBIT_ART,
+    GemtextParser,
+    HeadingLine,
+    Line,
+    LinkLine,
+    ListItemLine,
+    PreformattedLine,
+    PreformatToggleLine,
+    PromptLine,
+    QuoteLine,
+    RabbitLine,
+    TextLine,
+    parse_fixed_line,
+)
+from geminiportal.handlers.base import PreformattedHandler, StreamingTemplateHandler
+from geminiportal.urls import LinkResolver
+
+
+class GeminiFixedHandler(PreformattedHandler):
     """
     Everything in a single <pre> block, with => links supported.
     """
 
-    async def get_body(self) -> str:
-        buffer = []
-        for line in self.text.splitlines(keepends=False):
-            line = line.rstrip()
-            if line.startswith("=>"):
-                url, link_text = parse_link_line(line[2:], self.url)
-                proxy_url = url.get_proxy_url()
-                buffer.append(f'<a href="{escape(proxy_url)}">{escape(link_text)}</a>')
-            else:
-                buffer.append(escape(line))
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.links = LinkResolver(self.url)
 
-        body = "\n".join(buffer)
-        return f"<pre>{body}</pre>\n"
+    def render_line(self, line: str) -> str:
+        node = parse_fixed_line(line)
+        if type(node) is LinkLine:
+            proxy_url = self.links.get_proxy_url(node.url)
+            return f'<a href="{escape(proxy_url)}">{escape(node.text)}</a>'
+        else:
+            return escape(node.text)
 
 
-class GeminiFlowedHandler(TemplateHandler):
+class GeminiFlowedHandler(StreamingTemplateHandler):
     """
     The full-featured gemtext -> html converter.
+
+    Lines are parsed with the gemtext parser and the nodes are fed through
+    a state machine that emits a section of HTML every time a block is
+    completed, so only the current block needs to
+    be held in memory while streaming.
     """
 
     inline_images = False
 
-    _rabbit_re = re.compile(RABBIT_INLINE)
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        self.parser = GemtextParser()
+        self.links = LinkResolver(self.url)
         self.sections: list[str] = []
         self.buffer: list[str] = []
         self.preformat_mode = False
@@ -74,6 +65,18 @@ class GeminiFlowedHandler(TemplateHandler):
         self.quote_mode = False
         self.anchor_counter: Counter[str] = Counter()
 
+        self.renderers: dict[type[Line], Callable] = {
+            TextLine: self.render_text,
+            LinkLine: self.render_link,
+            PromptLine: self.render_prompt,
+            HeadingLine: self.render_heading,
+            ListItemLine: self.render_list_item,
+            QuoteLine: self.render_quote,
+            PreformatToggleLine: self.render_preformat_toggle,
+            PreformattedLine: self.render_preformatted,
+            RabbitLine: self.render_rabbit,
+        }
+
     def get_anchor(self, text: str) -> str:
         """
         Add link anchors to gemtext header lines.
@@ -87,83 +90,106 @@ class GeminiFlowedHandler(TemplateHandler):
             text += f"-{self.anchor_counter[text] - 1}"
         return text
 
+    def get_render_options(self) -> tuple:
+        return (self.inline_images,)
+
     async def get_body(self) -> str:
-        for line in self.text.splitlines(keepends=False):
-            line = line.rstrip()
-            line = self._rabbit_re.sub("🐇", line)
-            if line.startswith("```"):
-                self.flush()
-                self.preformat_mode = not self.preformat_mode
-            elif self.preformat_mode:
-                if line == RABBIT_STANDALONE:
-                    line = RABBIT_ART
-                self.buffer.append(escape(line))
-            elif line == RABBIT_STANDALONE:
-                self.flush()
-                self.sections.append(f"<pre>{RABBIT_ART}</pre>")
-            elif line.startswith("=>"):
-                self.flush()
-                url, link_text = parse_link_line(line[2:], self.url)
-                gemini_link, link_text = parse_link_line(line[2:], self.url)
-                mime_type = url.guess_mimetype()
-                if self.inline_images and mime_type and mime_type.startswith("image"):
-                    image_url = url.get_proxy_url(raw=True)
-                    self.sections.append(
-                        f'<figure><a href="{escape(image_url)}">'
-                        f'<img src="{escape(image_url)}" alt="{escape(link_text)}">'
-                        f"</a><figcaption>{escape(link_text)}</figcaption></figure>"
-                    )
-                else:
-                    image_url = url.get_proxy_url()
-                    self.sections.append(
-                        f'<a href="{escape(image_url)}">⇒ {escape(link_text)}</a><br/>'
-                    )
-            elif line.startswith("=:"):
-                self.flush()
-                url, link_text = parse_link_line(line[2:], self.url)
-                proxy_url = url.get_proxy_url()
-                self.sections.append(
-                    f'<form method="get" action="{escape(proxy_url)}" class="input-line">'
-                    f"<label>{escape(link_text)}"
-                    '<textarea name="q" rows="1" placeholder="Enter text..."></textarea>'
-                    "</label>"
-                    '<input type="submit" value="Submit">'
-                    "</form>"
-                )
-            elif line.startswith("###"):
-                self.flush()
-                text = line[3:].lstrip()
-                anchor = self.get_anchor(text)
-                self.sections.append(f"<h3 id={anchor}>{escape(text)}</h3>")
-            elif line.startswith("##"):
-                self.flush()
-                text = line[2:].lstrip()
-                anchor = self.get_anchor(text)
-                self.sections.append(f"<h2 id={anchor}>{escape(text)}</h2>")
-            elif line.startswith("#"):
-                self.flush()
-                text = line[1:].lstrip()
-                anchor = self.get_anchor(text)
-                self.sections.append(f"<h1 id={anchor}>{escape(text)}</h1>")
-            elif line.startswith("* "):
-                if not self.list_mode:
-                    self.flush()
-                    self.list_mode = True
-                self.buffer.append(f"<li>{escape(line[1:].lstrip())}</li>")
-            elif line.startswith(">"):
-                if not self.quote_mode:
-                    self.flush()
-                    self.quote_mode = True
-                self.buffer.append(escape(line[1:]))
-            else:
-                if self.list_mode or self.quote_mode:
-                    self.flush()
-                self.buffer.append(escape(line) + "\n")
+        renderers = self.renderers
+        for node in self.parser.parse(self.text):
+            renderers[type(node)](node)
         self.flush()
 
         body = "\n".join(self.sections)
         return f'<div class="gemini">{body}</div>\n'
 
+    async def stream_body(self, lines: AsyncIterator[list[str]]) -> AsyncIterator[str]:
+        yield '<div class="gemini">'
+
+        separator = ""
+        async for batch in lines:
+            for line in batch:
+                self.feed(line)
+            if self.sections:
+                yield separator + "\n".join(self.sections)
+                self.sections.clear()
+                separator = "\n"
+
+        self.flush()
+        if self.sections:
+            yield separator + "\n".join(self.sections)
+            self.sections.clear()
+
+        yield "</div>\n"
+
+    def feed(self, line: str) -> None:
+        """
+        Process a single line of gemtext, appending to the sections list
+        whenever a block of HTML is finished.
+        """
+        node = self.parser.parse_line(line)
+        self.renderers[type(node)](node)
+
+    def render_text(self, node: TextLine) -> None:
+        if self.list_mode or self.quote_mode:
+            self.flush()
+        self.buffer.append(escape(node.text) + "\n")
+
+    def render_link(self, node: LinkLine) -> None:
+        self.flush()
+        links = self.links
+        mimetype = links.resolve(node.url).guess_mimetype() if self.inline_images else None
+        if mimetype and mimetype.startswith("image"):
+            image_url = links.get_proxy_url(node.url, raw=True)
+            self.sections.append(
+                f'<figure><a href="{escape(image_url)}">'
+                f'<img src="{escape(image_url)}" alt="{escape(node.text)}">'
+                f"</a><figcaption>{escape(node.text)}</figcaption></figure>"
+            )
+        else:
+            proxy_url = links.get_proxy_url(node.url)
+            self.sections.append(f'<a href="{escape(proxy_url)}">⇒ {escape(node.text)}</a><br/>')
+
+    def render_prompt(self, node: PromptLine) -> None:
+        self.flush()
+        proxy_url = self.links.get_proxy_url(node.url)
+        self.sections.append(
+            f'<form method="get" action="{escape(proxy_url)}" class="input-line">'
+            f"<label>{escape(node.text)}"
+            '<textarea name="q" rows="1" placeholder="Enter text..."></textarea>'
+            "</label>"
+            '<input type="submit" value="Submit">'
+            "</form>"
+        )
+
+    def render_heading(self, node: HeadingLine) -> None:
+        self.flush()
+        anchor = self.get_anchor(node.text)
+        level = node.level
+        self.sections.append(f"<h{level} id={anchor}>{escape(node.text)}</h{level}>")
+
+    def render_list_item(self, node: ListItemLine) -> None:
+        if not self.list_mode:
+            self.flush()
+            self.list_mode = True
+        self.buffer.append(f"<li>{escape(node.text)}</li>")
+
+    def render_quote(self, node: QuoteLine) -> None:
+        if not self.quote_mode:
+            self.flush()
+            self.quote_mode = True
+        self.buffer.append(escape(node.text))
+
+    def render_preformat_toggle(self, node: PreformatToggleLine) -> None:
+        self.flush()
+        self.preformat_mode = not self.preformat_mode
+
+    def render_preformatted(self, node: PreformattedLine) -> None:
+        self.buffer.append(escape(node.text))
+
+    def render_rabbit(self, node: RabbitLine) -> None:
+        self.flush()
+        self.sections.append(f"<pre>{RABBIT_ART}</pre>")
+
     def flush(self) -> None:
         if self.buffer:
             if self.preformat_mode:
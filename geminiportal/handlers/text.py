@@ -2,7 +2,7 @@ import re
 
 from quart import escape
 
-from geminiportal.handlers.base import TemplateHandler
+from geminiportal.handlers.base import PreformattedHandler
 from geminiportal.urls import URLReference
 
 # URLs that will be auto-detected in plain text responses
@@ -20,22 +20,16 @@ URL_SCHEMES = [
 ]
 
 
-class TextHandler(TemplateHandler):
+class TextHandler(PreformattedHandler):
     """
     Everything in a single <pre> block, with URLs converted into links.
     """
 
     url_re = re.compile(rf"(?:{'|'.join(URL_SCHEMES)})://\S+\w", flags=re.UNICODE)
 
-    async def get_body(self) -> str:
-        buffer = []
-        for line in self.text.splitlines(keepends=False):
-            line = escape(line)
-            line = self.url_re.sub(self.insert_anchor, line)
-            buffer.append(line)
-
-        body = "\n".join(buffer)
-        return f"<pre>{body}</pre>\n"
+    def render_line(self, line: str) -> str:
+        line = escape(line)
+        return self.url_re.sub(self.insert_anchor, line)
 
     def insert_anchor(self, match: re.Match) -> str:
         m = match.group()
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# When set, every worker writes its metrics to files in this directory and
+# the /metrics endpoint adds them together. It must be set before the
+# workers start, see gunicorn_conf.py.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Upper bounds for the upstream latency histogram, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Seconds between checks of how late the event loop is running
+LOOP_LAG_INTERVAL = 1.0
+
+
+class ProxyMetrics:
+    """
+    Prometheus metrics for the proxy.
+
+    Recording a metric is a lock and an addition, cheap enough to do on
+    every request. Labels are limited to values from fixed tables (schemes,
+    status codes, handler and exception class names) so that the number of
+    series stays bounded.
+    """
+
+    def __init__(self, registry: CollectorRegistry = REGISTRY):
+        self.requests = Counter(
+            "geminiportal_requests",
+            "Proxied responses by scheme and upstream status code",
+            ["scheme", "status"],
+            registry=registry,
+        )
+        self.handlers = Counter(
+            "geminiportal_handler_responses",
+            "Responses rendered by each handler class",
+            ["handler"],
+            registry=registry,
+        )
+        self.upstream_latency = Histogram(
+            "geminiportal_upstream_latency_seconds",
+            "Time from starting an upstream request to receiving the response header",
+            ["scheme"],
+            buckets=LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.upstream_bytes = Counter(
+            "geminiportal_upstream_bytes",
+            "Response body bytes read from upstream servers",
+            ["scheme"],
+            registry=registry,
+        )
+        self.errors = Counter(
+            "geminiportal_proxy_errors",
+            "Proxy errors shown to the user, by exception class",
+            ["error"],
+            registry=registry,
+        )
+        self.favicons = Counter(
+            "geminiportal_favicon_lookups",
+            "Favicon cache lookups by result",
+            ["result"],
+            registry=registry,
+        )
+        self.upstream_connections = Gauge(
+            "geminiportal_upstream_connections",
+            "Upstream connections that are currently open",
+            registry=registry,
+            multiprocess_mode="livesum",
+        )
+        self.loop_lag = Gauge(
+            "geminiportal_event_loop_lag_seconds",
+            "How late the event loop woke up for the last scheduled check",
+            registry=registry,
+            multiprocess_mode="livemax",
+        )
+
+        self.loop_monitor: asyncio.Task | None = None
+
+    def record_response(self, scheme: str, status: str, status_codes: dict[str, str]) -> None:
+        # Anything outside of the protocol's table is a misbehaving server
+        if status not in status_codes:
+            status = "other"
+        self.requests.labels(scheme, status).inc()
+
+    def record_handler(self, handler: str) -> None:
+        self.handlers.labels(handler).inc()
+
+    def record_upstream_latency(self, scheme: str, latency: float) -> None:
+        self.upstream_latency.labels(scheme).observe(latency)
+
+    def record_upstream_bytes(self, scheme: str, size: int) -> None:
+        self.upstream_bytes.labels(scheme).inc(size)
+
+    def record_error(self, error: Exception) -> None:
+        self.errors.labels(error.__class__.__name__).inc()
+
+    def record_favicon(self, result: str) -> None:
+        self.favicons.labels(result).inc()
+
+    def connection_opened(self) -> None:
+        self.upstream_connections.inc()
+
+    def connection_closed(self) -> None:
+        self.upstream_connections.dec()
+
+    def start(self, interval: float = LOOP_LAG_INTERVAL) -> None:
+        """
+        Start measuring the event loop lag in the background.
+        """
+        if self.loop_monitor is None:
+            self.loop_monitor = asyncio.create_task(self._monitor_event_loop(interval))
+
+    async def _monitor_event_loop(self, interval: float) -> None:
+        # The time past the scheduled wake up grows when something is
+        # blocking the loop.
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.set(max(loop.time() - start - interval, 0.0))
+
+    def shutdown(self) -> None:
+        if self.loop_monitor is not None:
+            self.loop_monitor.cancel()
+            self.loop_monitor = None
+
+
+def generate_metrics() -> bytes:
+    """
+    Render the metrics in the Prometheus text format, combining the values
+    from every worker when running in multiprocess mode.
+
+    This reads a file for every worker and should be called from a thread.
+    """
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    return generate_latest(REGISTRY)
+
+
+proxy_metrics = ProxyMetrics()
@@ -6,14 +6,14 @@ from geminiportal.protocols.text import TxtRequest
 from geminiportal.urls import URLReference
 
 
-def build_proxy_request(url: URLReference) -> BaseRequest:
+def build_proxy_request(url: URLReference, client: str | None = None) -> BaseRequest:
     if url.scheme == "spartan":
-        return SpartanRequest(url)
+        return SpartanRequest(url, client)
     elif url.scheme == "text":
-        return TxtRequest(url)
+        return TxtRequest(url, client)
     elif url.scheme == "finger":
-        return FingerRequest(url)
+        return FingerRequest(url, client)
     elif url.scheme == "gemini":
-        return GeminiRequest(url)
+        return GeminiRequest(url, client)
     else:
         raise ValueError("Unsupported URL scheme")
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+_logger = logging.getLogger(__name__)
+
+# The table is stored on the filesystem so that it's shared by every worker
+BACKOFF_DB_NAME = os.path.join(tempfile.gettempdir(), "gemini-portal-backoff.sqlite3")
+
+# Seconds to back off when the server doesn't say how long to wait
+BACKOFF_DEFAULT = 30
+
+# Upper bound on the wait time that a server can ask for
+BACKOFF_MAX = 60 * 60
+
+# Requests are held until the deadline if it's at most this many seconds away,
+# otherwise they fail immediately.
+BACKOFF_MAX_QUEUE_WAIT = 5
+
+# Seconds between reloading the deadlines written by other workers
+BACKOFF_SYNC_INTERVAL = 1.0
+
+
+def parse_backoff(meta: str) -> int:
+    """
+    Parse the number of seconds to wait from a "44 SLOW DOWN" response.
+    """
+    try:
+        seconds = int(meta.strip())
+    except ValueError:
+        return BACKOFF_DEFAULT
+
+    return min(max(seconds, 1), BACKOFF_MAX)
+
+
+class BackoffTable:
+    """
+    Keep track of upstream hosts that have asked us to slow down.
+
+    Deadlines are written to a SQLite database so that all of the workers
+    in the deployment back off together. Each worker keeps a local copy of
+    the active deadlines, so that checking a host never touches the
+    filesystem. The local copy is refreshed from the database in the
+    background, and new deadlines are written behind from a thread.
+    """
+
+    def __init__(self, db_name: str, sync_interval: float = BACKOFF_SYNC_INTERVAL):
+        self.db_name = db_name
+        self.sync_interval = sync_interval
+        self.initialized = False
+
+        self.deadlines: dict[str, float] = {}
+        self.last_sync = 0.0
+        self.sync_task: asyncio.Task | None = None
+
+        # Deadlines that are waiting to be written to the database
+        self.pending: dict[str, float] = {}
+        self.flush_task: asyncio.Task | None = None
+
+        self.recorded = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_name, timeout=5)
+        if not self.initialized:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS backoff (host TEXT PRIMARY KEY, deadline REAL)")
+            self.initialized = True
+        return db
+
+    def get_retry_in(self, host: str) -> float:
+        """
+        Return the number of seconds until the host may be contacted again.
+        """
+        now = time.time()
+        if now - self.last_sync >= self.sync_interval and self.sync_task is None:
+            try:
+                self.sync_task = asyncio.get_running_loop().create_task(self._sync_later())
+            except RuntimeError:
+                # Not called from the event loop, only the local deadlines
+                # are checked.
+                pass
+
+        deadline = self.deadlines.get(host)
+        if deadline is None:
+            return 0
+        elif deadline <= now:
+            del self.deadlines[host]
+            return 0
+
+        self.throttled += 1
+        return deadline - now
+
+    def record(self, host: str, seconds: int) -> None:
+        deadline = time.time() + seconds
+        _logger.info(f"Backing off from {host} for {seconds} seconds")
+
+        self.recorded += 1
+        self.deadlines[host] = max(deadline, self.deadlines.get(host, 0))
+
+        self.pending[host] = max(deadline, self.pending.get(host, 0))
+        if self.flush_task is None:
+            try:
+                self.flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # Not called from the event loop, the deadline is saved by
+                # the next flush instead.
+                pass
+
+    async def _sync_later(self) -> None:
+        try:
+            await self.sync()
+        finally:
+            self.sync_task = None
+
+    async def _flush_later(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self.flush_task = None
+
+    async def sync(self) -> None:
+        """
+        Merge the active deadlines from the database into the local copy.
+        """
+        now = time.time()
+        self.last_sync = now
+
+        try:
+            rows = await asyncio.to_thread(self.load, now)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to load backoff deadlines: {e}")
+            self.errors += 1
+            return
+
+        now = time.time()
+        deadlines = {host: deadline for host, deadline in self.deadlines.items() if deadline > now}
+        for host, deadline in rows:
+            deadlines[host] = max(deadline, deadlines.get(host, 0))
+        self.deadlines = deadlines
+
+    async def flush(self) -> None:
+        """
+        Write all of the pending deadlines to the database.
+        """
+        while self.pending:
+            entries, self.pending = list(self.pending.items()), {}
+            try:
+                await asyncio.to_thread(self.save, entries)
+            except sqlite3.Error as e:
+                _logger.warning(f"Unable to save backoff deadlines: {e}")
+                self.errors += 1
+                return
+
+    def load(self, now: float) -> list[tuple[str, float]]:
+        # Read only, so that syncing never takes the write lock
+        with closing(self.connect()) as db:
+            return db.execute(
+                "SELECT host, deadline FROM backoff WHERE deadline > ?", (now,)
+            ).fetchall()
+
+    def save(self, entries: list[tuple[str, float]]) -> None:
+        with closing(self.connect()) as db, db:
+            # Expired deadlines are pruned while we're writing anyway
+            db.execute("DELETE FROM backoff WHERE deadline <= ?", (time.time(),))
+            db.executemany(
+                "INSERT INTO backoff VALUES (?, ?) ON CONFLICT (host) "
+                "DO UPDATE SET deadline = max(deadline, excluded.deadline)",
+                entries,
+            )
+
+    async def shutdown(self) -> None:
+        if self.sync_task:
+            self.sync_task.cancel()
+        tasks = [task for task in (self.sync_task, self.flush_task) if task]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush()
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hosts": len(self.deadlines),
+            "recorded": self.recorded,
+            "throttled": self.throttled,
+            "pending_writes": len(self.pending),
+            "errors": self.errors,
+        }
+
+
+backoff_table = BackoffTable(BACKOFF_DB_NAME)
@@ -1,16 +1,37 @@
 from __future__ import annotations
 
 import asyncio
+import copy
 import logging
 import re
 import socket
+import time
 from asyncio.exceptions import IncompleteReadError
-from collections.abc import AsyncIterator
-
+from collections.abc import AsyncGenerator, Awaitable
+from typing import TYPE_CHECKING, TypeVar
+
+from geminiportal.metrics import proxy_metrics
+from geminiportal.protocols.backoff import BACKOFF_MAX_QUEUE_WAIT, backoff_table
+from geminiportal.protocols.breaker import circuit_breaker
+from geminiportal.protocols.cache import BodyRecorder, response_cache
+from geminiportal.protocols.coalesce import request_coalescer
+from geminiportal.protocols.connect import connection_racer
+from geminiportal.protocols.dns import resolver
+from geminiportal.protocols.scheduler import (
+    SchedulerBusyError,
+    UpstreamSlot,
+    upstream_scheduler,
+)
+from geminiportal.timings import RequestTimings
 from geminiportal.urls import URLReference
 
+if TYPE_CHECKING:
+    from geminiportal.protocols.coalesce import FlightReader
+
 _logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 # Chunk size for streaming files, taken from the twisted FileSender class
 CHUNK_SIZE = 2**14
 
@@ -27,6 +48,29 @@ ALLOWED_PORTS = {79, 7070, 300, 301, 3000, 3333, *range(1960, 2021)}
 # Time waiting to establish a connection before aborting
 CONNECT_TIMEOUT = 10
 
+# Time waiting for the server to send the response header line
+HEADER_TIMEOUT = 30
+
+# Time waiting for the next chunk of the response body before aborting
+READ_TIMEOUT = 30
+
+# Total time allowed for the entire response, including the body
+RESPONSE_TIMEOUT = 60 * 10
+
+# Gemini limits the meta field to 1024 bytes, plus room for the status
+# code, the separating space, and the trailing CRLF.
+MAX_HEADER_SIZE = 1024 + 5
+
+TIMEOUT_MESSAGES = {
+    "connect": "Timeout establishing connection with server",
+    "header": "Timeout waiting for the server to send a response",
+    "idle": "Timeout waiting for the server to send more data",
+    "deadline": "The server took too long to send the complete response",
+}
+
+# Number of upstream timeouts, grouped by kind
+timeout_counts = dict.fromkeys(TIMEOUT_MESSAGES, 0)
+
 
 class ProxyError(Exception):
     pass
@@ -36,6 +80,45 @@ class ProxyResponseSizeError(ProxyError):
     pass
 
 
+class ProxyCircuitOpenError(ProxyError):
+    pass
+
+
+class ProxyTimeoutError(ProxyError):
+    def __init__(self, kind: str):
+        super().__init__(TIMEOUT_MESSAGES[kind])
+        self.kind = kind
+
+
+class ProxyBusyError(ProxyError):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProxySlowDownError(ProxyBusyError):
+    pass
+
+
+async def wait_for_upstream(
+    aw: Awaitable[T], kind: str, timeout: float, deadline: float | None
+) -> T:
+    """
+    Wait for an upstream read, raising ProxyTimeoutError if it takes longer
+    than the timeout or runs past the response deadline.
+    """
+    if deadline is not None:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining < timeout:
+            kind, timeout = "deadline", max(remaining, 0)
+
+    try:
+        return await asyncio.wait_for(aw, timeout=timeout)
+    except asyncio.TimeoutError:
+        timeout_counts[kind] += 1
+        raise ProxyTimeoutError(kind)
+
+
 class BaseRequest:
     """
     Encapsulates a request to a protocol.
@@ -43,10 +126,16 @@ class BaseRequest:
 
     _blocked_hosts = [re.compile(rf"(?:.+\.)?{host}\.?$", flags=re.I) for host in BLOCKED_HOSTS]
 
-    def __init__(self, url: URLReference):
+    def __init__(self, url: URLReference, client: str | None = None):
         self.url = url
+        self.client = client
         self.host, self.port = url.conn_info
 
+        # Event loop time that the upstream response must be finished by
+        self.deadline: float | None = None
+
+        self.timings = RequestTimings()
+
         self.clean()
 
     def clean(self):
@@ -60,27 +149,167 @@ class BaseRequest:
             raise ValueError(f"Proxied content is disabled over port {self.port}.")
 
     async def get_response(self):
+        response = response_cache.get(self)
+        if response is not None:
+            _logger.info(f"{self.__class__.__name__}: Cached response for {self.url}")
+            return response
+
+        retry_in = backoff_table.get_retry_in(self.host)
+        if retry_in > 0:
+            response = response_cache.get(self, allow_stale=True)
+            if response is not None:
+                _logger.info(f"{self.__class__.__name__}: Stale response for {self.url}")
+                return response
+
+            if retry_in > BACKOFF_MAX_QUEUE_WAIT:
+                raise ProxySlowDownError(
+                    f'The server "{self.host}" has asked us to slow down, '
+                    f"please try again in {round(retry_in)} seconds",
+                    retry_in,
+                )
+
+            _logger.info(f"{self.__class__.__name__}: Waiting {retry_in:.1f}s for {self.host}")
+            await asyncio.sleep(retry_in)
+
+        return await request_coalescer.get_response(self, self.get_upstream_response)
+
+    async def get_upstream_response(self):
+        try:
+            slot = await upstream_scheduler.acquire(self.host, self.client)
+        except SchedulerBusyError:
+            raise ProxyBusyError(
+                f'Too many requests are waiting on "{self.host}", please try again later',
+                upstream_scheduler.max_queue_wait,
+            )
+
         _logger.info(f"{self.__class__.__name__}: Making request to {self.url}")
+        self.deadline = asyncio.get_running_loop().time() + RESPONSE_TIMEOUT
+        start = time.perf_counter()
         try:
             response = await self.fetch()
         except socket.gaierror:
+            slot.release()
             raise ProxyError(f'Unable to establish connection with host "{self.host}"')
         except OSError as e:
+            slot.release()
             raise ProxyError(f"Connection error: {e}")
+        except BaseException:
+            slot.release()
+            raise
 
         _logger.info(f"{self.__class__.__name__}: Response received: {response.status}")
+        proxy_metrics.record_upstream_latency(self.url.scheme, time.perf_counter() - start)
+        response.slot = slot
+        response.deadline = self.deadline
+
+        backoff = response.get_backoff()
+        if backoff is not None:
+            backoff_table.record(self.host, backoff)
+
+        response_cache.track(response)
         return response
 
     async def open_connection(self, **kwargs) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
-        future = asyncio.open_connection(self.host, self.port, **kwargs)
+        key = (self.host, self.port)
+        if not circuit_breaker.allow(key):
+            retry_in = circuit_breaker.get_retry_in(key)
+            raise ProxyCircuitOpenError(
+                "The server has not been responding to connections, "
+                f"the next attempt will be made in {retry_in} seconds"
+            )
+
+        future = self._open_connection(**kwargs)
         try:
-            return await asyncio.wait_for(future, timeout=CONNECT_TIMEOUT)
+            result = await asyncio.wait_for(future, timeout=CONNECT_TIMEOUT)
         except asyncio.TimeoutError:
-            raise ProxyError("Timeout establishing connection with server")
+            circuit_breaker.record_failure(key)
+            timeout_counts["connect"] += 1
+            raise ProxyTimeoutError("connect")
+        except socket.gaierror:
+            # DNS failures are handled by the resolver's negative cache
+            circuit_breaker.record_abort(key)
+            raise
+        except OSError:
+            circuit_breaker.record_failure(key)
+            raise
+        except BaseException:
+            circuit_breaker.record_abort(key)
+            raise
+
+        circuit_breaker.record_success(key)
+        return result
+
+    async def _open_connection(self, **kwargs) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        with self.timings.measure("dns"):
+            addresses = await resolver.resolve(self.host)
+        with self.timings.measure("connect"):
+            sock = await connection_racer.connect(self.host, self.port, addresses)
+
+        if kwargs.get("ssl"):
+            # Connecting with a raw socket, so the SNI hostname must be set explicitly
+            kwargs.setdefault("server_hostname", self.host)
+
+        try:
+            # Wrapping the socket in a stream is only significant with TLS
+            with self.timings.measure("tls" if kwargs.get("ssl") else "connect"):
+                return await asyncio.open_connection(sock=sock, **kwargs)
+        except BaseException:
+            sock.close()
+            raise
 
     async def fetch(self) -> BaseResponse:
         raise NotImplementedError
 
+    async def write_request(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        """
+        Send the request line (and body, if any) to the server.
+        """
+        with self.timings.measure("write"):
+            writer.write(data)
+            await writer.drain()
+
+    async def read_header(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bytes:
+        """
+        Read the response header line, closing the connection if it fails.
+        """
+        try:
+            with self.timings.measure("header"):
+                return await wait_for_upstream(
+                    self._read_header(reader), "header", HEADER_TIMEOUT, self.deadline
+                )
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _read_header(self, reader: asyncio.StreamReader) -> bytes:
+        # Take whatever is already buffered up to the end of the line, but
+        # never more than the header limit, so that a misbehaving server
+        # can't make us consume up to the stream limit looking for "\n".
+        header = bytearray()
+        while not header.endswith(b"\n"):
+            remaining = MAX_HEADER_SIZE - len(header)
+            if remaining <= 0:
+                raise ProxyError(f"Response header exceeds {MAX_HEADER_SIZE} bytes")
+
+            buffer = reader._buffer  # type: ignore[attr-defined]
+            index = buffer.find(b"\n", 0, remaining)
+            if index >= 0:
+                size = index + 1
+            else:
+                # Wait for at least one more byte if nothing is buffered
+                size = min(len(buffer), remaining) or 1
+
+            try:
+                header += await reader.readexactly(size)
+            except IncompleteReadError as e:
+                # The server closed the connection without ending the line
+                header += e.partial
+                break
+
+        return bytes(header)
+
     @staticmethod
     def parse_header(raw_header: bytes) -> tuple[str, str]:
         header = raw_header.decode()
@@ -103,14 +332,26 @@ class BaseResponse:
     STATUS_CODES: dict[str, str] = {}
 
     request: BaseRequest
-    reader: asyncio.StreamReader
-    writer: asyncio.StreamWriter
+    reader: asyncio.StreamReader | FlightReader
+    writer: asyncio.StreamWriter | None
     status: str
     meta: str
     mimetype: str
     charset: str
     lang: str | None
 
+    # Set when the body should be saved to the response cache as it's read
+    recorder: BodyRecorder | None = None
+
+    # Held while the upstream connection is open, see the upstream scheduler
+    slot: UpstreamSlot | None = None
+
+    # Event loop time that the upstream response must be finished by
+    deadline: float | None = None
+
+    # SHA-256 of the body, when it's known before the body has been read
+    body_digest: bytes | None = None
+
     def __str__(self) -> str:
         return f'{self.__class__.__name__} {self.status} "{self.meta}"'
 
@@ -145,10 +386,35 @@ class BaseResponse:
 
         return mimetype, params
 
+    def copy(self, request: BaseRequest, reader: asyncio.StreamReader | FlightReader | None):
+        """
+        Copy the response header, reading the body from a different source.
+        """
+        response = copy.copy(self)
+        response.request = request
+        response.reader = reader  # type: ignore
+        response.writer = None
+        response.recorder = None
+        response.slot = None
+        response.deadline = None
+        response.body_digest = None
+        return response
+
     def close(self) -> None:
         """
         Close the socket connection.
         """
+        if self.slot:
+            self.slot.release()
+
+        if self.writer is None:
+            # Cached and shared responses read from a buffer instead of
+            # owning a socket connection.
+            close_reader = getattr(self.reader, "close", None)
+            if close_reader:
+                close_reader()
+            return
+
         _logger.info("Closing socket")
         try:
             self.writer.close()
@@ -158,30 +424,73 @@ class BaseResponse:
             # that ahead of time.
             _logger.warning(f"Error closing socket: {e}")
 
-    async def get_body(self) -> bytes:
+    async def get_body(self) -> bytearray:
         """
-        Return the entire response body as bytes, up to the max body size.
+        Return the entire response body, up to the max body size.
         """
+        # Chunks are appended to a single buffer that is handed back as-is,
+        # instead of building up the body in the reader and copying it out.
+        # Anything that keeps the body around (e.g. the response cache)
+        # takes its own immutable copy.
+        body = bytearray()
         try:
-            try:
-                await self.reader.readexactly(MAX_BODY_SIZE)
-            except IncompleteReadError as e:
-                return e.partial
-            else:
-                raise ProxyResponseSizeError()
+            while True:
+                # Never ask for more than the limit, so an oversize body is
+                # detected as soon as the last allowed byte arrives.
+                chunk = await self.read(MAX_BODY_SIZE - len(body))
+                if not chunk:
+                    break
+                body += chunk
+                if len(body) >= MAX_BODY_SIZE:
+                    raise ProxyResponseSizeError()
         finally:
             self.close()
 
-    async def stream_body(self) -> AsyncIterator[bytes]:
+        if self.recorder:
+            self.recorder.save(body)
+
+        return body
+
+    async def read(self, n: int) -> bytes:
+        """
+        Read up to n bytes of the response body.
+        """
+        if self.deadline is None:
+            # Cached and shared responses are not reading from the network.
+            # These are the responses handed to the client, so the body time
+            # is counted here instead of in the upstream reader that feeds them.
+            start = time.perf_counter()
+            try:
+                return await self.reader.read(n)
+            finally:
+                self.request.timings.add("body", time.perf_counter() - start)
+
+        data = await wait_for_upstream(self.reader.read(n), "idle", READ_TIMEOUT, self.deadline)
+        proxy_metrics.record_upstream_bytes(self.url.scheme, len(data))
+        return data
+
+    async def stream_body(self) -> AsyncGenerator[bytes, None]:
         """
         Return a streaming iterator for the response bytes.
         """
         try:
-            while chunk := await self.reader.read(CHUNK_SIZE):
+            while chunk := await self.read(CHUNK_SIZE):
+                if self.recorder:
+                    self.recorder.feed(chunk)
                 yield chunk
+
+            if self.recorder:
+                self.recorder.finish()
         finally:
             self.close()
 
+    def get_backoff(self) -> int | None:
+        """
+        Return the number of seconds that the server asked us to wait before
+        sending another request, if any.
+        """
+        return None
+
     def is_input(self) -> bool:
         return False
 
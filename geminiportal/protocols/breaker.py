@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+_logger = logging.getLogger(__name__)
+
+# Consecutive connection failures before the circuit opens
+BREAKER_FAILURE_THRESHOLD = 5
+
+# Seconds to fail fast before letting a probe request through
+BREAKER_RESET_TIMEOUT = 30
+
+# The reset timeout doubles each time a probe fails, up to this limit
+BREAKER_MAX_RESET_TIMEOUT = 60 * 10
+
+# Seconds that a probe can take before it gives up, the same as the
+# connect timeout for upstream requests
+BREAKER_PROBE_TIMEOUT = 10
+
+# Number of failing servers to keep track of
+BREAKER_MAX_CIRCUITS = 4096
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+@dataclass
+class Circuit:
+    state: str = CLOSED
+    failures: int = 0
+    opened_at: float = 0.0
+    probe_started_at: float = 0.0
+    reset_timeout: float = BREAKER_RESET_TIMEOUT
+
+    @property
+    def retry_at(self) -> float:
+        return self.opened_at + self.reset_timeout
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to upstream servers that are unreachable.
+
+    After several consecutive connection failures the circuit for the
+    server opens and requests fail immediately. Once the reset timeout
+    has passed, a single probe request is allowed through to check if
+    the server has come back.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        max_reset_timeout: float = BREAKER_MAX_RESET_TIMEOUT,
+        probe_timeout: float = BREAKER_PROBE_TIMEOUT,
+        max_circuits: int = BREAKER_MAX_CIRCUITS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout
+        self.max_circuits = max_circuits
+
+        # Only servers that have recently failed are tracked
+        self.circuits: dict[tuple[str, int], Circuit] = {}
+
+        self.rejected = 0
+
+    def allow(self, key: tuple[str, int]) -> bool:
+        """
+        Check if a connection to the server may be attempted.
+        """
+        circuit = self.circuits.get(key)
+        if circuit is None or circuit.state == CLOSED:
+            return True
+
+        now = time.monotonic()
+        if circuit.state == OPEN and now >= circuit.retry_at:
+            _logger.info(f"Circuit half-open for {key}, sending probe")
+            circuit.state = HALF_OPEN
+            circuit.probe_started_at = now
+            return True
+
+        self.rejected += 1
+        return False
+
+    def get_retry_at(self, circuit: Circuit) -> float:
+        if circuit.state == HALF_OPEN:
+            # The probe that's in flight will have finished by then
+            return circuit.probe_started_at + self.probe_timeout
+        return circuit.retry_at
+
+    def get_retry_in(self, key: tuple[str, int]) -> int:
+        """
+        Return the number of seconds until a rejected request can be retried.
+        """
+        circuit = self.circuits.get(key)
+        if circuit is None or circuit.state == CLOSED:
+            return 0
+        return max(1, math.ceil(self.get_retry_at(circuit) - time.monotonic()))
+
+    def record_success(self, key: tuple[str, int]) -> None:
+        if self.circuits.pop(key, None):
+            _logger.info(f"Circuit closed for {key}")
+
+    def record_failure(self, key: tuple[str, int]) -> None:
+        circuit = self.circuits.get(key)
+        if circuit is None:
+            circuit = self.circuits[key] = Circuit(reset_timeout=self.reset_timeout)
+            if len(self.circuits) > self.max_circuits:
+                del self.circuits[next(iter(self.circuits))]
+
+        circuit.failures += 1
+
+        if circuit.state == HALF_OPEN:
+            circuit.reset_timeout = min(circuit.reset_timeout * 2, self.max_reset_timeout)
+            self.trip(key, circuit)
+        elif circuit.state == CLOSED and circuit.failures >= self.failure_threshold:
+            self.trip(key, circuit)
+
+    def record_abort(self, key: tuple[str, int]) -> None:
+        """
+        The connection attempt ended without a result, let another probe through.
+        """
+        circuit = self.circuits.get(key)
+        if circuit is not None and circuit.state == HALF_OPEN:
+            circuit.state = OPEN
+
+    def trip(self, key: tuple[str, int], circuit: Circuit) -> None:
+        _logger.warning(f"Circuit opened for {key} after {circuit.failures} failures")
+        circuit.state = OPEN
+        circuit.opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "rejected": self.rejected,
+            "circuits": [
+                {
+                    "host": host,
+                    "port": port,
+                    "state": circuit.state,
+                    "failures": circuit.failures,
+                    "retry_in": (
+                        max(0.0, self.get_retry_at(circuit) - now) if circuit.state != CLOSED else 0
+                    ),
+                }
+                for (host, port), circuit in self.circuits.items()
+            ],
+        }
+
+
+circuit_breaker = CircuitBreaker()
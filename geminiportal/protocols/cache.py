@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from geminiportal.protocols.base import BaseRequest, BaseResponse
+
+_logger = logging.getLogger(__name__)
+
+# Upper bound on the total number of body bytes held in the cache
+CACHE_MAX_SIZE = 2**26
+
+# Bodies larger than this are streamed through without being cached
+CACHE_MAX_ENTRY_SIZE = 2**20
+
+# Seconds to keep a response around, grouped by the type of response
+CACHE_TTL = {
+    "input": 0,
+    "success": 60,
+    "redirect": 300,
+    "failure": 30,
+}
+
+# Individual status codes that override the TTL for their response type.
+# Temporary failures are not cached so that a capsule that is restarting
+# doesn't look broken for longer than it actually is.
+CACHE_STATUS_TTL = {
+    # gemini:// & text://
+    "40": 0,
+    "41": 0,
+    "42": 0,
+    "43": 0,
+    "44": 0,
+    # spartan://
+    "5": 0,
+}
+
+
+@dataclass
+class CacheEntry:
+    """
+    A snapshot of a completed upstream response.
+    """
+
+    response: BaseResponse
+    body: bytes
+    expires: float
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.response.meta)
+
+    @cached_property
+    def digest(self) -> bytes:
+        return hashlib.sha256(self.body).digest()
+
+    def replay(self, request: BaseRequest) -> BaseResponse:
+        """
+        Build a new response object that reads from the cached body.
+        """
+        reader = asyncio.StreamReader()
+        reader.feed_data(self.body)
+        reader.feed_eof()
+        response = self.response.copy(request, reader)
+        response.body_digest = self.digest
+        return response
+
+
+class BodyRecorder:
+    """
+    Collect the body bytes of a response as they're read, and save the
+    response to the cache once the body has been fully consumed.
+    """
+
+    def __init__(self, cache: ResponseCache, key: tuple[str, str], response: BaseResponse):
+        self.cache = cache
+        self.key = key
+        self.response = response
+        self.buffer: bytearray | None = bytearray()
+
+    def feed(self, data: bytes) -> None:
+        if self.buffer is None:
+            return
+
+        self.buffer += data
+        if len(self.buffer) > self.cache.max_entry_size:
+            # Too large to cache, stop recording
+            self.buffer = None
+
+    def finish(self) -> None:
+        if self.buffer is not None:
+            self.cache.store(self.key, self.response, bytes(self.buffer))
+            self.buffer = None
+
+    def save(self, body: bytearray) -> None:
+        """
+        Store the complete body in one go, when it was read all at once.
+        """
+        if self.buffer is not None:
+            if len(body) <= self.cache.max_entry_size:
+                self.cache.store(self.key, self.response, bytes(body))
+            self.buffer = None
+
+
+class ResponseCache:
+    """
+    An in-memory LRU cache of upstream responses, bounded by the total
+    number of body bytes that it holds.
+
+    Expired responses are kept until they are replaced or evicted, so that
+    a stale copy can still be served while an upstream server is asking us
+    to slow down.
+    """
+
+    def __init__(
+        self,
+        max_size: int = CACHE_MAX_SIZE,
+        max_entry_size: int = CACHE_MAX_ENTRY_SIZE,
+        ttl: dict[str, int] | None = None,
+        status_ttl: dict[str, int] | None = None,
+    ):
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.status_ttl = CACHE_STATUS_TTL if status_ttl is None else status_ttl
+
+        self.entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_key(request: BaseRequest) -> tuple[str, str]:
+        url = request.url
+        return url.scheme, url.get_gemini_request_url()
+
+    def get_ttl(self, response: BaseResponse) -> int:
+        """
+        Return the number of seconds that the response may be cached for.
+        """
+        if response.status in self.status_ttl:
+            return self.status_ttl[response.status]
+        elif response.is_input():
+            return self.ttl["input"]
+        elif response.is_success():
+            return self.ttl["success"]
+        elif response.is_redirect():
+            return self.ttl["redirect"]
+        else:
+            return self.ttl["failure"]
+
+    def get(self, request: BaseRequest, allow_stale: bool = False) -> BaseResponse | None:
+        """
+        Return a replayable copy of the cached response for the request.
+        """
+        key = self.get_key(request)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if time.time() >= entry.expires:
+            if not allow_stale:
+                self.misses += 1
+                return None
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+
+        self.entries.move_to_end(key)
+        return entry.replay(request)
+
+    def track(self, response: BaseResponse) -> None:
+        """
+        Start recording a fresh upstream response so that it can be stored.
+        """
+        if self.get_ttl(response) <= 0:
+            return
+
+        key = self.get_key(response.request)
+        if response.is_success():
+            response.recorder = BodyRecorder(self, key, response)
+        else:
+            # Only successful responses include a body
+            self.store(key, response, b"")
+
+    def store(self, key: tuple[str, str], response: BaseResponse, body: bytes) -> None:
+        ttl = self.get_ttl(response)
+        if ttl <= 0 or len(body) > self.max_entry_size:
+            return
+
+        snapshot = response.copy(response.request, None)
+
+        self.remove(key)
+        entry = CacheEntry(snapshot, body, time.time() + ttl)
+        self.entries[key] = entry
+        self.size += entry.size
+        self.evict()
+
+    def remove(self, key: tuple[str, str]) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+        }
+
+
+response_cache = ResponseCache()
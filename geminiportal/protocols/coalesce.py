@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from asyncio.exceptions import IncompleteReadError
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING
+
+from geminiportal.protocols.cache import ResponseCache
+
+if TYPE_CHECKING:
+    from geminiportal.protocols.base import BaseRequest, BaseResponse
+
+_logger = logging.getLogger(__name__)
+
+# Number of body bytes that a flight holds on to for readers. Late joiners
+# can only attach while the start of the body is still in the buffer, and
+# the upstream download pauses when the slowest reader falls this far behind.
+FLIGHT_BUFFER_SIZE = 2**20
+
+
+class FlightReader:
+    """
+    Read the body of a shared upstream response from an independent position.
+
+    This implements the subset of the asyncio.StreamReader interface that is
+    used by BaseResponse.
+    """
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.position = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        return await self.flight.read(self, n)
+
+    async def readexactly(self, n: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < n:
+            chunk = await self.read(n - len(buffer))
+            if not chunk:
+                raise IncompleteReadError(bytes(buffer), n)
+            buffer += chunk
+        return bytes(buffer)
+
+    def close(self) -> None:
+        self.flight.unsubscribe(self)
+
+
+class Flight:
+    """
+    A single upstream request that one or more clients are waiting on.
+
+    The response header is shared with every reader, and the body is pumped
+    from the socket into a shared buffer that each reader consumes at its
+    own pace.
+    """
+
+    def __init__(self, key: tuple[str, str], buffer_size: int = FLIGHT_BUFFER_SIZE):
+        self.key = key
+        self.buffer_size = buffer_size
+
+        self.header: asyncio.Future[BaseResponse] = asyncio.get_running_loop().create_future()
+        self.header.add_done_callback(self._consume_exception)
+        self.task: asyncio.Task | None = None
+
+        self.readers: set[FlightReader] = set()
+        self.buffer = bytearray()
+        self.offset = 0  # Position of the first byte in the buffer
+        self.done = False
+        self.error: Exception | None = None
+
+        self._changed = asyncio.Event()
+
+    @staticmethod
+    def _consume_exception(future: asyncio.Future) -> None:
+        # Avoid "exception was never retrieved" warnings when every
+        # reader has already given up on the request.
+        if not future.cancelled():
+            future.exception()
+
+    @property
+    def joinable(self) -> bool:
+        """
+        New readers can only attach if they haven't missed any bytes.
+        """
+        return not self.done and self.offset == 0
+
+    def _notify(self) -> None:
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    def start(
+        self,
+        fetch: Callable[[], Awaitable[BaseResponse]],
+        on_done: Callable[[Flight], None],
+    ) -> None:
+        self.task = asyncio.create_task(self.run(fetch))
+        self.task.add_done_callback(lambda _: on_done(self))
+
+    def subscribe(self) -> FlightReader:
+        reader = FlightReader(self)
+        self.readers.add(reader)
+        return reader
+
+    def unsubscribe(self, reader: FlightReader) -> None:
+        self.readers.discard(reader)
+        self._notify()
+
+    async def get_response(self, request: BaseRequest, reader: FlightReader) -> BaseResponse:
+        """
+        Wait for the upstream header and return a response for the reader.
+        """
+        try:
+            # Shield so one client disconnecting doesn't cancel the request
+            # for everyone else.
+            response = await asyncio.shield(self.header)
+        except BaseException:
+            reader.close()
+            raise
+
+        return response.copy(request, reader)
+
+    async def run(self, fetch: Callable[[], Awaitable[BaseResponse]]) -> None:
+        try:
+            response = await fetch()
+        except asyncio.CancelledError:
+            self.header.cancel()
+            self.done = True
+            raise
+        except Exception as e:
+            self.header.set_exception(e)
+            self.done = True
+            return
+
+        self.header.set_result(response)
+        await self.pump(response)
+
+    async def pump(self, response: BaseResponse) -> None:
+        """
+        Copy the upstream body into the shared buffer.
+        """
+        stream = response.stream_body()
+        try:
+            async for chunk in stream:
+                while not self.has_capacity():
+                    await self._changed.wait()
+
+                if not self.readers:
+                    _logger.info("All readers disconnected, aborting upstream request")
+                    break
+
+                self.buffer += chunk
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            await stream.aclose()
+            self.done = True
+            self._notify()
+
+    def has_capacity(self) -> bool:
+        if not self.readers or len(self.buffer) < self.buffer_size:
+            return True
+
+        # Drop the bytes that every reader has already consumed
+        consumed = min(reader.position for reader in self.readers) - self.offset
+        if consumed > 0:
+            del self.buffer[:consumed]
+            self.offset += consumed
+
+        return len(self.buffer) < self.buffer_size
+
+    async def read(self, reader: FlightReader, n: int) -> bytes:
+        while reader.position >= self.offset + len(self.buffer) and not self.done:
+            await self._changed.wait()
+
+        start = reader.position - self.offset
+        if start >= len(self.buffer):
+            if self.error:
+                raise self.error
+            return b""
+
+        end = len(self.buffer) if n < 0 else start + n
+        data = bytes(self.buffer[start:end])
+        reader.position += len(data)
+        self._notify()
+        return data
+
+
+class RequestCoalescer:
+    """
+    Share a single upstream fetch between concurrent requests for the same URL.
+    """
+
+    def __init__(self, buffer_size: int = FLIGHT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.flights: dict[tuple[str, str], Flight] = {}
+
+        self.started = 0
+        self.joined = 0
+
+    async def get_response(
+        self,
+        request: BaseRequest,
+        fetch: Callable[[], Awaitable[BaseResponse]],
+    ) -> BaseResponse:
+        key = ResponseCache.get_key(request)
+
+        flight = self.flights.get(key)
+        if flight is not None and flight.joinable:
+            _logger.info(f"Joining in-flight request for {request.url}")
+            self.joined += 1
+        else:
+            self.started += 1
+            flight = self.flights[key] = Flight(key, self.buffer_size)
+
+        reader = flight.subscribe()
+        if flight.task is None:
+            flight.start(fetch, on_done=self.discard)
+
+        return await flight.get_response(request, reader)
+
+    def discard(self, flight: Flight) -> None:
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self.flights),
+            "started": self.started,
+            "joined": self.joined,
+        }
+
+
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import socket
+import time
+from collections import OrderedDict
+
+from geminiportal.protocols.dns import Address
+
+_logger = logging.getLogger(__name__)
+
+# Delay before starting a connection to the next address (RFC 8305, section 5)
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+# Weight given to the newest latency sample when updating an address score
+LATENCY_DECAY = 0.3
+
+# Score used for addresses that haven't been connected to before
+UNKNOWN_LATENCY = 1.0
+
+# Latency recorded for an address that refused or failed the connection
+FAILURE_LATENCY = 10.0
+
+# Number of hosts to remember address scores for
+ADDRESS_MEMORY_SIZE = 4096
+
+
+def interleave(addresses: list[Address]) -> list[Address]:
+    """
+    Alternate between address families, starting with the family of the
+    first address returned by the resolver (RFC 8305, section 4).
+    """
+    if not addresses:
+        return []
+
+    first_family = addresses[0][0]
+    primary = [a for a in addresses if a[0] == first_family]
+    secondary = [a for a in addresses if a[0] != first_family]
+
+    ordered = []
+    for i in range(max(len(primary), len(secondary))):
+        ordered.extend(primary[i : i + 1])
+        ordered.extend(secondary[i : i + 1])
+    return ordered
+
+
+class ConnectionRacer:
+    """
+    Open TCP connections by racing the resolved addresses for a host, and
+    remember how quickly each address connected so that the fastest one
+    is tried first next time.
+    """
+
+    def __init__(
+        self,
+        attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+        max_size: int = ADDRESS_MEMORY_SIZE,
+    ):
+        self.attempt_delay = attempt_delay
+        self.max_size = max_size
+        self.scores: OrderedDict[str, dict[str, float]] = OrderedDict()
+
+        self.connections = 0
+        self.attempts = 0
+        self.fallbacks = 0
+
+    def get_score(self, host: str, address: str) -> float:
+        return self.scores.get(host, {}).get(address, UNKNOWN_LATENCY)
+
+    def record(self, host: str, address: str, latency: float) -> None:
+        """
+        Blend a new latency sample into the score for the address.
+        """
+        scores = self.scores.setdefault(host, {})
+        self.scores.move_to_end(host)
+        if address in scores:
+            scores[address] += (latency - scores[address]) * LATENCY_DECAY
+        else:
+            scores[address] = latency
+
+        while len(self.scores) > self.max_size:
+            self.scores.popitem(last=False)
+
+    def record_loss(self, host: str, address: str, elapsed: float, winner_score: float) -> None:
+        """
+        Record an address whose attempt was cancelled because another one
+        connected first.
+
+        The time it ran for is a lower bound for its latency, and it's
+        always ranked behind the winner, even if it started too late to
+        have had a chance.
+        """
+        self.record(host, address, elapsed)
+        scores = self.scores[host]
+        scores[address] = max(scores[address], math.nextafter(winner_score, math.inf))
+
+    def sort(self, host: str, addresses: list[Address]) -> list[Address]:
+        ordered = interleave(addresses)
+        return sorted(ordered, key=lambda a: self.get_score(host, a[1]))
+
+    async def connect(self, host: str, port: int, addresses: list[Address]) -> socket.socket:
+        """
+        Return a connected socket for the first address to succeed.
+        """
+        self.connections += 1
+        remaining = self.sort(host, addresses)
+        first = remaining[0]
+
+        pending: set[asyncio.Task[socket.socket]] = set()
+        attempts: dict[asyncio.Task[socket.socket], Address] = {}
+        started: dict[asyncio.Task[socket.socket], float] = {}
+        errors: list[BaseException] = []
+        try:
+            while remaining or pending:
+                if remaining:
+                    address = remaining.pop(0)
+                    task = asyncio.create_task(self.attempt(host, port, address))
+                    attempts[task] = address
+                    started[task] = time.perf_counter()
+                    pending.add(task)
+
+                timeout = self.attempt_delay if remaining else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                winner = None
+                for task in done:
+                    error = task.exception()
+                    if error is not None:
+                        errors.append(error)
+                    elif winner is None:
+                        winner = task.result()
+                        winner_address = attempts[task]
+                        if winner_address != first:
+                            self.fallbacks += 1
+                    else:
+                        task.result().close()
+
+                if winner is not None:
+                    now = time.perf_counter()
+                    winner_score = self.get_score(host, winner_address[1])
+                    for task in pending:
+                        elapsed = now - started[task]
+                        self.record_loss(host, attempts[task][1], elapsed, winner_score)
+                    return winner
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise errors[0]
+
+    async def attempt(self, host: str, port: int, address: Address) -> socket.socket:
+        self.attempts += 1
+        family, ip = address
+
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+
+        start = time.perf_counter()
+        try:
+            await loop.sock_connect(sock, (ip, port))
+        except asyncio.CancelledError:
+            # Another address won the race, connect() records the loss
+            sock.close()
+            raise
+        except BaseException:
+            sock.close()
+            _logger.info(f"Connection to {ip} port {port} failed")
+            self.record(host, ip, FAILURE_LATENCY)
+            raise
+
+        self.record(host, ip, time.perf_counter() - start)
+        return sock
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hosts": len(self.scores),
+            "connections": self.connections,
+            "attempts": self.attempts,
+            "fallbacks": self.fallbacks,
+        }
+
+
+connection_racer = ConnectionRacer()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of hostnames to keep in the cache
+DNS_CACHE_SIZE = 4096
+
+# Seconds to cache successful lookups when the backend doesn't provide a TTL
+DNS_POSITIVE_TTL = 300
+
+# Seconds to cache failed lookups
+DNS_NEGATIVE_TTL = 30
+
+# A resolved address, as (socket family, IP address)
+Address = tuple[int, str]
+
+
+class ResolverBackend:
+    """
+    Performs the actual hostname lookups for the resolver.
+    """
+
+    async def resolve(self, host: str) -> tuple[list[Address], int | None]:
+        """
+        Return the addresses for the host, and a TTL in seconds if known.
+        """
+        raise NotImplementedError
+
+
+class GetaddrinfoBackend(ResolverBackend):
+    """
+    Resolve hostnames using the system resolver in the event loop's executor.
+    """
+
+    async def resolve(self, host: str) -> tuple[list[Address], int | None]:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+
+        addresses: list[Address] = []
+        for family, _, _, _, sockaddr in infos:
+            address = (family, str(sockaddr[0]))
+            if address not in addresses:
+                addresses.append(address)
+
+        return addresses, None
+
+
+@dataclass
+class DNSRecord:
+    addresses: list[Address]
+    error: socket.gaierror | None
+    expires: float
+
+
+class Resolver:
+    """
+    Caching DNS resolver for upstream hostnames.
+
+    Successful and failed lookups are both cached, and concurrent lookups
+    for the same hostname share a single query to the backend.
+    """
+
+    def __init__(
+        self,
+        backend: ResolverBackend | None = None,
+        max_size: int = DNS_CACHE_SIZE,
+        positive_ttl: int = DNS_POSITIVE_TTL,
+        negative_ttl: int = DNS_NEGATIVE_TTL,
+    ):
+        self.backend = backend or GetaddrinfoBackend()
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+
+        self.records: OrderedDict[str, DNSRecord] = OrderedDict()
+        self.pending: dict[str, asyncio.Task[DNSRecord]] = {}
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lookup_time = 0.0
+
+    async def resolve(self, host: str) -> list[Address]:
+        """
+        Return the list of addresses for the host.
+
+        Raises socket.gaierror if the host can't be resolved.
+        """
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            pass
+        else:
+            family = socket.AF_INET6 if ip.version == 6 else socket.AF_INET
+            return [(family, host)]
+
+        record = await self.get_record(host)
+        if record.error:
+            raise record.error
+
+        return record.addresses
+
+    async def get_record(self, host: str) -> DNSRecord:
+        key = host.lower()
+
+        record = self.records.get(key)
+        if record is not None and time.monotonic() < record.expires:
+            self.records.move_to_end(key)
+            if record.error:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return record
+
+        task = self.pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self.pending[key] = asyncio.create_task(self.lookup_and_store(key, host))
+            task.add_done_callback(lambda task: self.discard(key, task))
+
+        # The lookup runs in its own task and is shielded, so one caller
+        # giving up (e.g. the client disconnecting) doesn't cancel it for
+        # everyone else waiting on the same hostname.
+        return await asyncio.shield(task)
+
+    async def lookup_and_store(self, key: str, host: str) -> DNSRecord:
+        record = await self.lookup(host)
+        self.store(key, record)
+        return record
+
+    def discard(self, key: str, task: asyncio.Task[DNSRecord]) -> None:
+        if self.pending.get(key) is task:
+            del self.pending[key]
+
+        # Avoid "exception was never retrieved" warnings when every caller
+        # has already given up on the lookup.
+        if not task.cancelled():
+            task.exception()
+
+    async def lookup(self, host: str) -> DNSRecord:
+        start = time.perf_counter()
+        try:
+            addresses, ttl = await self.backend.resolve(host)
+        except socket.gaierror as e:
+            _logger.info(f"DNS lookup failed for {host}: {e}")
+            record = DNSRecord([], e, time.monotonic() + self.negative_ttl)
+        else:
+            if not addresses:
+                error = socket.gaierror(socket.EAI_NONAME, "No addresses found")
+                record = DNSRecord([], error, time.monotonic() + self.negative_ttl)
+            else:
+                ttl = self.positive_ttl if ttl is None else ttl
+                record = DNSRecord(addresses, None, time.monotonic() + ttl)
+        finally:
+            self.lookup_time += time.perf_counter() - start
+
+        return record
+
+    def store(self, key: str, record: DNSRecord) -> None:
+        self.records[key] = record
+        self.records.move_to_end(key)
+        while len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    def get_stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self.records),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+            "lookup_avg": self.lookup_time / self.misses if self.misses else 0.0,
+        }
+
+
+resolver = Resolver()
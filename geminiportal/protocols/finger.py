@@ -15,8 +15,7 @@ class FingerRequest(BaseRequest):
 
         request = unquote_to_bytes(self.url.finger_request)
 
-        writer.write(b"%s\r\n" % request)
-        await writer.drain()
+        await self.write_request(writer, b"%s\r\n" % request)
 
         return FingerResponse(self, reader, writer)
 
@@ -1,62 +1,47 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-import ssl
+import time
 
+from geminiportal.protocols.backoff import parse_backoff
 from geminiportal.protocols.base import BaseRequest, BaseResponse
+from geminiportal.protocols.tls import CloseNotifyState, ProxySSLContext, ssl_context
+from geminiportal.protocols.tlsinfo import tls_info_store
 
 _logger = logging.getLogger(__name__)
 
 
-class CloseNotifyState:
-    """
-    Inject into the SSL context to register if the TLS close_notify signal
-    was received at the end of the connection.
-    """
-
-    def __init__(self, context: ssl.SSLContext):
-        self.received: bool = False
-
-        def msg_callback(connection, direction, v, c, m, data):
-            if m == ssl._TLSAlertType.CLOSE_NOTIFY:  # type: ignore  # noqa
-                if direction == "read":
-                    _logger.info("CLOSE_NOTIFY received")
-                    self.received = True
-
-        # This is a private debugging hook provided by the SSL library
-        context._msg_callback = msg_callback  # type: ignore
-
-    def __bool__(self) -> bool:
-        return self.received
-
-
 class GeminiRequest(BaseRequest):
     """
     Encapsulates a gemini:// request.
     """
 
-    def create_ssl_context(self) -> ssl.SSLContext:
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        return context
+    def create_ssl_context(self) -> ProxySSLContext:
+        """
+        Return the process-wide SSL context, which is expensive to create.
+        """
+        return ssl_context
 
     async def fetch(self) -> GeminiResponse:
         context = self.create_ssl_context()
-        tls_close_notify = CloseNotifyState(context)
 
-        reader, writer = await self.open_connection(ssl=context)
+        start = time.perf_counter()
+        with context.connecting(self.port):
+            reader, writer = await self.open_connection(ssl=context)
         ssock = writer.get_extra_info("ssl_object")
+        context.session_cache.record_handshake(ssock.session_reused, time.perf_counter() - start)
+        context.save_session(self.host, self.port, ssock)
+        tls_close_notify = context.get_close_notify_state(ssock)
 
         tls_cert = ssock.getpeercert(True)
         tls_version = ssock.version()
         tls_cipher, _, _ = ssock.cipher()
 
         gemini_url = self.url.get_gemini_request_url()
-        writer.write(f"{gemini_url}\r\n".encode())
-        await writer.drain()
+        await self.write_request(writer, f"{gemini_url}\r\n".encode())
 
-        raw_header = await reader.readline()
+        raw_header = await self.read_header(reader, writer)
         status, meta = self.parse_header(raw_header)
 
         return GeminiResponse(
@@ -98,6 +83,7 @@ class GeminiResponse(BaseResponse):
     tls_version: str
     tls_cipher: str
     tls_close_notify: CloseNotifyState
+    tls_recorded: bool = False
 
     def __init__(
         self,
@@ -130,6 +116,37 @@ class GeminiResponse(BaseResponse):
     def tls_close_notify_received(self):
         return bool(self.tls_close_notify)
 
+    def close(self) -> None:
+        if self.writer is not None:
+            # TLS 1.3 session tickets are sent after the handshake, so check
+            # for an updated session before the connection goes away.
+            ssock = self.writer.get_extra_info("ssl_object")
+            if ssock is not None:
+                ssl_context.save_session(self.request.host, self.request.port, ssock)
+
+            if self.tls_cert and not self.tls_recorded:
+                self.tls_recorded = True
+                # Whether close_notify was sent is only known once the whole
+                # body has been read.
+                close_notify = None
+                if isinstance(self.reader, asyncio.StreamReader) and self.reader.at_eof():
+                    close_notify = self.tls_close_notify_received
+                tls_info_store.record(
+                    self.request.host,
+                    self.request.port,
+                    self.tls_cert,
+                    self.tls_version,
+                    self.tls_cipher,
+                    close_notify,
+                )
+
+        super().close()
+
+    def get_backoff(self) -> int | None:
+        if self.status == "44":
+            return parse_backoff(self.meta)
+        return None
+
     def is_input(self):
         return self.status.startswith("1")
 
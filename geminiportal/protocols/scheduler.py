@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from geminiportal.metrics import proxy_metrics
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of open upstream connections for the whole process
+SCHEDULER_MAX_CONNECTIONS = 256
+
+# Maximum number of open connections to a single upstream host
+SCHEDULER_MAX_HOST_CONNECTIONS = 8
+
+# Maximum number of requests waiting in line for a single upstream host
+SCHEDULER_MAX_HOST_QUEUE = 64
+
+# Seconds that a request may wait in line before giving up
+SCHEDULER_MAX_QUEUE_WAIT = 5.0
+
+
+class SchedulerBusyError(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class Waiter:
+    host: str
+    client: str
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+class UpstreamSlot:
+    """
+    Permission to hold a connection open to an upstream host.
+    """
+
+    def __init__(self, scheduler: UpstreamScheduler, host: str):
+        self.scheduler = scheduler
+        self.host = host
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self.host)
+
+
+class UpstreamScheduler:
+    """
+    Limit the number of concurrent upstream connections, both in total and
+    per-host. When the limits are reached, requests wait in line and are
+    served round-robin across hosts, and across client addresses for each
+    host, so a single busy crawler can't starve everyone else.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = SCHEDULER_MAX_CONNECTIONS,
+        max_host_connections: int = SCHEDULER_MAX_HOST_CONNECTIONS,
+        max_host_queue: int = SCHEDULER_MAX_HOST_QUEUE,
+        max_queue_wait: float = SCHEDULER_MAX_QUEUE_WAIT,
+    ):
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+        self.max_host_queue = max_host_queue
+        self.max_queue_wait = max_queue_wait
+
+        self.active = 0
+        self.active_hosts: dict[str, int] = {}
+
+        # host -> client -> waiters, the order of both levels is rotated
+        # every time a waiter is served.
+        self.queues: OrderedDict[str, OrderedDict[str, deque[Waiter]]] = OrderedDict()
+
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.queue_wait_time = 0.0
+        self.queue_wait_max = 0.0
+
+    def has_capacity(self, host: str) -> bool:
+        return (
+            self.active < self.max_connections
+            and self.active_hosts.get(host, 0) < self.max_host_connections
+        )
+
+    def get_queue_length(self, host: str) -> int:
+        return sum(len(waiters) for waiters in self.queues.get(host, {}).values())
+
+    async def acquire(self, host: str, client: str | None = None) -> UpstreamSlot:
+        """
+        Wait for a slot to open a connection to the host.
+
+        Raises SchedulerBusyError if the request can't be served in time.
+        """
+        if host not in self.queues and self.has_capacity(host):
+            return self.grant(host)
+
+        if self.get_queue_length(host) >= self.max_host_queue:
+            self.rejected += 1
+            raise SchedulerBusyError()
+
+        waiter = Waiter(host, client or "")
+        self.queues.setdefault(host, OrderedDict()).setdefault(waiter.client, deque()).append(
+            waiter
+        )
+        self.queued += 1
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(waiter.future, timeout=self.max_queue_wait)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted right as the waiter gave up
+                waiter.future.result().release()
+
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise SchedulerBusyError()
+            raise
+        finally:
+            self.discard(waiter)
+            elapsed = time.perf_counter() - start
+            self.queue_wait_time += elapsed
+            self.queue_wait_max = max(self.queue_wait_max, elapsed)
+
+    def grant(self, host: str) -> UpstreamSlot:
+        proxy_metrics.connection_opened()
+        self.active += 1
+        self.active_hosts[host] = self.active_hosts.get(host, 0) + 1
+        self.granted += 1
+        return UpstreamSlot(self, host)
+
+    def release(self, host: str) -> None:
+        proxy_metrics.connection_closed()
+        self.active -= 1
+        self.active_hosts[host] -= 1
+        if not self.active_hosts[host]:
+            del self.active_hosts[host]
+
+        self.dispatch()
+
+    def discard(self, waiter: Waiter) -> None:
+        """
+        Remove a waiter from the queue if it's still there.
+        """
+        clients = self.queues.get(waiter.host)
+        if clients is None:
+            return
+
+        waiters = clients.get(waiter.client)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del clients[waiter.client]
+            if not clients:
+                del self.queues[waiter.host]
+
+    def dispatch(self) -> None:
+        """
+        Hand out free slots to the next waiters in line.
+        """
+        while self.queues and self.active < self.max_connections:
+            for host in self.queues:
+                if self.has_capacity(host):
+                    break
+            else:
+                return
+
+            clients = self.queues[host]
+            client, waiters = next(iter(clients.items()))
+            waiter = waiters.popleft()
+
+            if waiters:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+
+            if clients:
+                self.queues.move_to_end(host)
+            else:
+                del self.queues[host]
+
+            if not waiter.future.done():
+                waiter.future.set_result(self.grant(host))
+
+    def get_stats(self) -> dict[str, int | float]:
+        return {
+            "active": self.active,
+            "active_hosts": len(self.active_hosts),
+            "waiting": sum(self.get_queue_length(host) for host in self.queues),
+            "granted": self.granted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "queue_wait_avg": self.queue_wait_time / self.queued if self.queued else 0.0,
+            "queue_wait_max": self.queue_wait_max,
+        }
+
+
+upstream_scheduler = UpstreamScheduler()
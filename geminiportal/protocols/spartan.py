@@ -20,10 +20,9 @@ class SpartanRequest(BaseRequest):
         encoded_path = quote_from_bytes(unquote_to_bytes(path)).encode("ascii")
 
         request = b"%s %s %d\r\n%b" % (encoded_host, encoded_path, len(data), data)
-        writer.write(request)
-        await writer.drain()
+        await self.write_request(writer, request)
 
-        raw_header = await reader.readline()
+        raw_header = await self.read_header(reader, writer)
         status, meta = self.parse_header(raw_header)
 
         return SpartanResponse(self, reader, writer, status, meta)
@@ -12,10 +12,9 @@ class TxtRequest(BaseRequest):
         reader, writer = await self.open_connection()
 
         gemini_url = self.url.get_gemini_request_url()
-        writer.write(f"{gemini_url}\r\n".encode())
-        await writer.drain()
+        await self.write_request(writer, f"{gemini_url}\r\n".encode())
 
-        raw_header = await reader.readline()
+        raw_header = await self.read_header(reader, writer)
         status, meta = self.parse_header(raw_header)
 
         return TxtResponse(self, reader, writer, status, meta)
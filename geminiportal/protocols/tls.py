@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import ssl
+import weakref
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_logger = logging.getLogger(__name__)
+
+# Number of servers to remember TLS sessions for
+TLS_SESSION_CACHE_SIZE = 2048
+
+# The port of the connection that's being opened in the current task, the
+# SSL context is only told the hostname when a connection is wrapped.
+connection_port: ContextVar[int | None] = ContextVar("connection_port", default=None)
+
+
+class CloseNotifyState:
+    """
+    Register if the TLS close_notify signal was received at the end of
+    the connection.
+    """
+
+    def __init__(self):
+        self.received: bool = False
+
+    def __bool__(self) -> bool:
+        return self.received
+
+
+class TLSSessionCache:
+    """
+    Remember the most recent TLS session for each server, so that repeat
+    connections can skip the full handshake.
+
+    Sessions are keyed by hostname and port, because different ports on
+    the same host are often entirely separate servers.
+    """
+
+    def __init__(self, max_size: int = TLS_SESSION_CACHE_SIZE):
+        self.max_size = max_size
+        self.sessions: OrderedDict[tuple[str, int], ssl.SSLSession] = OrderedDict()
+
+        self.handshakes = 0
+        self.resumed = 0
+        self.full_handshake_time = 0.0
+        self.resumed_handshake_time = 0.0
+
+    def get(self, hostname: str, port: int) -> ssl.SSLSession | None:
+        key = (hostname, port)
+        session = self.sessions.get(key)
+        if session is not None:
+            self.sessions.move_to_end(key)
+        return session
+
+    def store(self, hostname: str, port: int, session: ssl.SSLSession | None) -> None:
+        if session is None or not session.has_ticket and not session.id:
+            return
+
+        key = (hostname, port)
+        self.sessions[key] = session
+        self.sessions.move_to_end(key)
+        while len(self.sessions) > self.max_size:
+            self.sessions.popitem(last=False)
+
+    def discard(self, hostname: str, port: int) -> None:
+        self.sessions.pop((hostname, port), None)
+
+    def record_handshake(self, resumed: bool, elapsed: float) -> None:
+        """
+        Track the time spent establishing connections, including the handshake.
+        """
+        self.handshakes += 1
+        if resumed:
+            self.resumed += 1
+            self.resumed_handshake_time += elapsed
+        else:
+            self.full_handshake_time += elapsed
+
+    def get_stats(self) -> dict[str, int | float]:
+        full = self.handshakes - self.resumed
+        return {
+            "sessions": len(self.sessions),
+            "handshakes": self.handshakes,
+            "resumed": self.resumed,
+            "resumption_rate": self.resumed / self.handshakes if self.handshakes else 0.0,
+            "full_handshake_avg": self.full_handshake_time / full if full else 0.0,
+            "resumed_handshake_avg": (
+                self.resumed_handshake_time / self.resumed if self.resumed else 0.0
+            ),
+        }
+
+
+class ProxySSLContext(ssl.SSLContext):
+    """
+    A client context that's shared by every connection in the process.
+
+    Certificates are not verified (gemini uses TOFU), so loading the
+    system CA bundle is skipped entirely. Each connection gets its own
+    CloseNotifyState, and previous TLS sessions are offered to the
+    server to allow for resumption.
+    """
+
+    def __new__(cls, session_cache: TLSSessionCache):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, session_cache: TLSSessionCache):
+        self.session_cache = session_cache
+        self.close_notify_states: weakref.WeakKeyDictionary[
+            ssl.SSLObject, CloseNotifyState
+        ] = weakref.WeakKeyDictionary()
+
+        self.check_hostname = False
+        self.verify_mode = ssl.CERT_NONE
+
+        # This is a private debugging hook provided by the SSL library
+        self._msg_callback = self._on_message
+
+    def _on_message(self, connection, direction, v, c, m, data) -> None:
+        if m == ssl._TLSAlertType.CLOSE_NOTIFY:  # type: ignore  # noqa
+            if direction == "read":
+                _logger.info("CLOSE_NOTIFY received")
+                state = self.close_notify_states.get(connection)
+                if state is not None:
+                    state.received = True
+
+    def wrap_bio(
+        self,
+        incoming,
+        outgoing,
+        server_side=False,
+        server_hostname=None,
+        session=None,
+    ) -> ssl.SSLObject:
+        port = connection_port.get()
+        if session is None and server_hostname and port is not None:
+            session = self.session_cache.get(server_hostname, port)
+
+        ssl_object = super().wrap_bio(
+            incoming,
+            outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+        self.close_notify_states[ssl_object] = CloseNotifyState()
+        return ssl_object
+
+    def get_close_notify_state(self, ssl_object: ssl.SSLObject) -> CloseNotifyState:
+        return self.close_notify_states.setdefault(ssl_object, CloseNotifyState())
+
+    @contextmanager
+    def connecting(self, port: int) -> Iterator[None]:
+        """
+        Offer the sessions for the port to connections wrapped in the block.
+        """
+        token = connection_port.set(port)
+        try:
+            yield
+        finally:
+            connection_port.reset(token)
+
+    def save_session(self, hostname: str, port: int, ssl_object: ssl.SSLObject) -> None:
+        """
+        Store the session for the connection's server so it can be resumed.
+        """
+        self.session_cache.store(hostname, port, ssl_object.session)
+
+
+tls_session_cache = TLSSessionCache()
+
+ssl_context = ProxySSLContext(tls_session_cache)
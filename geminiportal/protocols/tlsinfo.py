@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass
+
+_logger = logging.getLogger(__name__)
+
+# The database is stored on the filesystem so that it's shared by every worker
+TLS_INFO_DB_NAME = os.path.join(tempfile.gettempdir(), "gemini-portal-tls.sqlite3")
+
+# Maximum number of hosts to keep in memory
+TLS_INFO_CACHE_SIZE = 2048
+
+# Seconds since a host was last seen that its TLS details are still shown
+# on the certificate page without contacting the server again.
+TLS_INFO_MAX_AGE = 60 * 10
+
+# Seconds to wait before writing to the database, so that the details
+# from many requests are saved in a single transaction.
+TLS_INFO_FLUSH_INTERVAL = 1.0
+
+
+@dataclass
+class TLSInfo:
+    """
+    The TLS details that were observed the last time that a host was
+    contacted.
+    """
+
+    host: str
+    port: int
+    cert: bytes
+    fingerprint: str
+    version: str
+    cipher: str
+
+    # None until a response body has been read to the end
+    close_notify: bool | None
+
+    # When the current certificate was first and last seen for the host
+    first_seen: float
+    last_seen: float
+
+
+@dataclass
+class TLSCertRecord:
+    """
+    A certificate that has been presented by a host, for the TOFU history.
+    """
+
+    fingerprint: str
+    first_seen: float
+    last_seen: float
+
+
+class TLSInfoDatabase:
+    """
+    Persistent TLS details in a SQLite database, shared by every worker.
+
+    All of the methods do blocking file I/O and should be called from a
+    thread.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.initialized = False
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_name, timeout=5)
+        if not self.initialized:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tls_hosts "
+                "(host TEXT, port INTEGER, cert BLOB, fingerprint TEXT, version TEXT, "
+                "cipher TEXT, close_notify INTEGER, first_seen REAL, last_seen REAL, "
+                "PRIMARY KEY (host, port))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tls_history "
+                "(host TEXT, port INTEGER, fingerprint TEXT, first_seen REAL, last_seen REAL, "
+                "PRIMARY KEY (host, port, fingerprint))"
+            )
+            self.initialized = True
+        return db
+
+    def load(self, host: str, port: int) -> TLSInfo | None:
+        with closing(self.connect()) as db:
+            row = db.execute(
+                "SELECT host, port, cert, fingerprint, version, cipher, close_notify, "
+                "first_seen, last_seen FROM tls_hosts WHERE host = ? AND port = ?",
+                (host, port),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        info = TLSInfo(*row)
+        if info.close_notify is not None:
+            info.close_notify = bool(info.close_notify)
+        return info
+
+    def load_history(self, host: str, port: int) -> list[TLSCertRecord]:
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT fingerprint, first_seen, last_seen FROM tls_history "
+                "WHERE host = ? AND port = ? ORDER BY first_seen DESC",
+                (host, port),
+            ).fetchall()
+
+        return [TLSCertRecord(*row) for row in rows]
+
+    def save(self, entries: list[TLSInfo]) -> None:
+        """
+        Write a batch of entries in a single transaction.
+
+        Other workers may have seen the host more recently, so the newest
+        details always win, and close_notify is only replaced once it's
+        known.
+        """
+        with closing(self.connect()) as db, db:
+            db.executemany(
+                "INSERT INTO tls_hosts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (host, port) DO UPDATE SET "
+                "cert = excluded.cert, "
+                "fingerprint = excluded.fingerprint, "
+                "version = excluded.version, "
+                "cipher = excluded.cipher, "
+                "close_notify = coalesce(excluded.close_notify, close_notify), "
+                "first_seen = CASE WHEN fingerprint = excluded.fingerprint "
+                "THEN min(first_seen, excluded.first_seen) ELSE excluded.first_seen END, "
+                "last_seen = excluded.last_seen "
+                "WHERE excluded.last_seen >= last_seen",
+                [
+                    (
+                        info.host,
+                        info.port,
+                        info.cert,
+                        info.fingerprint,
+                        info.version,
+                        info.cipher,
+                        info.close_notify,
+                        info.first_seen,
+                        info.last_seen,
+                    )
+                    for info in entries
+                ],
+            )
+            db.executemany(
+                "INSERT INTO tls_history VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (host, port, fingerprint) DO UPDATE SET "
+                "first_seen = min(first_seen, excluded.first_seen), "
+                "last_seen = max(last_seen, excluded.last_seen)",
+                [
+                    (info.host, info.port, info.fingerprint, info.first_seen, info.last_seen)
+                    for info in entries
+                ],
+            )
+
+
+class TLSInfoStore:
+    """
+    Keep track of the TLS details of every host that the portal connects
+    to, as a side effect of normal page loads.
+
+    This lets the certificate page be shown without making another request
+    to the server, and builds up a trust-on-first-use history of the
+    certificates that each capsule has presented.
+
+    Recent hosts are kept in memory, and new details are written to the
+    database in batches from a thread.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        max_size: int = TLS_INFO_CACHE_SIZE,
+        max_age: float = TLS_INFO_MAX_AGE,
+        flush_interval: float = TLS_INFO_FLUSH_INTERVAL,
+    ):
+        self.db = TLSInfoDatabase(db_name)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+
+        self.hosts: OrderedDict[tuple[str, int], TLSInfo] = OrderedDict()
+
+        # Entries that are waiting to be written to the database
+        self.pending: dict[tuple[str, int], TLSInfo] = {}
+        self.flush_task: asyncio.Task | None = None
+
+        self.recorded = 0
+        self.cert_changes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def record(
+        self,
+        host: str,
+        port: int,
+        cert: bytes,
+        version: str,
+        cipher: str,
+        close_notify: bool | None,
+    ) -> None:
+        """
+        Remember the TLS details from a completed connection.
+        """
+        key = (host, port)
+        now = time.time()
+        fingerprint = hashlib.sha256(cert).hexdigest()
+
+        previous = self.hosts.get(key)
+        if previous is not None and previous.fingerprint == fingerprint:
+            first_seen = previous.first_seen
+            if close_notify is None:
+                close_notify = previous.close_notify
+        else:
+            if previous is not None:
+                _logger.info(f"TLS certificate changed for {host}:{port}")
+                self.cert_changes += 1
+            first_seen = now
+
+        info = TLSInfo(
+            host, port, cert, fingerprint, version, cipher, close_notify, first_seen, now
+        )
+        self.remember(info)
+        self.recorded += 1
+
+        self.pending[key] = info
+        if self.flush_task is None:
+            try:
+                self.flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # Not called from the event loop, the entry is saved by the
+                # next flush instead.
+                pass
+
+    def remember(self, info: TLSInfo) -> None:
+        key = (info.host, info.port)
+        self.hosts[key] = info
+        self.hosts.move_to_end(key)
+        while len(self.hosts) > self.max_size:
+            self.hosts.popitem(last=False)
+
+    async def get(self, host: str, port: int) -> TLSInfo | None:
+        """
+        Return the most recent TLS details for the host, from any worker.
+        """
+        key = (host, port)
+        now = time.time()
+
+        info = self.hosts.get(key)
+        if info is not None and now - info.last_seen < self.max_age:
+            self.hosts.move_to_end(key)
+            return info
+
+        try:
+            stored = await asyncio.to_thread(self.db.load, host, port)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to load TLS details: {e}")
+            self.errors += 1
+            return info
+
+        if stored is not None and (info is None or stored.last_seen > info.last_seen):
+            self.remember(stored)
+            return stored
+        return info
+
+    async def get_fresh(self, host: str, port: int) -> TLSInfo | None:
+        """
+        Return the TLS details for the host if they're recent and complete
+        enough to show on the certificate page.
+        """
+        info = await self.get(host, port)
+        if (
+            info is None
+            or info.close_notify is None
+            or time.time() - info.last_seen >= self.max_age
+        ):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return info
+
+    async def get_history(self, host: str, port: int) -> list[TLSCertRecord]:
+        """
+        Return every certificate that the host has presented, newest first.
+        """
+        await self.flush()
+        try:
+            return await asyncio.to_thread(self.db.load_history, host, port)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to load TLS history: {e}")
+            self.errors += 1
+            return []
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write all of the pending entries to the database.
+        """
+        if not self.pending:
+            return
+
+        entries, self.pending = list(self.pending.values()), {}
+        try:
+            await asyncio.to_thread(self.db.save, entries)
+        except sqlite3.Error as e:
+            _logger.warning(f"Unable to save TLS details: {e}")
+            self.errors += 1
+        else:
+            self.writes += len(entries)
+
+    async def shutdown(self) -> None:
+        if self.flush_task:
+            self.flush_task.cancel()
+        await self.flush()
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hosts": len(self.hosts),
+            "recorded": self.recorded,
+            "cert_changes": self.cert_changes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_writes": len(self.pending),
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
+
+tls_info_store = TLSInfoStore(TLS_INFO_DB_NAME)
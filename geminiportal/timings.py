@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import time
+from collections.abc import AsyncIterable, Callable, Iterator
+from contextlib import contextmanager
+from types import TracebackType
+
+from quart.wrappers.response import ResponseBody
+
+# Phases of a proxied request, in the order that they happen
+PHASES = {
+    "dns": "DNS lookup",
+    "connect": "TCP connect",
+    "tls": "TLS handshake",
+    "write": "Request write",
+    "header": "Time to header",
+    "body": "Time to full body",
+    "decode": "Decode",
+    "handler": "Handler render",
+    "template": "Template render",
+}
+
+
+class RequestTimings:
+    """
+    Time spent in each phase of a proxied request, in seconds.
+
+    Phases that happen more than once (e.g. rendering several templates, or
+    decoding a streamed body one chunk at a time) are added together. The
+    handler phase includes any templates that the handler renders.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.durations: dict[str, float] = {}
+
+    def add(self, phase: str, duration: float) -> None:
+        self.durations[phase] = self.durations.get(phase, 0.0) + duration
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def get_total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def get_phases(self) -> list[tuple[str, float]]:
+        return [(phase, self.durations[phase]) for phase in PHASES if phase in self.durations]
+
+    def get_server_timing(self) -> str:
+        """
+        Format the timings for the HTTP Server-Timing header, in milliseconds.
+        """
+        metrics = [
+            f'{phase};dur={duration * 1000:.1f};desc="{PHASES[phase]}"'
+            for phase, duration in self.get_phases()
+        ]
+        metrics.append(f"total;dur={self.get_total() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def get_log_fields(self) -> dict[str, str]:
+        """
+        Return the timings for the access log, in milliseconds.
+        """
+        fields = {phase: f"{duration * 1000:.1f}" for phase, duration in self.get_phases()}
+        fields["total"] = f"{self.get_total() * 1000:.1f}"
+        return fields
+
+
+class ClosingResponseBody(ResponseBody):
+    """
+    Wrap a response body to call a function once it has been sent, so that
+    phases that happen while the body is streamed can be logged.
+    """
+
+    def __init__(self, body: ResponseBody, on_close: Callable[[], None]):
+        self.body = body
+        self.on_close = on_close
+
+    async def __aenter__(self) -> AsyncIterable:
+        return await self.body.__aenter__()
+
+    async def __aexit__(self, exc_type: type, exc_value: BaseException, tb: TracebackType) -> None:
+        try:
+            await self.body.__aexit__(exc_type, exc_value, tb)
+        finally:
+            self.on_close()
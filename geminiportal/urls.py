@@ -3,16 +3,71 @@ from __future__ import annotations
 import mimetypes
 import os
 import os.path
+import posixpath
+import re
 import urllib.parse
-from urllib.parse import quote, unquote_to_bytes, urljoin, urlparse, urlunparse
-
-from quart import url_for
+from functools import cached_property, lru_cache
+from types import MappingProxyType
+from typing import Any, NamedTuple
+from urllib.parse import (
+    quote,
+    unquote_to_bytes,
+    urljoin,
+    urlparse,
+    urlsplit,
+    urlunparse,
+)
 
-# Add custom mimetypes for extensions not defined by the filesystem
-mimetypes.add_type("text/gemini", ".gmi")
-mimetypes.add_type("text/gemini", ".gemini")
-mimetypes.add_type("text/x-rst", ".rst")
-mimetypes.add_type("application/gopher-menu", ".goph")
+from quart import current_app, url_for
+from werkzeug.urls import url_encode
+
+# Custom mimetypes for extensions not defined by the standard library
+CUSTOM_MIMETYPES = {
+    ".gmi": "text/gemini",
+    ".gemini": "text/gemini",
+    ".rst": "text/x-rst",
+    ".goph": "application/gopher-menu",
+}
+
+# Gopher item types that always map to the same mimetype, regardless of
+# the extension on the selector.
+GOPHER_MIMETYPES: dict[str, str | None] = {
+    "1": "application/gopher-menu",
+    "7": "application/gopher-menu",
+    "h": "text/html",
+    "H": "text/html",
+    "g": "image/gif",
+    "4": "application/binhex",
+    "2": None,
+    "8": None,
+    "3": None,
+    "i": None,
+    "+": None,
+}
+
+# Gopher item types that use the extension on the selector, with a fallback
+# for when the extension is unknown.
+GOPHER_DEFAULT_MIMETYPES = {
+    "d": "application/pdf",
+    "5": "application/octet-stream",
+    "9": "application/octet-stream",
+}
+
+# Gopher item types that use the extension on the selector only if it
+# agrees with the item type's major type, e.g. "s" for sound files.
+GOPHER_MAJOR_MIMETYPES = {
+    "s": ("audio/", "audio/wave"),
+    "0": ("text/", "text/plain"),
+}
+
+# Number of distinct file suffixes to keep mimetype guesses for
+MIMETYPE_CACHE_SIZE = 2**10
+
+# Number of parsed URLs to keep around for re-use
+URL_CACHE_SIZE = 2**14
+
+# Number of distinct links in a document to keep the resolved URLs for
+LINK_CACHE_SIZE = 2**12
 
 
 # Patch hardcoded URL schemes to support our niche protocols
@@ -32,6 +87,131 @@ _extend(
 )
 
 
+class MimetypeTables(NamedTuple):
+    types_map: MappingProxyType[str, str]
+    common_types: MappingProxyType[str, str]
+    suffix_map: MappingProxyType[str, str]
+    encodings_map: MappingProxyType[str, str]
+
+
+class MimetypeTable:
+    """
+    Guess mimetypes from file names with a frozen copy of the tables from
+    the mimetypes module.
+
+    The tables are copied from the mimetypes database, which reads the
+    system's mime.types files, plus our custom types, so guesses match
+    mimetypes.guess_type() without patching the global database. Reading
+    the files takes a few milliseconds, so it's put off until the first
+    guess instead of slowing down every worker's start up.
+
+    Guesses only depend on the suffix of the file name (e.g. ".tar.gz"), so
+    they are cached by suffix, and guessing for a link is usually a single
+    dictionary lookup.
+    """
+
+    def __init__(self, custom_types: dict[str, str] | None = None):
+        self.custom_types = custom_types or {}
+        self.guess_suffix = lru_cache(maxsize=MIMETYPE_CACHE_SIZE)(self._guess_suffix)
+
+    @cached_property
+    def tables(self) -> MimetypeTables:
+        # Creating a mimetypes.MimeTypes() instance initializes the global
+        # database anyway, so copy from that instead of reading the system
+        # files a second time.
+        if not mimetypes.inited:
+            mimetypes.init()
+
+        strict_types = dict(mimetypes.types_map)
+        strict_types.update(self.custom_types)
+        common_types = {
+            ext: mimetype
+            for ext, mimetype in mimetypes.common_types.items()
+            if ext not in strict_types
+        }
+        return MimetypeTables(
+            types_map=MappingProxyType(strict_types),
+            common_types=MappingProxyType(common_types),
+            suffix_map=MappingProxyType(dict(mimetypes.suffix_map)),
+            encodings_map=MappingProxyType(dict(mimetypes.encodings_map)),
+        )
+
+    def guess_type(self, path: str, strict: bool = True) -> str | None:
+        """
+        Equivalent to mimetypes.guess_type(path, strict)[0].
+        """
+        if path[:1] != "/":
+            # Relative paths might look like a scheme or a data URL, so they
+            # are never worth caching.
+            return self._guess_type(path)[0 if strict else 1]
+
+        filename = path[path.rfind("/") + 1 :].lstrip(".")
+        index = filename.find(".")
+        if index == -1:
+            return None
+        return self.guess_suffix(filename[index:])[0 if strict else 1]
+
+    def _guess_suffix(self, suffix: str) -> tuple[str | None, str | None]:
+        return self._guess_type(f"x{suffix}")
+
+    def _guess_type(self, url: str) -> tuple[str | None, str | None]:
+        """
+        Return the strict and non-strict guess for a URL, following the
+        steps in MimeTypes.guess_type().
+        """
+        try:
+            scheme = urlsplit(url).scheme
+        except ValueError:
+            # Not a valid URL, e.g. an unbalanced "[" in the netloc
+            scheme = ""
+        if scheme:
+            url = url.partition(":")[2]
+
+        if scheme == "data":
+            comma = url.find(",")
+            if comma < 0:
+                return None, None
+            semi = url.find(";", 0, comma)
+            mimetype = url[:semi] if semi >= 0 else url[:comma]
+            if "=" in mimetype or "/" not in mimetype:
+                mimetype = "text/plain"
+            return mimetype, mimetype
+
+        tables = self.tables
+        base, ext = posixpath.splitext(url)
+        while (ext_lower := ext.lower()) in tables.suffix_map:
+            base, ext = posixpath.splitext(base + tables.suffix_map[ext_lower])
+        if ext in tables.encodings_map:
+            base, ext = posixpath.splitext(base)
+
+        ext = ext.lower()
+        if ext in tables.types_map:
+            mimetype = tables.types_map[ext]
+            return mimetype, mimetype
+        return None, tables.common_types.get(ext)
+
+    def guess_gopher_type(self, item_type: str, selector: str) -> str | None:
+        """
+        Guess the mimetype for a gopher selector from its item type and the
+        extension on the selector.
+        """
+        if item_type in GOPHER_MIMETYPES:
+            return GOPHER_MIMETYPES[item_type]
+
+        mimetype = self.guess_type(selector)
+        if item_type in GOPHER_DEFAULT_MIMETYPES:
+            return mimetype or GOPHER_DEFAULT_MIMETYPES[item_type]
+        elif item_type in GOPHER_MAJOR_MIMETYPES:
+            major, default = GOPHER_MAJOR_MIMETYPES[item_type]
+            if mimetype and mimetype.startswith(major):
+                return mimetype
+            return default
+        return mimetype
+
+
+mimetype_table = MimetypeTable(CUSTOM_MIMETYPES)
+
+
 class URLReference:
     """
     Central class for all URL handling and manipulation.
@@ -43,6 +223,11 @@ class URLReference:
     This was copied from another project that I'm working on, which is why
     it handles gopher & other URL patterns that the proxy does not support
     (yet).
+
+    References are immutable and parsed URLs are kept in a bounded cache,
+    so the same string is only parsed once no matter how many times it
+    appears during a request. Derived values (the netloc, the normalized
+    URL, the root and parent URLs) are computed on first use and saved.
     """
 
     DEFAULT_PORTS: dict[str, int] = {
@@ -56,7 +241,53 @@ class URLReference:
         "finger": 79,
     }
 
-    def __init__(self, url: str, base: str | None = None):
+    __slots__ = (
+        "original",
+        "base",
+        "resolved",
+        "scheme",
+        "port",
+        "hostname",
+        "path",
+        "params",
+        "query",
+        "fragment",
+        "gopher_item_type",
+        "gopher_selector",
+        "gopher_search",
+        "_netloc",
+        "_url",
+        "_hash",
+        "_request_url",
+        "_root",
+        "_user_root",
+        "_parent",
+    )
+
+    original: str
+    base: str | None
+    resolved: str
+    scheme: str
+    port: int | None
+    hostname: str | None
+    path: str
+    params: str
+    query: str
+    fragment: str
+    gopher_item_type: str
+    gopher_selector: str
+    gopher_search: str
+
+    # Lazily computed, these slots are left empty until they're first used
+    _netloc: str
+    _url: str
+    _hash: int
+    _request_url: str
+    _root: URLReference | None
+    _user_root: URLReference | None
+    _parent: URLReference | None
+
+    def __new__(cls, url: str, base: str | None = None) -> URLReference:
         """
         Deconstruct the URL, so we can inspect and transform it.
 
@@ -65,52 +296,77 @@ class URLReference:
             base: The document that the URL was retrieved from,
                 this is used to resolve relative URLs.
         """
-        self.original = url
-        self.base = base
-        if base:
-            url = urljoin(base, url)
+        return cls._from_cache(url, base)
+
+    @classmethod
+    @lru_cache(maxsize=URL_CACHE_SIZE)
+    def _from_cache(cls, url: str, base: str | None) -> URLReference:
+        return cls.from_resolved(urljoin(base, url) if base else url, url, base)
+
+    @classmethod
+    def from_resolved(cls, url: str, original: str, base: str | None) -> URLReference:
+        """
+        Build a reference from a URL that has already been joined with its base.
+        """
+        obj = object.__new__(cls)
+        obj._parse(url, original, base)
+        return obj
+
+    def _parse(self, url: str, original: str, base: str | None) -> None:
+        set_attr = object.__setattr__
+        set_attr(self, "original", original)
+        set_attr(self, "base", base)
+        set_attr(self, "resolved", url)
 
         url_parts = urlparse(url)
+        scheme = url_parts.scheme
+        path = url_parts.path
 
-        self.scheme = url_parts.scheme
-        self.port = url_parts.port or self.DEFAULT_PORTS.get(self.scheme, None)
-        self.hostname = url_parts.hostname
+        set_attr(self, "scheme", scheme)
+        set_attr(self, "port", url_parts.port or self.DEFAULT_PORTS.get(scheme, None))
+        set_attr(self, "hostname", url_parts.hostname)
 
         # HTTP/Gemini/Spartan URL components (RFC 3986)
-        self.path = url_parts.path
-        self.params = url_parts.params
-        self.query = url_parts.query
-        self.fragment = url_parts.fragment
+        set_attr(self, "params", url_parts.params)
+        set_attr(self, "query", url_parts.query)
+        set_attr(self, "fragment", url_parts.fragment)
 
         # Remove the optional trailing slash
-        if self.path == "/":
-            self.path = ""
-
-        sections = url.split("/", maxsplit=3)
-
-        # https://datatracker.ietf.org/doc/html/draft-ietf-uri-url-finger
-        # Finger URLs parse differently after the authority component
-        self.finger_request = ""
-        if self.scheme == "finger" and len(sections) == 4:
-            self.finger_request = sections[3]
+        if path == "/":
+            path = ""
 
         # https://datatracker.ietf.org/doc/html/rfc4266
         # Gopher URLs parse differently after the authority component
-        self.gopher_item_type = ""
-        self.gopher_selector = ""
-        self.gopher_search = ""
-        if self.scheme in ("gopher", "gophers"):
+        item_type, selector, search = "", "", ""
+        if scheme in ("gopher", "gophers"):
+            sections = url.split("/", maxsplit=3)
             if len(sections) < 4 or sections[3] == "":
-                self.gopher_item_type = "1"
-                self.gopher_selector = ""
+                item_type = "1"
             else:
-                self.gopher_item_type = sections[3][0]
-                self.gopher_selector = sections[3][1:]
+                item_type = sections[3][0]
+                selector = sections[3][1:]
+
+            if "%09" in selector:
+                # Strip the search string & gopher+ data out of the selector and path
+                selector, search = selector.split("%09", maxsplit=1)
+                path = path.split("%09", maxsplit=1)[0]
+
+        set_attr(self, "path", path)
+        set_attr(self, "gopher_item_type", item_type)
+        set_attr(self, "gopher_selector", selector)
+        set_attr(self, "gopher_search", search)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
 
-        if "%09" in self.gopher_selector:
-            # Strip the search string & gopher+ data out of the selector and path
-            self.gopher_selector, self.gopher_search = self.gopher_selector.split("%09", maxsplit=1)
-            self.path = self.path.split("%09", maxsplit=1)[0]
+    def __copy__(self) -> URLReference:
+        return self
+
+    def __deepcopy__(self, memo: dict) -> URLReference:
+        return self
+
+    def __reduce__(self):
+        return URLReference.from_resolved, (self.resolved, self.original, self.base)
 
     def __str__(self):
         return self.get_url()
@@ -119,11 +375,49 @@ class URLReference:
         return f"URLReference: {self.get_url()}"
 
     def __eq__(self, other) -> bool:
-        if isinstance(other, URLReference):
+        if self is other:
+            return True
+        elif isinstance(other, URLReference):
             return self.get_url() == other.get_url()
         else:
             return False
 
+    def __hash__(self) -> int:
+        try:
+            return self._hash
+        except AttributeError:
+            value = hash(self.get_url())
+            object.__setattr__(self, "_hash", value)
+            return value
+
+    @property
+    def finger_request(self) -> str:
+        """
+        https://datatracker.ietf.org/doc/html/draft-ietf-uri-url-finger
+        Finger URLs parse differently after the authority component.
+        """
+        if self.scheme == "finger":
+            sections = self.resolved.split("/", maxsplit=3)
+            if len(sections) == 4:
+                return sections[3]
+        return ""
+
+    def replace(self, **parts: str) -> URLReference:
+        """
+        Return a new reference with some of the URL components replaced,
+        e.g. url.replace(query="hello").
+        """
+        components = {
+            "scheme": self.scheme,
+            "netloc": self.netloc,
+            "path": self.path,
+            "params": self.params,
+            "query": self.query,
+            "fragment": self.fragment,
+        }
+        components.update(parts)
+        return URLReference(urlunparse(tuple(components.values())))
+
     def guess_mimetype(self) -> str | None:
         """
         Guess the mimetype of the file/document that the URL is pointed to.
@@ -133,9 +427,9 @@ class URLReference:
             # here, because even though the path has no meaning in gopher, I'm
             # assuming most modern gopher servers are going to use HTTP-style
             # paths for file names.
-            return self.guess_gopher_mimetype(self.gopher_item_type, self.path)
+            return mimetype_table.guess_gopher_type(self.gopher_item_type, self.path)
         else:
-            return mimetypes.guess_type(self.path, strict=False)[0]
+            return mimetype_table.guess_type(self.path, strict=False)
 
     def get_external_indicator(self) -> str | None:
         """
@@ -165,12 +459,19 @@ class URLReference:
         """
         Return the normalized netloc value for constructing URLs.
         """
+        try:
+            return self._netloc
+        except AttributeError:
+            pass
+
         if self.port and self.port != self.DEFAULT_PORTS.get(self.scheme):
-            return f"{self.hostname}:{self.port}"
+            netloc = f"{self.hostname}:{self.port}"
         elif self.hostname:
-            return self.hostname
+            netloc = self.hostname
         else:
-            return ""
+            netloc = ""
+        object.__setattr__(self, "_netloc", netloc)
+        return netloc
 
     @property
     def conn_info(self) -> tuple[str, int]:
@@ -206,6 +507,17 @@ class URLReference:
         """
         Construct a normalized URL string.
         """
+        if not (include_query and include_fragment):
+            return self._get_url(include_query, include_fragment)
+
+        try:
+            return self._url
+        except AttributeError:
+            url = self._get_url(True, True)
+            object.__setattr__(self, "_url", url)
+            return url
+
+    def _get_url(self, include_query: bool, include_fragment: bool) -> str:
         if self.scheme == "finger":
             return self._get_finger_url()
         elif self.scheme in ("gopher", "gophers"):
@@ -226,6 +538,14 @@ class URLReference:
         """
         Get the URL formatted to be sent in a gemini request string.
         """
+        try:
+            return self._request_url
+        except AttributeError:
+            url = self._get_gemini_request_url()
+            object.__setattr__(self, "_request_url", url)
+            return url
+
+    def _get_gemini_request_url(self) -> str:
         path = self.path
         if self.scheme in ("gemini", "text") and path == "":
             # Add an optional trailing slash for gemini because of a quirk in
@@ -256,6 +576,15 @@ class URLReference:
         """
         Get the base component of the URL that denotes a unique site.
         """
+        name = "_user_root" if include_user_dirs else "_root"
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            root = self._get_root(include_user_dirs)
+            object.__setattr__(self, name, root)
+            return root
+
+    def _get_root(self, include_user_dirs: bool) -> URLReference | None:
         if self.scheme == "view-source":
             target = self.get_view_source_target()
             return target.get_root(include_user_dirs=include_user_dirs)
@@ -295,6 +624,14 @@ class URLReference:
         """
         Get the parent of the URL with the last path component stripped off.
         """
+        try:
+            return self._parent
+        except AttributeError:
+            parent = self._get_parent()
+            object.__setattr__(self, "_parent", parent)
+            return parent
+
+    def _get_parent(self) -> URLReference | None:
         path = self.path.rstrip("/")
         if not path:
             # We're already at the root URL
@@ -362,9 +699,14 @@ class URLReference:
                 raise AssertionError(f"Could not derive directory for url: {self}")
             return parent
 
-    def get_proxy_url(self, external=True, **query_params) -> str:
+    def get_proxy_url(
+        self, external=True, builder: ProxyURLBuilder | None = None, **query_params
+    ) -> str:
         """
         Build a https://portal.mozz.us/... proxy link for the given URL.
+
+        Pass a ProxyURLBuilder to skip url_for() when building many links
+        in the same request.
         """
         if self.scheme not in ("gemini", "spartan", "text", "finger"):
             if external:
@@ -373,7 +715,15 @@ class URLReference:
             raise ValueError("Unsupported URL scheme")
 
         path = urlunparse(("", "", self.path, self.params, self.query, ""))
-        if path:
+        if builder is not None:
+            return builder.build(
+                self.scheme,
+                self.netloc,
+                path.lstrip("/") if path else None,
+                self.fragment or None,
+                query_params,
+            )
+        elif path:
             return url_for(
                 "proxy-path",
                 scheme=self.scheme,
@@ -417,33 +767,179 @@ class URLReference:
         Attempt to guess a specific mimetype for a gopher selector based on the
         selector's item type and the extension on the selector.
         """
-        mimetype, _ = mimetypes.guess_type(selector)
-
-        if item_type in ("1", "7"):
-            mimetype = "application/gopher-menu"
-        elif item_type in ("h", "H"):
-            mimetype = "text/html"
-        elif item_type == "g":
-            mimetype = "image/gif"
-        elif item_type == "4":
-            mimetype = "application/binhex"
-        elif item_type == "d":
-            mimetype = mimetype or "application/pdf"
-        elif item_type in ("5", "9"):
-            mimetype = mimetype or "application/octet-stream"
-        elif item_type == "s":
-            if mimetype and mimetype.startswith("audio/"):
-                mimetype = mimetype
-            else:
-                mimetype = "audio/wave"
-        elif item_type == "0":
-            if mimetype and mimetype.startswith("text/"):
-                mimetype = mimetype
-            else:
-                mimetype = "text/plain"
-        elif item_type in ("2", "8", "3", "i", "+"):
-            mimetype = None
+        return mimetype_table.guess_gopher_type(item_type, selector)
+
+
+class ProxyURLBuilder:
+    """
+    Build links to the proxy-path and proxy-netloc endpoints without going
+    through url_for() for every link.
+
+    url_for() is called once per endpoint with placeholder values, to
+    capture the parts of the URL that depend on the current request (the
+    script root, or the server name for external URLs). The real values
+    are then quoted and filled in the same way that werkzeug's URL rules
+    would, so the output is identical to url_for().
+
+    A builder is only valid for the app/request context that created it.
+    """
+
+    PLACEHOLDERS = {
+        "scheme": "x0schemex0",
+        "netloc": "x0netlocx0",
+        "path": "x0pathx0",
+    }
+
+    # The characters that werkzeug's url_quote() leaves unescaped by default,
+    # on top of the ones that urllib's quote() always leaves unescaped.
+    QUOTE_SAFE = "/:$!'()*+,;"
+
+    _placeholder_re = re.compile("(" + "|".join(PLACEHOLDERS.values()) + ")")
+
+    def __init__(self):
+        url_map = current_app.url_map
+        self.charset = url_map.charset
+        self.sort_parameters = url_map.sort_parameters
+        self.sort_key = url_map.sort_key
+
+        self.netloc_template = self.compile("proxy-netloc", "scheme", "netloc")
+        self.path_template = self.compile("proxy-path", "scheme", "netloc", "path")
+
+    def compile(self, endpoint: str, *args: str) -> list[tuple[bool, str]]:
+        """
+        Split the URL for an endpoint into (is_dynamic, value) parts.
+        """
+        values: dict[str, Any] = {arg: self.PLACEHOLDERS[arg] for arg in args}
+        url = url_for(endpoint, **values)
+        names = {placeholder: name for name, placeholder in self.PLACEHOLDERS.items()}
+
+        template = []
+        for part in self._placeholder_re.split(url):
+            if part in names:
+                template.append((True, names[part]))
+            elif part:
+                template.append((False, part))
+        return template
+
+    def build(
+        self,
+        scheme: str,
+        netloc: str,
+        path: str | None,
+        anchor: str | None = None,
+        query_params: dict | None = None,
+    ) -> str:
+        if path is None:
+            template = self.netloc_template
+            values = {"scheme": scheme, "netloc": netloc}
         else:
-            mimetype = mimetype
+            template = self.path_template
+            values = {"scheme": scheme, "netloc": netloc, "path": path}
 
-        return mimetype
+        charset, safe = self.charset, self.QUOTE_SAFE
+        url = "".join(
+            quote(values[part], safe, charset) if is_dynamic else part
+            for is_dynamic, part in template
+        )
+
+        if query_params:
+            query_params = {k: v for k, v in query_params.items() if v is not None}
+            params = url_encode(query_params, charset, sort=self.sort_parameters, key=self.sort_key)
+            if params:
+                url = f"{url}?{params}"
+
+        if anchor is not None:
+            url = f"{url}#{quote(anchor, safe)}"
+
+        return url
+
+
+class LinkResolver:
+    """
+    Resolve the links in a single document against the document's URL.
+
+    The base URL is only built and parsed once, instead of for every link,
+    and the results for recent links are remembered because link-heavy
+    pages like directory listings and aggregators repeat the same targets.
+    """
+
+    def __init__(self, base: URLReference):
+        self.base = base
+        self.base_url = base.get_url()
+
+        parts = urlparse(self.base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path
+        self.params = parts.params
+        self.query = parts.query
+
+        # The directory segments that relative paths are resolved against
+        self.path_parts = self.path.split("/")
+        if self.path_parts[-1] != "":
+            del self.path_parts[-1]
+
+        self.builder: ProxyURLBuilder | None = None
+
+        self.resolve = lru_cache(maxsize=LINK_CACHE_SIZE)(self._resolve)
+        self.get_proxy_url = lru_cache(maxsize=LINK_CACHE_SIZE)(self._get_proxy_url)
+
+    def join(self, link: str) -> str:
+        """
+        Equivalent to urljoin(base_url, link).
+        """
+        if not self.base_url:
+            return link
+        if not link:
+            return self.base_url
+
+        scheme, netloc, path, params, query, fragment = urlparse(link, self.scheme)
+        if scheme != self.scheme or scheme not in urllib.parse.uses_relative:
+            return link
+        if scheme in urllib.parse.uses_netloc:
+            if netloc:
+                return urlunparse((scheme, netloc, path, params, query, fragment))
+            netloc = self.netloc
+
+        if not path and not params:
+            query = query or self.query
+            return urlunparse((scheme, netloc, self.path, self.params, query, fragment))
+
+        if path[:1] == "/":
+            segments = path.split("/")
+        else:
+            segments = self.path_parts + path.split("/")
+            # Filter out empty segments that would cause redundant slashes
+            segments[1:-1] = filter(None, segments[1:-1])
+
+        resolved_path: list[str] = []
+        for segment in segments:
+            if segment == "..":
+                if resolved_path:
+                    resolved_path.pop()
+            elif segment != ".":
+                resolved_path.append(segment)
+
+        if segments[-1] in (".", ".."):
+            resolved_path.append("")
+
+        path = "/".join(resolved_path) or "/"
+        return urlunparse((scheme, netloc, path, params, query, fragment))
+
+    def _resolve(self, link: str) -> URLReference:
+        """
+        Equivalent to base.join(link).
+        """
+        return URLReference.from_resolved(self.join(link), link, self.base_url)
+
+    def _get_proxy_url(self, link: str, raw: bool = False) -> str:
+        """
+        Build the proxy URL for a link in the document.
+        """
+        if self.builder is None:
+            self.builder = ProxyURLBuilder()
+
+        url = self.resolve(link)
+        if raw:
+            return url.get_proxy_url(builder=self.builder, raw=True)
+        return url.get_proxy_url(builder=self.builder)
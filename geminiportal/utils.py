@@ -1,16 +1,341 @@
+from __future__ import annotations
+
 import asyncio
-import subprocess
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+from cryptography.x509.oid import (
+    AuthorityInformationAccessOID,
+    ExtendedKeyUsageOID,
+    ExtensionOID,
+    NameOID,
+    SignatureAlgorithmOID,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of certificate descriptions to keep in memory
+CERT_CACHE_SIZE = 256
+
+# Names that openssl uses for certificate fields, where they differ from
+# the names used by the cryptography package.
+NAME_ATTRIBUTES = {
+    NameOID.EMAIL_ADDRESS: "emailAddress",
+}
+
+EXTENSION_NAMES = {
+    ExtensionOID.SUBJECT_KEY_IDENTIFIER: "X509v3 Subject Key Identifier",
+    ExtensionOID.AUTHORITY_KEY_IDENTIFIER: "X509v3 Authority Key Identifier",
+    ExtensionOID.BASIC_CONSTRAINTS: "X509v3 Basic Constraints",
+    ExtensionOID.SUBJECT_ALTERNATIVE_NAME: "X509v3 Subject Alternative Name",
+    ExtensionOID.ISSUER_ALTERNATIVE_NAME: "X509v3 Issuer Alternative Name",
+    ExtensionOID.KEY_USAGE: "X509v3 Key Usage",
+    ExtensionOID.EXTENDED_KEY_USAGE: "X509v3 Extended Key Usage",
+    ExtensionOID.CERTIFICATE_POLICIES: "X509v3 Certificate Policies",
+    ExtensionOID.CRL_DISTRIBUTION_POINTS: "X509v3 CRL Distribution Points",
+    ExtensionOID.AUTHORITY_INFORMATION_ACCESS: "Authority Information Access",
+}
+
+KEY_USAGES = {
+    "digital_signature": "Digital Signature",
+    "content_commitment": "Non Repudiation",
+    "key_encipherment": "Key Encipherment",
+    "data_encipherment": "Data Encipherment",
+    "key_agreement": "Key Agreement",
+    "key_cert_sign": "Certificate Sign",
+    "crl_sign": "CRL Sign",
+}
+
+EXTENDED_KEY_USAGES = {
+    ExtendedKeyUsageOID.SERVER_AUTH: "TLS Web Server Authentication",
+    ExtendedKeyUsageOID.CLIENT_AUTH: "TLS Web Client Authentication",
+    ExtendedKeyUsageOID.CODE_SIGNING: "Code Signing",
+    ExtendedKeyUsageOID.EMAIL_PROTECTION: "E-mail Protection",
+    ExtendedKeyUsageOID.TIME_STAMPING: "Time Stamping",
+    ExtendedKeyUsageOID.OCSP_SIGNING: "OCSP Signing",
+}
+
+ACCESS_METHODS = {
+    AuthorityInformationAccessOID.OCSP: "OCSP",
+    AuthorityInformationAccessOID.CA_ISSUERS: "CA Issuers",
+}
+
+# Names that openssl prints for signature algorithms, anything else is
+# printed as the dotted OID.
+SIGNATURE_ALGORITHMS = {
+    SignatureAlgorithmOID.RSA_WITH_MD5: "md5WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA1: "sha1WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA224: "sha224WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA256: "sha256WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA384: "sha384WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA512: "sha512WithRSAEncryption",
+    SignatureAlgorithmOID.RSA_WITH_SHA3_224: "RSA-SHA3-224",
+    SignatureAlgorithmOID.RSA_WITH_SHA3_256: "RSA-SHA3-256",
+    SignatureAlgorithmOID.RSA_WITH_SHA3_384: "RSA-SHA3-384",
+    SignatureAlgorithmOID.RSA_WITH_SHA3_512: "RSA-SHA3-512",
+    SignatureAlgorithmOID.RSASSA_PSS: "rsassaPss",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA1: "ecdsa-with-SHA1",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA224: "ecdsa-with-SHA224",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA256: "ecdsa-with-SHA256",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA384: "ecdsa-with-SHA384",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA512: "ecdsa-with-SHA512",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA3_224: "ecdsa_with_SHA3-224",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA3_256: "ecdsa_with_SHA3-256",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA3_384: "ecdsa_with_SHA3-384",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA3_512: "ecdsa_with_SHA3-512",
+    SignatureAlgorithmOID.DSA_WITH_SHA1: "dsaWithSHA1",
+    SignatureAlgorithmOID.DSA_WITH_SHA224: "dsa_with_SHA224",
+    SignatureAlgorithmOID.DSA_WITH_SHA256: "dsa_with_SHA256",
+    SignatureAlgorithmOID.DSA_WITH_SHA384: "dsa_with_SHA384",
+    SignatureAlgorithmOID.DSA_WITH_SHA512: "dsa_with_SHA512",
+    SignatureAlgorithmOID.ED25519: "ED25519",
+    SignatureAlgorithmOID.ED448: "ED448",
+}
+
+EC_CURVES = {
+    "secp256r1": ("prime256v1", "P-256"),
+    "secp384r1": ("secp384r1", "P-384"),
+    "secp521r1": ("secp521r1", "P-521"),
+}
+
+
+def format_hex(data: bytes, indent: int, width: int) -> list[str]:
+    """
+    Format bytes as colon separated hex lines, the way that openssl does.
+    """
+    lines = []
+    for i in range(0, len(data), width):
+        chunk = ":".join(f"{b:02x}" for b in data[i : i + width])
+        if i + width < len(data):
+            chunk += ":"
+        lines.append(" " * indent + chunk)
+    return lines
+
+
+def format_name(name: x509.Name) -> str:
+    parts = []
+    for attribute in name:
+        key = NAME_ATTRIBUTES.get(attribute.oid) or attribute.rfc4514_attribute_name
+        parts.append(f"{key} = {attribute.value!s}")
+    return ", ".join(parts)
+
+
+def format_date(date: datetime) -> str:
+    return f"{date:%b} {date.day:2d} {date:%H:%M:%S %Y} GMT"
+
+
+def format_general_name(name: x509.GeneralName) -> str:
+    if isinstance(name, x509.DNSName):
+        return f"DNS:{name.value}"
+    elif isinstance(name, x509.IPAddress):
+        return f"IP Address:{name.value}"
+    elif isinstance(name, x509.UniformResourceIdentifier):
+        return f"URI:{name.value}"
+    elif isinstance(name, x509.RFC822Name):
+        return f"email:{name.value}"
+    elif isinstance(name, x509.DirectoryName):
+        return f"DirName:{format_name(name.value)}"
+    return str(name.value)
+
+
+def format_public_key(cert: x509.Certificate) -> list[str]:
+    key = cert.public_key()
+    if isinstance(key, rsa.RSAPublicKey):
+        numbers = key.public_numbers()
+        modulus = numbers.n.to_bytes(key.key_size // 8 + 1, "big")
+        return [
+            "Public Key Algorithm: rsaEncryption",
+            f"    Public-Key: ({key.key_size} bit)",
+            "    Modulus:",
+            *format_hex(modulus, 8, 15),
+            f"    Exponent: {numbers.e} (0x{numbers.e:x})",
+        ]
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        point = key.public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        asn1_oid, nist_curve = EC_CURVES.get(key.curve.name, (key.curve.name, None))
+        lines = [
+            "Public Key Algorithm: id-ecPublicKey",
+            f"    Public-Key: ({key.key_size} bit)",
+            "    pub:",
+            *format_hex(point, 8, 15),
+            f"    ASN1 OID: {asn1_oid}",
+        ]
+        if nist_curve:
+            lines.append(f"    NIST CURVE: {nist_curve}")
+        return lines
+    elif isinstance(key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        algorithm = "ED25519" if isinstance(key, ed25519.Ed25519PublicKey) else "ED448"
+        raw = key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        return [
+            f"Public Key Algorithm: {algorithm}",
+            f"    {algorithm} Public-Key:",
+            "    pub:",
+            *format_hex(raw, 8, 15),
+        ]
+    return [f"Public Key Algorithm: {cert.public_key_algorithm_oid.dotted_string}"]
+
+
+def format_extension_value(extension: x509.Extension) -> list[str]:
+    value = extension.value
+    if isinstance(value, x509.SubjectKeyIdentifier):
+        return [value.digest.hex(":").upper()]
+    elif isinstance(value, x509.AuthorityKeyIdentifier) and value.key_identifier:
+        return [value.key_identifier.hex(":").upper()]
+    elif isinstance(value, x509.BasicConstraints):
+        text = f"CA:{str(value.ca).upper()}"
+        if value.path_length is not None:
+            text += f", pathlen:{value.path_length}"
+        return [text]
+    elif isinstance(value, (x509.SubjectAlternativeName, x509.IssuerAlternativeName)):
+        return [", ".join(format_general_name(name) for name in value)]
+    elif isinstance(value, x509.KeyUsage):
+        usages = [name for attr, name in KEY_USAGES.items() if getattr(value, attr)]
+        if value.key_agreement:
+            if value.encipher_only:
+                usages.append("Encipher Only")
+            if value.decipher_only:
+                usages.append("Decipher Only")
+        return [", ".join(usages)]
+    elif isinstance(value, x509.ExtendedKeyUsage):
+        return [", ".join(EXTENDED_KEY_USAGES.get(oid, oid.dotted_string) for oid in value)]
+    elif isinstance(value, x509.CertificatePolicies):
+        return [f"Policy: {policy.policy_identifier.dotted_string}" for policy in value]
+    elif isinstance(value, x509.CRLDistributionPoints):
+        lines = []
+        for point in value:
+            lines.append("Full Name:")
+            lines += [f"  {format_general_name(name)}" for name in point.full_name or []]
+        return lines
+    elif isinstance(value, x509.AuthorityInformationAccess):
+        return [
+            f"{ACCESS_METHODS.get(desc.access_method, desc.access_method.dotted_string)} - "
+            f"{format_general_name(desc.access_location)}"
+            for desc in value
+        ]
+
+    try:
+        data = value.public_bytes()
+    except (AttributeError, NotImplementedError):
+        return [str(value)]
+    return [data.hex(":")]
+
+
+def format_tls_cert(tls_cert: bytes) -> str:
+    """
+    Describe a DER encoded certificate in the same layout as the output of
+    "openssl x509 -inform DER -text".
+    """
+    cert = x509.load_der_x509_certificate(tls_cert)
+
+    serial = cert.serial_number
+    if serial.bit_length() < 64:
+        serial_lines = [f"        Serial Number: {serial} (0x{serial:x})"]
+    else:
+        serial_bytes = serial.to_bytes((serial.bit_length() + 7) // 8, "big")
+        serial_lines = ["        Serial Number:", *format_hex(serial_bytes, 12, len(serial_bytes))]
+
+    oid = cert.signature_algorithm_oid
+    signature_algorithm = SIGNATURE_ALGORITHMS.get(oid, oid.dotted_string)
+    version = cert.version.value
+
+    lines = [
+        "Certificate:",
+        "    Data:",
+        f"        Version: {version + 1} (0x{version:x})",
+        *serial_lines,
+        f"        Signature Algorithm: {signature_algorithm}",
+        f"        Issuer: {format_name(cert.issuer)}",
+        "        Validity",
+        f"            Not Before: {format_date(cert.not_valid_before_utc)}",
+        f"            Not After : {format_date(cert.not_valid_after_utc)}",
+        f"        Subject: {format_name(cert.subject)}",
+        "        Subject Public Key Info:",
+        *["            " + line for line in format_public_key(cert)],
+    ]
+
+    if cert.extensions:
+        lines.append("        X509v3 extensions:")
+        for extension in cert.extensions:
+            name = EXTENSION_NAMES.get(extension.oid, extension.oid.dotted_string)
+            critical = "critical" if extension.critical else ""
+            lines.append(f"            {name}: {critical}")
+            lines += ["                " + line for line in format_extension_value(extension)]
+
+    lines += [
+        f"    Signature Algorithm: {signature_algorithm}",
+        "    Signature Value:",
+        *format_hex(cert.signature, 8, 18),
+        cert.public_bytes(serialization.Encoding.PEM).decode(),
+    ]
+    return "\n".join(lines)
+
+
+class TLSCertDescriptionCache:
+    """
+    Remember the descriptions of recently viewed certificates, keyed by
+    their SHA-256 fingerprint.
+
+    Certificates are parsed in a thread so that large certificates don't
+    hold up the event loop.
+    """
+
+    def __init__(self, max_size: int = CERT_CACHE_SIZE):
+        self.max_size = max_size
+        self.descriptions: OrderedDict[bytes, str] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def describe(self, tls_cert: bytes | None) -> str:
+        if not tls_cert:
+            # The server didn't present a certificate
+            return ""
+
+        fingerprint = hashlib.sha256(tls_cert).digest()
+
+        if fingerprint in self.descriptions:
+            self.descriptions.move_to_end(fingerprint)
+            self.hits += 1
+            return self.descriptions[fingerprint]
+
+        self.misses += 1
+        try:
+            description = await asyncio.to_thread(format_tls_cert, tls_cert)
+        except Exception as e:
+            # Malformed certificates can fail in many ways besides ValueError
+            # (e.g. x509.DuplicateExtension), none of them should break the page.
+            _logger.warning(f"Unable to parse TLS certificate: {e!r}")
+            self.errors += 1
+            return ""
+
+        self.descriptions[fingerprint] = description
+        while len(self.descriptions) > self.max_size:
+            self.descriptions.popitem(last=False)
+
+        return description
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.descriptions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+
+tls_cert_cache = TLSCertDescriptionCache()
 
 
-async def describe_tls_cert(tls_cert: bytes) -> str:
+async def describe_tls_cert(tls_cert: bytes | None) -> str:
     """
-    Use openssl to print details about the given TLS certificate data.
+    Print details about the given TLS certificate data.
     """
-    proc = await asyncio.create_subprocess_exec(
-        *["openssl", "x509", "-inform", "DER", "-text"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = await proc.communicate(tls_cert)
-    return stdout.decode(errors="ignore")
+    return await tls_cert_cache.describe(tls_cert)
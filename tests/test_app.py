@@ -1,5 +1,8 @@
 import pytest
 
+from geminiportal.protocols.base import BaseRequest, ProxyError
+from tests.test_cache import build_gemini_response
+
 
 async def test_get_robots(client):
     response = await client.get("/robots.txt")
@@ -83,3 +86,138 @@ async def test_gemini_handler_raw_response(client):
     response = await client.get("/gemini/mozz.us/?raw=1")
     assert response.status_code == 200
     assert response.mimetype == "text/plain"
+
+
+@pytest.fixture()
+def early_flush(app, monkeypatch):
+    monkeypatch.setitem(app.config, "EARLY_FLUSH", True)
+
+    def mock_response(status, meta, body=b""):
+        async def get_response(request):
+            return build_gemini_response(request.url.get_url(), status, meta, body)
+
+        monkeypatch.setattr(BaseRequest, "get_response", get_response)
+
+    return mock_response
+
+
+async def test_early_flush_success(client, early_flush):
+    early_flush("20", "text/gemini", b"# Hello\n")
+    response = await client.get("/gemini/mozz.us/")
+    assert response.status_code == 200
+    assert "rel=preload" in response.headers["Link"]
+
+    page = await response.get_data(as_text=True)
+    assert page.count("<html>") == 1
+    assert page.count('class="url-div"') == 1
+    assert "<!-- flush -->" not in page
+    assert "<h1 id=hello>Hello</h1>" in page
+
+
+async def test_early_flush_redirect(client, early_flush):
+    early_flush("30", "/journal/")
+    response = await client.get("/gemini/mozz.us/journal")
+    assert response.status_code == 200
+
+    page = await response.get_data(as_text=True)
+    assert '<meta http-equiv="refresh" content="0; url=/gemini/mozz.us/journal/">' in page
+
+
+async def test_early_flush_error(client, early_flush, monkeypatch):
+    async def get_response(request):
+        raise ProxyError("Connection error")
+
+    monkeypatch.setattr(BaseRequest, "get_response", get_response)
+    response = await client.get("/gemini/mozz.us/")
+    page = await response.get_data(as_text=True)
+    assert page.count("<html>") == 1
+    assert "Gateway Error" in page
+
+
+async def test_early_flush_raw_response(client, early_flush):
+    early_flush("30", "/journal/")
+    response = await client.get("/gemini/mozz.us/journal?raw=1")
+    assert response.status_code == 307
+    assert "Link" not in response.headers
+
+
+async def test_early_flush_html_response(client, early_flush):
+    early_flush("20", "text/html", b"<html><body>Upstream page</body></html>")
+    response = await client.get("/gemini/mozz.us/page.html")
+    assert response.status_code == 200
+
+    page = await response.get_data(as_text=True)
+    assert page.count("<html>") == 1
+    assert page.rstrip().endswith("</html>")
+    assert "Upstream page" not in page
+    assert '<meta http-equiv="refresh" content="0; url=/gemini/mozz.us/page.html?raw=1">' in page
+
+
+async def test_early_flush_body_without_marker(client, early_flush):
+    early_flush("20", "application/octet-stream", b"\x00" * 100_000)
+    response = await client.get("/gemini/mozz.us/file.bin")
+    assert response.status_code == 200
+
+    page = await response.get_data(as_text=True)
+    assert page.count("<html>") == 1
+    assert page.rstrip().endswith("</html>")
+    assert '<meta http-equiv="refresh" content="0; url=/gemini/mozz.us/file.bin?raw=1">' in page
+
+
+@pytest.fixture()
+def mock_response(monkeypatch):
+    def mock_response(status, meta, body=b""):
+        async def get_response(request):
+            response = build_gemini_response(request.url.get_url(), status, meta, body)
+            response.request = request
+            return response
+
+        monkeypatch.setattr(BaseRequest, "get_response", get_response)
+
+    return mock_response
+
+
+async def test_server_timing(client, mock_response, caplog):
+    mock_response("20", "text/plain", b"Hello\n")
+    with caplog.at_level("INFO", logger="geminiportal.access"):
+        response = await client.get("/gemini/mozz.us/")
+        await response.get_data()
+
+    # The body is streamed after the headers are sent
+    server_timing = response.headers["Server-Timing"]
+    assert "handler;dur=" in server_timing
+    assert "template;dur=" in server_timing
+    assert "body;dur=" not in server_timing
+    assert "total;dur=" in server_timing
+
+    (record,) = [r for r in caplog.records if r.name == "geminiportal.access"]
+    message = record.getMessage()
+    assert "url=gemini://mozz.us status=200 upstream_status=20" in message
+    assert " body=" in message
+    assert " decode=" in message
+    assert " total=" in message
+
+
+async def test_server_timing_not_proxied(client):
+    response = await client.get("/about")
+    assert "Server-Timing" not in response.headers
+
+
+async def test_metrics_disabled(client):
+    response = await client.get("/metrics")
+    assert response.status_code == 404
+
+
+async def test_metrics(app, client, mock_response, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_ENABLED", True)
+    mock_response("20", "text/plain", b"Hello\n")
+    response = await client.get("/gemini/mozz.us/")
+    await response.get_data()
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    page = await response.get_data(as_text=True)
+    assert 'geminiportal_requests_total{scheme="gemini",status="20"}' in page
+    assert 'geminiportal_handler_responses_total{handler="TextHandler"}' in page
@@ -0,0 +1,148 @@
+import time
+from contextlib import closing
+
+import pytest
+
+from geminiportal.protocols import GeminiRequest
+from geminiportal.protocols.backoff import BACKOFF_DEFAULT, BackoffTable, parse_backoff
+from geminiportal.protocols.base import ProxySlowDownError
+from geminiportal.protocols.cache import ResponseCache
+from geminiportal.urls import URLReference
+from tests.test_cache import build_gemini_response
+
+
+@pytest.fixture
+async def table(tmp_path, monkeypatch):
+    table = BackoffTable(str(tmp_path / "backoff.sqlite3"))
+    monkeypatch.setattr("geminiportal.protocols.base.backoff_table", table)
+    yield table
+    await table.shutdown()
+
+
+def test_parse_backoff():
+    assert parse_backoff("10") == 10
+    assert parse_backoff(" 5 ") == 5
+    assert parse_backoff("0") == 1
+    assert parse_backoff("Please slow down") == BACKOFF_DEFAULT
+    assert parse_backoff("99999999") == 60 * 60
+
+
+def test_gemini_response_backoff():
+    assert build_gemini_response("gemini://mozz.us/", "44", "30").get_backoff() == 30
+    assert build_gemini_response("gemini://mozz.us/", "20", "30").get_backoff() is None
+
+
+def test_backoff_record(table):
+    assert table.get_retry_in("mozz.us") == 0
+    table.record("mozz.us", 30)
+    assert 29 < table.get_retry_in("mozz.us") <= 30
+    assert table.get_retry_in("example.com") == 0
+
+    table.deadlines["mozz.us"] = time.time() - 1
+    assert table.get_retry_in("mozz.us") == 0
+    assert "mozz.us" not in table.deadlines
+
+
+async def test_backoff_shared_between_workers(tmp_path):
+    db_name = str(tmp_path / "backoff.sqlite3")
+    worker_1 = BackoffTable(db_name)
+    worker_2 = BackoffTable(db_name)
+
+    worker_1.record("mozz.us", 30)
+    await worker_1.flush()
+    await worker_2.sync()
+    assert worker_2.get_retry_in("mozz.us") > 0
+
+    # A shorter deadline doesn't overwrite a longer one
+    worker_2.record("mozz.us", 5)
+    await worker_2.flush()
+    await worker_1.sync()
+    assert worker_1.get_retry_in("mozz.us") > 5
+    assert worker_1.get_stats()["errors"] == 0
+
+    await worker_1.shutdown()
+    await worker_2.shutdown()
+
+
+async def test_backoff_writes_behind(table, monkeypatch):
+    table.record("mozz.us", 30)
+    assert table.pending
+    assert table.flush_task is not None
+    await table.flush_task
+    assert not table.pending
+
+    # Checking a host only reads the local copy, the database is loaded in
+    # the background.
+    def load(now):
+        raise AssertionError("Loaded on the request path")
+
+    monkeypatch.setattr(table, "load", load)
+    table.last_sync = 0
+    assert table.get_retry_in("mozz.us") > 0
+    assert table.sync_task is not None
+    with pytest.raises(AssertionError):
+        await table.sync_task
+
+
+async def test_backoff_sync_is_read_only(table):
+    table.save([("mozz.us", time.time() - 1), ("example.com", time.time() + 30)])
+
+    # Syncing skips the expired deadline without deleting it
+    with closing(table.connect()) as db:
+        db.execute("BEGIN IMMEDIATE")
+        await table.sync()
+        db.rollback()
+    assert table.get_stats()["errors"] == 0
+    assert set(table.deadlines) == {"example.com"}
+
+    with closing(table.connect()) as db:
+        assert db.execute("SELECT count(*) FROM backoff").fetchone() == (2,)
+
+    # Writing prunes it
+    table.save([("example.org", time.time() + 30)])
+    with closing(table.connect()) as db:
+        hosts = {host for host, in db.execute("SELECT host FROM backoff")}
+    assert hosts == {"example.com", "example.org"}
+
+
+async def test_backoff_serves_stale_response(table, monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr("geminiportal.protocols.base.response_cache", cache)
+
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+    key = cache.get_key(response.request)
+    cache.store(key, response, b"# Hello")
+    cache.entries[key].expires = time.time() - 1
+    table.record("mozz.us", 60)
+
+    request = GeminiRequest(URLReference("gemini://mozz.us/"))
+    stale = await request.get_response()
+    assert await stale.get_body() == b"# Hello"
+    assert cache.get_stats()["stale_hits"] == 1
+
+
+async def test_backoff_fails_fast(table):
+    table.record("mozz.us", 60)
+
+    request = GeminiRequest(URLReference("gemini://mozz.us/uncached"))
+    with pytest.raises(ProxySlowDownError) as e:
+        await request.get_response()
+    assert e.value.retry_after > 5
+
+
+async def test_backoff_waits_for_short_deadline(table, monkeypatch):
+    monkeypatch.setattr("geminiportal.protocols.base.BACKOFF_MAX_QUEUE_WAIT", 1)
+    table.record("mozz.us", 1)
+    table.deadlines["mozz.us"] -= 0.95
+    table.pending["mozz.us"] -= 0.95
+
+    request = GeminiRequest(URLReference("gemini://mozz.us/uncached"))
+    upstream = build_gemini_response("gemini://mozz.us/uncached", "51", "Not found")
+
+    async def get_upstream_response():
+        assert table.get_retry_in("mozz.us") == 0
+        return upstream
+
+    request.get_upstream_response = get_upstream_response
+    response = await request.get_response()
+    assert response.status == "51"
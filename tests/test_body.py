@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from geminiportal.protocols import SpartanRequest
+from geminiportal.protocols.base import MAX_BODY_SIZE, ProxyResponseSizeError
+from geminiportal.protocols.spartan import SpartanResponse
+from geminiportal.urls import URLReference
+
+
+def build_response(body: bytes, eof: bool = True) -> SpartanResponse:
+    reader = asyncio.StreamReader()
+    reader.feed_data(body)
+    if eof:
+        reader.feed_eof()
+
+    request = SpartanRequest(URLReference("spartan://mozz.us/"))
+    return SpartanResponse(request, reader, None, "2", "text/plain")
+
+
+async def test_get_body():
+    body = await build_response(b"Hello world").get_body()
+    assert body == b"Hello world"
+    assert body.decode() == "Hello world"
+
+
+async def test_get_body_empty():
+    assert await build_response(b"").get_body() == b""
+
+
+async def test_get_body_below_limit():
+    body = await build_response(b"a" * (MAX_BODY_SIZE - 1)).get_body()
+    assert len(body) == MAX_BODY_SIZE - 1
+
+
+async def test_get_body_at_limit():
+    with pytest.raises(ProxyResponseSizeError):
+        await build_response(b"a" * MAX_BODY_SIZE).get_body()
+
+
+async def test_get_body_oversize_stops_early():
+    # The server never finishes, the limit is enforced without waiting for EOF
+    response = build_response(b"a" * (MAX_BODY_SIZE * 2), eof=False)
+    with pytest.raises(ProxyResponseSizeError):
+        await response.get_body()
+
+    assert len(await response.reader.read(MAX_BODY_SIZE * 2)) == MAX_BODY_SIZE
@@ -0,0 +1,97 @@
+import pytest
+
+from geminiportal.protocols import GeminiRequest
+from geminiportal.protocols.base import ProxyCircuitOpenError
+from geminiportal.protocols.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from geminiportal.urls import URLReference
+
+KEY = ("mozz.us", 1965)
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3)
+    for _ in range(2):
+        breaker.record_failure(KEY)
+        assert breaker.allow(KEY)
+
+    breaker.record_failure(KEY)
+    assert breaker.circuits[KEY].state == OPEN
+    assert not breaker.allow(KEY)
+    assert breaker.get_stats()["rejected"] == 1
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure(KEY)
+    breaker.record_failure(KEY)
+    breaker.record_success(KEY)
+    breaker.record_failure(KEY)
+    assert breaker.allow(KEY)
+
+
+def test_breaker_half_open_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure(KEY)
+
+    assert breaker.allow(KEY)
+    assert breaker.circuits[KEY].state == HALF_OPEN
+    assert not breaker.allow(KEY)
+
+    breaker.record_success(KEY)
+    assert KEY not in breaker.circuits
+    assert breaker.allow(KEY)
+
+
+def test_breaker_half_open_retry_in():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, probe_timeout=10)
+    breaker.record_failure(KEY)
+    assert breaker.get_retry_in(KEY) == 1
+
+    # Requests rejected while the probe is in flight wait for it to finish
+    assert breaker.allow(KEY)
+    assert not breaker.allow(KEY)
+    assert breaker.get_retry_in(KEY) == 10
+
+    breaker.circuits[KEY].probe_started_at -= 20
+    assert breaker.get_retry_in(KEY) == 1
+
+
+def test_breaker_failed_probe_backs_off():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, max_reset_timeout=15)
+    breaker.record_failure(KEY)
+    breaker.circuits[KEY].opened_at -= 10
+
+    assert breaker.allow(KEY)
+    breaker.record_failure(KEY)
+    assert breaker.circuits[KEY].state == OPEN
+    assert breaker.circuits[KEY].reset_timeout == 15
+    assert not breaker.allow(KEY)
+
+
+def test_breaker_aborted_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure(KEY)
+    assert breaker.allow(KEY)
+
+    breaker.record_abort(KEY)
+    assert breaker.circuits[KEY].state == OPEN
+    assert breaker.allow(KEY)
+
+
+def test_breaker_stats():
+    breaker = CircuitBreaker(failure_threshold=5)
+    breaker.record_failure(KEY)
+    circuit = breaker.get_stats()["circuits"][0]
+    assert circuit["host"] == "mozz.us"
+    assert circuit["state"] == CLOSED
+    assert circuit["failures"] == 1
+
+
+async def test_request_fails_fast(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure(KEY)
+    monkeypatch.setattr("geminiportal.protocols.base.circuit_breaker", breaker)
+
+    request = GeminiRequest(URLReference("gemini://mozz.us/"))
+    with pytest.raises(ProxyCircuitOpenError):
+        await request.open_connection()
@@ -0,0 +1,133 @@
+import asyncio
+
+from geminiportal.protocols import GeminiRequest, SpartanRequest
+from geminiportal.protocols.cache import ResponseCache
+from geminiportal.protocols.gemini import CloseNotifyState, GeminiResponse
+from geminiportal.protocols.spartan import SpartanResponse
+from geminiportal.urls import URLReference
+
+
+def build_gemini_response(url: str, status: str, meta: str, body: bytes = b"") -> GeminiResponse:
+    reader = asyncio.StreamReader()
+    reader.feed_data(body)
+    reader.feed_eof()
+
+    return GeminiResponse(
+        request=GeminiRequest(URLReference(url)),
+        reader=reader,
+        writer=None,
+        status=status,
+        meta=meta,
+        tls_cert=b"cert",
+        tls_version="TLSv1.3",
+        tls_cipher="TLS_AES_256_GCM_SHA384",
+        tls_close_notify=CloseNotifyState(),
+    )
+
+
+async def test_cache_get_body():
+    cache = ResponseCache()
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+
+    cache.track(response)
+    assert cache.get(response.request) is None
+    assert await response.get_body() == b"# Hello"
+
+    request = GeminiRequest(URLReference("gemini://mozz.us"))
+    cached = cache.get(request)
+    assert cached is not None
+    assert cached.request is request
+    assert cached.status == "20"
+    assert cached.tls_cert == b"cert"
+    assert await cached.get_body() == b"# Hello"
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+
+async def test_cache_body_copied():
+    cache = ResponseCache()
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+
+    cache.track(response)
+    body = await response.get_body()
+    body[:] = b"# Changed"
+
+    cached = cache.get(GeminiRequest(URLReference("gemini://mozz.us/")))
+    assert cached is not None
+    assert await cached.get_body() == b"# Hello"
+
+
+async def test_cache_stream_body():
+    cache = ResponseCache()
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+
+    cache.track(response)
+    assert b"".join([chunk async for chunk in response.stream_body()]) == b"# Hello"
+
+    cached = cache.get(response.request)
+    assert b"".join([chunk async for chunk in cached.stream_body()]) == b"# Hello"
+
+
+async def test_cache_incomplete_stream():
+    cache = ResponseCache()
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+
+    cache.track(response)
+    stream = response.stream_body()
+    await stream.__anext__()
+    await stream.aclose()
+
+    assert cache.get(response.request) is None
+
+
+async def test_cache_status_ttl():
+    cache = ResponseCache()
+
+    for status, meta in [("10", "Search"), ("44", "30")]:
+        response = build_gemini_response(f"gemini://mozz.us/{status}", status, meta)
+        cache.track(response)
+        assert cache.get(response.request) is None
+
+    response = build_gemini_response("gemini://mozz.us/51", "51", "Not found")
+    cache.track(response)
+    assert cache.get(response.request).meta == "Not found"
+
+
+async def test_cache_protocol_status_ttl():
+    cache = ResponseCache()
+
+    reader = asyncio.StreamReader()
+    reader.feed_eof()
+    request = SpartanRequest(URLReference("spartan://mozz.us/"))
+    response = SpartanResponse(request, reader, None, "5", "Server error")
+    cache.track(response)
+    assert cache.get(request) is None
+
+
+async def test_cache_expired():
+    cache = ResponseCache(ttl={"input": 0, "success": -1, "redirect": 0, "failure": 0})
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+    cache.store(cache.get_key(response.request), response, b"# Hello")
+    assert cache.get(response.request) is None
+
+
+async def test_cache_max_entry_size():
+    cache = ResponseCache(max_entry_size=4)
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", b"# Hello")
+
+    cache.track(response)
+    await response.get_body()
+    assert cache.get(response.request) is None
+
+
+async def test_cache_eviction():
+    cache = ResponseCache(max_size=40)
+
+    for path in ["a", "b", "c"]:
+        response = build_gemini_response(f"gemini://mozz.us/{path}", "20", "text/gemini", b"0" * 8)
+        cache.track(response)
+        await response.get_body()
+
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get(GeminiRequest(URLReference("gemini://mozz.us/a"))) is None
+    assert cache.get(GeminiRequest(URLReference("gemini://mozz.us/c"))) is not None
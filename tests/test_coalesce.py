@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from geminiportal.protocols import GeminiRequest
+from geminiportal.protocols.base import ProxyError
+from geminiportal.protocols.coalesce import RequestCoalescer
+from geminiportal.protocols.gemini import GeminiResponse
+from geminiportal.urls import URLReference
+
+
+class FakeUpstream:
+    """
+    Stand-in for a remote server that the test can feed body data to.
+    """
+
+    def __init__(self, status="20", meta="text/gemini", error=None):
+        self.status = status
+        self.meta = meta
+        self.error = error
+        self.reader = asyncio.StreamReader()
+        self.fetch_count = 0
+        self.released = asyncio.Event()
+
+    async def fetch(self, request):
+        self.fetch_count += 1
+        await self.released.wait()
+        if self.error:
+            raise self.error
+
+        return GeminiResponse(
+            request=request,
+            reader=self.reader,
+            writer=None,
+            status=self.status,
+            meta=self.meta,
+            tls_cert=None,
+            tls_version="TLSv1.3",
+            tls_cipher="TLS_AES_256_GCM_SHA384",
+            tls_close_notify=None,
+        )
+
+
+def build_request(url="gemini://mozz.us/"):
+    return GeminiRequest(URLReference(url))
+
+
+async def get_response(coalescer, upstream, url="gemini://mozz.us/"):
+    request = build_request(url)
+    return await coalescer.get_response(request, lambda: upstream.fetch(request))
+
+
+async def test_coalesce_concurrent_requests():
+    coalescer = RequestCoalescer()
+    upstream = FakeUpstream()
+
+    tasks = [asyncio.create_task(get_response(coalescer, upstream)) for _ in range(5)]
+    await asyncio.sleep(0)
+    upstream.released.set()
+    upstream.reader.feed_data(b"# Hello\n")
+    upstream.reader.feed_eof()
+
+    responses = await asyncio.gather(*tasks)
+    assert upstream.fetch_count == 1
+    assert coalescer.get_stats()["joined"] == 4
+
+    bodies = await asyncio.gather(*[response.get_body() for response in responses])
+    assert bodies == [b"# Hello\n"] * 5
+    assert len({id(response.request) for response in responses}) == 5
+
+
+async def test_coalesce_late_joiner_receives_buffered_bytes():
+    coalescer = RequestCoalescer()
+    upstream = FakeUpstream()
+    upstream.released.set()
+
+    first = await get_response(coalescer, upstream)
+    stream = first.stream_body()
+    upstream.reader.feed_data(b"hello ")
+    assert await stream.__anext__() == b"hello "
+
+    second = await get_response(coalescer, upstream)
+    upstream.reader.feed_data(b"world")
+    upstream.reader.feed_eof()
+
+    assert await second.get_body() == b"hello world"
+    assert b"".join([chunk async for chunk in stream]) == b"world"
+    assert upstream.fetch_count == 1
+
+
+async def test_coalesce_bounded_buffer():
+    coalescer = RequestCoalescer(buffer_size=4)
+    upstream = FakeUpstream()
+    upstream.released.set()
+
+    first = await get_response(coalescer, upstream)
+    stream = first.stream_body()
+    upstream.reader.feed_data(b"0123")
+    assert await stream.__anext__() == b"0123"
+
+    upstream.reader.feed_data(b"4567")
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    # The start of the body has been dropped, so a new upstream fetch is made
+    other = FakeUpstream()
+    other.released.set()
+    other.reader.feed_data(b"01234567")
+    other.reader.feed_eof()
+    second = await get_response(coalescer, other)
+    assert other.fetch_count == 1
+    assert await second.get_body() == b"01234567"
+
+    upstream.reader.feed_eof()
+    assert b"".join([chunk async for chunk in stream]) == b"4567"
+    assert upstream.fetch_count == 1
+
+
+async def test_coalesce_error_shared():
+    coalescer = RequestCoalescer()
+    upstream = FakeUpstream(error=ProxyError("Timeout"))
+
+    tasks = [asyncio.create_task(get_response(coalescer, upstream)) for _ in range(2)]
+    await asyncio.sleep(0)
+    upstream.released.set()
+
+    for task in tasks:
+        with pytest.raises(ProxyError):
+            await task
+
+    assert upstream.fetch_count == 1
+    assert coalescer.get_stats()["in_flight"] == 0
+
+
+async def test_coalesce_cancelled_waiter():
+    coalescer = RequestCoalescer()
+    upstream = FakeUpstream()
+
+    first = asyncio.create_task(get_response(coalescer, upstream))
+    second = asyncio.create_task(get_response(coalescer, upstream))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+
+    upstream.released.set()
+    upstream.reader.feed_data(b"hello")
+    upstream.reader.feed_eof()
+
+    response = await second
+    assert await response.get_body() == b"hello"
+
+
+async def test_coalesce_all_readers_disconnect():
+    coalescer = RequestCoalescer()
+    upstream = FakeUpstream()
+    upstream.released.set()
+
+    response = await get_response(coalescer, upstream)
+    response.close()
+    upstream.reader.feed_data(b"hello")
+
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    assert coalescer.get_stats()["in_flight"] == 0
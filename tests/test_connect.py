@@ -0,0 +1,112 @@
+import asyncio
+import socket
+
+import pytest
+
+from geminiportal.protocols.connect import ConnectionRacer, interleave
+
+V4_A = (socket.AF_INET, "10.0.0.1")
+V4_B = (socket.AF_INET, "10.0.0.2")
+V6_A = (socket.AF_INET6, "2001:db8::1")
+V6_B = (socket.AF_INET6, "2001:db8::2")
+
+
+class FakeSocket:
+    def __init__(self, address):
+        self.address = address
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRacer(ConnectionRacer):
+    """
+    Simulate connections with a fixed delay per address.
+    """
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.delays = delays
+        self.started = []
+
+    async def attempt(self, host, port, address):
+        self.started.append(address)
+        delay = self.delays[address]
+        if delay is None:
+            self.record(host, address[1], 10.0)
+            raise ConnectionRefusedError()
+
+        await asyncio.sleep(delay)
+        self.record(host, address[1], delay)
+        return FakeSocket(address)
+
+
+def test_interleave():
+    assert interleave([V6_A, V6_B, V4_A, V4_B]) == [V6_A, V4_A, V6_B, V4_B]
+    assert interleave([V4_A, V6_A, V6_B]) == [V4_A, V6_A, V6_B]
+    assert interleave([]) == []
+
+
+def test_sort_prefers_fastest_address():
+    racer = ConnectionRacer()
+    racer.record("mozz.us", V4_A[1], 0.05)
+    racer.record("mozz.us", V6_A[1], 10.0)
+    assert racer.sort("mozz.us", [V6_A, V4_A, V6_B]) == [V4_A, V6_B, V6_A]
+
+
+def test_record_decay():
+    racer = ConnectionRacer()
+    racer.record("mozz.us", V4_A[1], 1.0)
+    racer.record("mozz.us", V4_A[1], 0.0)
+    assert racer.get_score("mozz.us", V4_A[1]) == pytest.approx(0.7)
+
+
+async def test_connect_races_slow_address():
+    racer = FakeRacer({V6_A: 1.0, V4_A: 0.0}, attempt_delay=0.05)
+    sock = await racer.connect("mozz.us", 1965, [V6_A, V4_A])
+    assert sock.address == V4_A
+    assert racer.get_stats()["fallbacks"] == 1
+
+    # The winning address is remembered and tried first next time
+    racer.started.clear()
+    sock = await racer.connect("mozz.us", 1965, [V6_A, V4_A])
+    assert sock.address == V4_A
+    assert racer.started == [V4_A]
+
+
+async def test_connect_loser_ranked_behind_winner():
+    # The second address starts just before the first one connects, and
+    # is cancelled after running for much less time than the winner took.
+    racer = FakeRacer({V6_A: 0.1, V4_A: 1.0}, attempt_delay=0.09)
+    sock = await racer.connect("mozz.us", 1965, [V6_A, V4_A])
+    assert sock.address == V6_A
+    assert racer.get_score("mozz.us", V4_A[1]) > racer.get_score("mozz.us", V6_A[1])
+
+    racer.started.clear()
+    racer.delays[V4_A] = 0.0
+    sock = await racer.connect("mozz.us", 1965, [V4_A, V6_A])
+    assert racer.started[0] == V6_A
+
+
+async def test_connect_hanging_address_loses_preference():
+    # An address that used to be the fastest stops responding
+    racer = FakeRacer({V4_A: 1.0, V6_A: 0.1}, attempt_delay=0.05)
+    racer.record("mozz.us", V4_A[1], 0.01)
+    racer.record("mozz.us", V6_A[1], 0.1)
+
+    sock = await racer.connect("mozz.us", 1965, [V4_A, V6_A])
+    assert sock.address == V6_A
+    assert racer.sort("mozz.us", [V4_A, V6_A]) == [V6_A, V4_A]
+
+
+async def test_connect_failure_starts_next_attempt():
+    racer = FakeRacer({V6_A: None, V4_A: 0.0}, attempt_delay=10)
+    sock = await racer.connect("mozz.us", 1965, [V6_A, V4_A])
+    assert sock.address == V4_A
+
+
+async def test_connect_all_fail():
+    racer = FakeRacer({V6_A: None, V4_A: None}, attempt_delay=0.01)
+    with pytest.raises(ConnectionRefusedError):
+        await racer.connect("mozz.us", 1965, [V6_A, V4_A])
@@ -0,0 +1,107 @@
+import asyncio
+import socket
+
+import pytest
+
+from geminiportal.protocols.dns import Resolver, ResolverBackend
+
+
+class FakeBackend(ResolverBackend):
+    def __init__(self, addresses=None, ttl=None, error=None):
+        self.addresses = addresses or [(socket.AF_INET, "127.0.0.1")]
+        self.ttl = ttl
+        self.error = error
+        self.queries = 0
+
+    async def resolve(self, host):
+        self.queries += 1
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return self.addresses, self.ttl
+
+
+async def test_resolver_cache():
+    backend = FakeBackend()
+    resolver = Resolver(backend)
+
+    assert await resolver.resolve("mozz.us") == [(socket.AF_INET, "127.0.0.1")]
+    assert await resolver.resolve("MOZZ.US") == [(socket.AF_INET, "127.0.0.1")]
+    assert backend.queries == 1
+
+    stats = resolver.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+async def test_resolver_ttl():
+    backend = FakeBackend(ttl=-1)
+    resolver = Resolver(backend)
+
+    await resolver.resolve("mozz.us")
+    await resolver.resolve("mozz.us")
+    assert backend.queries == 2
+
+
+async def test_resolver_negative_cache():
+    backend = FakeBackend(error=socket.gaierror(socket.EAI_NONAME, "Name or service not known"))
+    resolver = Resolver(backend)
+
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            await resolver.resolve("mozz.us")
+
+    assert backend.queries == 1
+    assert resolver.get_stats()["negative_hits"] == 1
+
+
+async def test_resolver_coalesce():
+    backend = FakeBackend()
+    resolver = Resolver(backend)
+
+    results = await asyncio.gather(*[resolver.resolve("mozz.us") for _ in range(5)])
+    assert results == [[(socket.AF_INET, "127.0.0.1")]] * 5
+    assert backend.queries == 1
+    assert resolver.get_stats()["coalesced"] == 4
+
+
+async def test_resolver_coalesce_leader_cancelled():
+    backend = FakeBackend()
+    resolver = Resolver(backend)
+
+    leader = asyncio.create_task(resolver.resolve("mozz.us"))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(resolver.resolve("mozz.us"))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+    assert await follower == [(socket.AF_INET, "127.0.0.1")]
+    assert backend.queries == 1
+    assert not resolver.pending
+
+    # The result was still cached for the next caller
+    assert await resolver.resolve("mozz.us") == [(socket.AF_INET, "127.0.0.1")]
+    assert backend.queries == 1
+
+
+async def test_resolver_ip_address():
+    backend = FakeBackend()
+    resolver = Resolver(backend)
+
+    assert await resolver.resolve("::1") == [(socket.AF_INET6, "::1")]
+    assert await resolver.resolve("10.0.0.1") == [(socket.AF_INET, "10.0.0.1")]
+    assert backend.queries == 0
+
+
+async def test_resolver_max_size():
+    backend = FakeBackend()
+    resolver = Resolver(backend, max_size=2)
+
+    for host in ["a.mozz.us", "b.mozz.us", "c.mozz.us"]:
+        await resolver.resolve(host)
+
+    assert list(resolver.records) == ["b.mozz.us", "c.mozz.us"]
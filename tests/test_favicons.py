@@ -1,13 +1,24 @@
 import asyncio
 import os
 import tempfile
+import time
 
 import pytest
 
-from geminiportal.favicons import FaviconCache
+from geminiportal.favicons import (
+    FAVICON_POPULAR_HITS,
+    FAVICON_STALE_TTL,
+    FaviconCache,
+    FaviconEntry,
+)
 from geminiportal.urls import URLReference
 
 
+@pytest.fixture
+def db_name(tmp_path):
+    return str(tmp_path / "favicons.sqlite3")
+
+
 async def test_favicon_cache():
     url = URLReference("gemini://mozz.us")
 
@@ -15,13 +26,188 @@ async def test_favicon_cache():
         db_name = os.path.join(tempdir, "db-file")
         cache = FaviconCache(db_name)
 
-        assert cache.check(url) is None
+        assert await cache.check(url) is None
         assert len(cache.tasks) == 1
 
-        assert cache.check(url) is None
+        assert await cache.check(url) is None
         assert len(cache.tasks) == 1
 
-        cache.shutdown()
+        await cache.shutdown(timeout=0)
+
+
+async def test_favicon_cache_memory_hit(db_name, monkeypatch):
+    url = URLReference("gemini://mozz.us")
+    cache = FaviconCache(db_name)
+    cache.remember("gemini://mozz.us/favicon.txt", FaviconEntry("🐟", time.time() + 60))
+
+    def load(key):
+        raise AssertionError("The database should not be read")
+
+    monkeypatch.setattr(cache.store, "load", load)
+
+    assert await cache.check(url) == "🐟"
+    assert cache.hits == 1
+    assert len(cache.tasks) == 0
+
+
+async def test_favicon_cache_shared_between_workers(db_name, monkeypatch):
+    url = URLReference("gemini://mozz.us")
+    worker_1 = FaviconCache(db_name, flush_interval=60)
+    worker_2 = FaviconCache(db_name)
+
+    async def fetch_favicon(favicon_url):
+        return "🐟"
+
+    monkeypatch.setattr(worker_1, "_fetch_favicon", fetch_favicon)
+    assert await worker_1.check(url) is None
+    await asyncio.gather(*worker_1.tasks.values())
+    # Writes are batched until the flush interval or shutdown
+    assert worker_1.pending
+    assert await worker_2.check(url) is None
+    await worker_2.shutdown(timeout=0)
+
+    await worker_1.shutdown()
+    assert not worker_1.pending
+    assert worker_1.writes == 1
+
+    worker_2 = FaviconCache(db_name)
+    assert await worker_2.check(url) == "🐟"
+    assert worker_2.db_hits == 1
+    assert len(worker_2.tasks) == 0
+
+    # The second check is served from memory
+    assert await worker_2.check(url) == "🐟"
+    assert worker_2.db_hits == 1
+    assert worker_2.hits == 2
+
+
+async def test_favicon_cache_expired(db_name):
+    url = URLReference("gemini://mozz.us")
+    cache = FaviconCache(db_name)
+    expires = time.time() - FAVICON_STALE_TTL - 1
+    cache.remember("gemini://mozz.us/favicon.txt", FaviconEntry("🐟", expires))
+
+    assert await cache.check(url) is None
+    assert len(cache.tasks) == 1
+    await cache.shutdown(timeout=0)
+
+
+async def test_favicon_store_keeps_newest(db_name):
+    cache = FaviconCache(db_name)
+    cache.store.save({"gemini://mozz.us/favicon.txt": FaviconEntry("🐟", 200)}, "")
+    cache.store.save({"gemini://mozz.us/favicon.txt": FaviconEntry("🐠", 100)}, "")
+    assert cache.store.load("gemini://mozz.us/favicon.txt") == FaviconEntry("🐟", 200)
+
+
+def test_favicon_cache_size(db_name):
+    cache = FaviconCache(db_name, max_size=2)
+    for i in range(3):
+        cache.remember(f"gemini://{i}/favicon.txt", FaviconEntry(None, 0))
+    assert list(cache.entries) == ["gemini://1/favicon.txt", "gemini://2/favicon.txt"]
+
+
+async def test_favicon_cache_stale_while_revalidate(db_name, monkeypatch):
+    url = URLReference("gemini://mozz.us")
+    cache = FaviconCache(db_name)
+    cache.remember("gemini://mozz.us/favicon.txt", FaviconEntry("🐟", time.time() - 1))
+
+    async def fetch_favicon(favicon_url):
+        return "🐠"
+
+    monkeypatch.setattr(cache, "_fetch_favicon", fetch_favicon)
+
+    # The expired favicon is shown while it's being refreshed
+    assert await cache.check(url) == "🐟"
+    assert cache.stale_hits == 1
+    await asyncio.gather(*cache.tasks.values())
+    assert await cache.check(url) == "🐠"
+    await cache.shutdown()
+
+
+async def test_favicon_cache_refresh_popular(db_name):
+    url = URLReference("gemini://mozz.us")
+    cache = FaviconCache(db_name)
+    cache.remember("gemini://mozz.us/favicon.txt", FaviconEntry("🐟", time.time() + 60))
+
+    for _ in range(FAVICON_POPULAR_HITS - 1):
+        assert await cache.check(url) == "🐟"
+    assert len(cache.tasks) == 0
+
+    assert await cache.check(url) == "🐟"
+    assert len(cache.tasks) == 1
+    await cache.shutdown(timeout=0)
+
+
+async def test_favicon_cache_negative_ttl(db_name, monkeypatch):
+    url = URLReference("gemini://mozz.us")
+    cache = FaviconCache(db_name, negative_ttl=10)
+
+    async def fetch_favicon(favicon_url):
+        return None
+
+    monkeypatch.setattr(cache, "_fetch_favicon", fetch_favicon)
+
+    assert await cache.check(url) is None
+    await asyncio.gather(*cache.tasks.values())
+    entry = cache.entries["gemini://mozz.us/favicon.txt"]
+    assert entry.favicon is None
+    assert entry.expires <= time.time() + 10
+
+    assert await cache.check(url) is None
+    assert cache.hits == 1
+    assert len(cache.tasks) == 0
+    await cache.shutdown()
+
+
+async def test_favicon_cache_lease(db_name, monkeypatch):
+    url = URLReference("gemini://mozz.us")
+    worker_1 = FaviconCache(db_name)
+    worker_2 = FaviconCache(db_name, lease_poll_interval=0.01)
+
+    async def fetch_favicon(favicon_url):
+        raise AssertionError("Only the worker with the lease should fetch")
+
+    monkeypatch.setattr(worker_2, "_fetch_favicon", fetch_favicon)
+
+    key = "gemini://mozz.us/favicon.txt"
+    assert worker_1.store.acquire_lease(key, worker_1.owner, 60)
+    assert not worker_2.store.acquire_lease(key, worker_2.owner, 60)
+
+    assert await worker_2.check(url) is None
+    assert len(worker_2.tasks) == 1
+    while not worker_2.lease_waits:
+        await asyncio.sleep(0.01)
+
+    worker_1.store.save({key: FaviconEntry("🐟", time.time() + 60)}, worker_1.owner)
+    await asyncio.wait_for(asyncio.gather(*worker_2.tasks.values()), 1)
+    assert worker_2.fetches == 0
+    assert await worker_2.check(url) == "🐟"
+
+    # Saving the favicon released the lease
+    assert worker_2.store.acquire_lease(key, worker_2.owner, 60)
+    await worker_2.shutdown()
+
+
+async def test_favicon_cache_fetch_limit(db_name, monkeypatch):
+    cache = FaviconCache(db_name, max_fetches=2)
+    active, max_active = 0, 0
+
+    async def fetch_favicon(favicon_url):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(active, max_active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return "🐟"
+
+    monkeypatch.setattr(cache, "_fetch_favicon", fetch_favicon)
+
+    for i in range(6):
+        assert await cache.check(URLReference(f"gemini://capsule{i}.example.org")) is None
+    await cache.shutdown()
+    assert cache.fetches == 6
+    assert max_active == 2
+    assert cache.writes == 6
 
 
 @pytest.mark.integration
@@ -32,12 +218,12 @@ async def test_favicon_cache_update():
         db_name = os.path.join(tempdir, "db-file")
         cache = FaviconCache(db_name)
 
-        assert cache.check(url) is None
+        assert await cache.check(url) is None
         assert len(cache.tasks) == 1
 
         task = next(iter(cache.tasks.values()))
         await asyncio.wait_for(task, 10)
-        assert cache.check(url) == "🐟"
+        assert await cache.check(url) == "🐟"
         assert len(cache.tasks) == 0
 
-        cache.shutdown()
+        await cache.shutdown()
@@ -0,0 +1,83 @@
+from geminiportal.gemtext import (
+    RABBIT_ART,
+    GemtextParser,
+    HeadingLine,
+    LinkLine,
+    ListItemLine,
+    PreformattedLine,
+    PreformatToggleLine,
+    PromptLine,
+    QuoteLine,
+    RabbitLine,
+    TextLine,
+    parse_fixed_line,
+)
+
+
+def test_parse_line_types():
+    text = "\n".join(
+        [
+            "# Header 1",
+            "##Header 2  ",
+            "### Header 3",
+            "#### Header 4",
+            "* item",
+            "*not an item",
+            "> quote",
+            ">quote",
+            "=> gemini://mozz.us link text",
+            "=>/path",
+            "=>",
+            "=: /search Search",
+            "=not a link",
+            ";rаbbiΤ;",
+            "hop :rаbbiΤ: hop",
+            "`not preformatted",
+            "",
+        ]
+    )
+    assert GemtextParser().parse(text) == [
+        HeadingLine(1, "Header 1"),
+        HeadingLine(2, "Header 2"),
+        HeadingLine(3, "Header 3"),
+        HeadingLine(3, "# Header 4"),
+        ListItemLine("item"),
+        TextLine("*not an item"),
+        QuoteLine(" quote"),
+        QuoteLine("quote"),
+        LinkLine("gemini://mozz.us", "link text"),
+        LinkLine("/path", "/path"),
+        LinkLine("", ""),
+        PromptLine("/search", "Search"),
+        TextLine("=not a link"),
+        RabbitLine(""),
+        TextLine("hop 🐇 hop"),
+        TextLine("`not preformatted"),
+    ]
+
+
+def test_parse_preformatted():
+    text = "```alt text\n# not a header\n=> not a link\n;rаbbiΤ;\n```\n# header"
+    assert GemtextParser().parse(text) == [
+        PreformatToggleLine("alt text"),
+        PreformattedLine("# not a header"),
+        PreformattedLine("=> not a link"),
+        PreformattedLine(RABBIT_ART),
+        PreformatToggleLine(""),
+        HeadingLine(1, "header"),
+    ]
+
+
+def test_parse_line_streaming():
+    parser = GemtextParser()
+    assert parser.parse_line("```") == PreformatToggleLine("")
+    assert parser.preformat
+    assert parser.parse_line("* item") == PreformattedLine("* item")
+    assert parser.parse_line("```") == PreformatToggleLine("")
+    assert parser.parse_line("* item") == ListItemLine("item")
+
+
+def test_parse_fixed_line():
+    assert parse_fixed_line("=> /path  Link ") == LinkLine("/path", "Link")
+    assert parse_fixed_line("# Header") == TextLine("# Header")
+    assert parse_fixed_line("=: /path") == TextLine("=: /path")
@@ -1,11 +1,14 @@
 import os
+import tracemalloc
 
+from geminiportal.handlers.base import ANSI_ESCAPE, ANSIStripper
 from geminiportal.handlers.gemini import (
     GeminiFixedHandler,
     GeminiFlowedHandler,
     GeminiFlowedHandler2,
 )
 from geminiportal.handlers.text import TextHandler
+from geminiportal.protocols.base import MAX_BODY_SIZE
 from geminiportal.urls import URLReference
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -49,3 +52,116 @@ async def test_gemini_flowed_handler_2(app):
     async with app.app_context():
         body = await handler.get_body()
     assert body == load_file("gemini_flowed_inline.html")
+
+
+async def iter_chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+async def stream_handler_body(handler_class, data: bytes, size: int) -> str:
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    handler = handler_class(url, b"", "text/gemini", "UTF-8", iter_chunks(data, size))
+    return "".join([html async for html in handler.stream_body(handler.iter_lines())])
+
+
+async def test_gemini_flowed_handler_streaming(app):
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    for handler_class in [GeminiFlowedHandler, GeminiFlowedHandler2]:
+        async with app.app_context():
+            expected = await handler_class(url, sample_data, "text/gemini", "UTF-8").get_body()
+            # Chunk boundaries that split lines and multi-byte characters
+            for size in [1, 7, 4096]:
+                assert await stream_handler_body(handler_class, sample_data, size) == expected
+
+
+async def test_gemini_flowed_handler_streaming_line_endings(app):
+    data = "# Title\r\nline one\rline two\n\x1b[31mred\x1b[0m\n* item\r\n".encode()
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    async with app.app_context():
+        expected = await GeminiFlowedHandler(url, data, "text/gemini", "UTF-8").get_body()
+        for size in [1, 2, 3]:
+            assert await stream_handler_body(GeminiFlowedHandler, data, size) == expected
+
+
+async def test_gemini_flowed_handler_streaming_render(app):
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    data = b"# Hello\n" + b"line\n" * 100_000
+    handler = GeminiFlowedHandler(url, b"", "text/gemini", "UTF-8", iter_chunks(data, 4096))
+    async with app.test_request_context("/gemini/mozz.us/test/file.gmi"):
+        response = await handler.render()
+        page = await response.get_data(as_text=True)
+
+    assert page.startswith("<!DOCTYPE html>")
+    assert '<div class="gemini"><h1 id=hello>Hello</h1>' in page
+    assert "<!-- body -->" not in page
+    assert page.rstrip().endswith("</html>")
+
+
+async def test_preformatted_handler_streaming(app):
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    data = sample_data + "\x1b[1mbold\x1b[0m gemini://mozz.us/link\r\n".encode()
+    for handler_class in [TextHandler, GeminiFixedHandler]:
+        async with app.app_context():
+            expected = await handler_class(url, data, "text/plain", "UTF-8").get_body()
+            for size in [1, 5, 4096]:
+                assert await stream_handler_body(handler_class, data, size) == expected
+
+
+def test_ansi_stripper_split_sequences():
+    text = "a\x1b[31mred\x1b[0m b\x1b(Bc\x1b[1;2Hd\x1b"
+    for size in range(1, len(text)):
+        stripper = ANSIStripper()
+        chunks = [text[i : i + size] for i in range(0, len(text), size)]
+        stripped = "".join(stripper.feed(chunk) for chunk in chunks) + stripper.flush()
+        assert stripped == ANSI_ESCAPE.sub("", text)
+
+
+async def test_streaming_long_line(app):
+    data = b"a" * 200_000
+    async with app.app_context():
+        body = await stream_handler_body(TextHandler, data, 4096)
+
+    lines = body.removeprefix("<pre>").removesuffix("</pre>\n").split("\n")
+    assert "".join(lines) == "a" * 200_000
+    assert max(len(line) for line in lines) <= 2**16
+
+
+async def measure_streaming_memory(app, handler_class, data: bytes) -> int:
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    handler = handler_class(url, b"", "text/plain", "UTF-8", iter_chunks(data, 2**14))
+
+    size = 0
+    tracemalloc.start()
+    try:
+        async with app.app_context():
+            async for html in handler.stream_body(handler.iter_lines()):
+                size += len(html)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert size > 0
+    return peak
+
+
+async def test_streaming_bounded_memory(app):
+    corpus = {
+        "log": b"".join(
+            b"2023-02-01 12:00:%02d INFO GET /page/%d 200 (0.%03ds)\n" % (i % 60, i, i % 1000)
+            for i in range(45_000)
+        ),
+        "ansi": b"\x1b[32mOK\x1b[0m " * 180_000,
+        "gemtext": (b"## Section\n" + b"Some paragraph text.\n" * 5 + b"* item\n> quote\n")
+        * 17_000,
+    }
+    handlers = {
+        "log": TextHandler,
+        "ansi": GeminiFixedHandler,
+        "gemtext": GeminiFlowedHandler,
+    }
+    for name, data in corpus.items():
+        # Larger than the limit for buffered responses
+        assert len(data) > 2 * MAX_BODY_SIZE, name
+        peak = await measure_streaming_memory(app, handlers[name], data)
+        assert peak < MAX_BODY_SIZE, (name, peak)
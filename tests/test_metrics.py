@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from geminiportal.metrics import ProxyMetrics
+from geminiportal.protocols.base import ProxyResponseSizeError
+from geminiportal.protocols.gemini import GeminiResponse
+
+
+@pytest.fixture
+def registry():
+    return CollectorRegistry()
+
+
+@pytest.fixture
+def metrics(registry):
+    return ProxyMetrics(registry)
+
+
+def test_record_response(metrics, registry):
+    metrics.record_response("gemini", "20", GeminiResponse.STATUS_CODES)
+    metrics.record_response("gemini", "20", GeminiResponse.STATUS_CODES)
+    metrics.record_response("gemini", "99", GeminiResponse.STATUS_CODES)
+
+    labels = {"scheme": "gemini", "status": "20"}
+    assert registry.get_sample_value("geminiportal_requests_total", labels) == 2
+    labels = {"scheme": "gemini", "status": "other"}
+    assert registry.get_sample_value("geminiportal_requests_total", labels) == 1
+
+
+def test_record_upstream(metrics, registry):
+    metrics.record_upstream_latency("spartan", 0.2)
+    metrics.record_upstream_bytes("spartan", 100)
+    metrics.record_upstream_bytes("spartan", 50)
+
+    labels = {"scheme": "spartan"}
+    assert registry.get_sample_value("geminiportal_upstream_latency_seconds_count", labels) == 1
+    labels = {"scheme": "spartan", "le": "0.25"}
+    assert registry.get_sample_value("geminiportal_upstream_latency_seconds_bucket", labels) == 1
+    labels = {"scheme": "spartan"}
+    assert registry.get_sample_value("geminiportal_upstream_bytes_total", labels) == 150
+
+
+def test_record_error(metrics, registry):
+    metrics.record_error(ProxyResponseSizeError())
+
+    labels = {"error": "ProxyResponseSizeError"}
+    assert registry.get_sample_value("geminiportal_proxy_errors_total", labels) == 1
+
+
+def test_upstream_connections(metrics, registry):
+    metrics.connection_opened()
+    metrics.connection_opened()
+    metrics.connection_closed()
+    assert registry.get_sample_value("geminiportal_upstream_connections") == 1
+
+
+async def test_event_loop_lag(metrics, registry):
+    metrics.start(interval=0.01)
+    await asyncio.sleep(0.05)
+    assert registry.get_sample_value("geminiportal_event_loop_lag_seconds") >= 0
+    assert metrics.loop_monitor is not None
+
+    metrics.shutdown()
+    assert metrics.loop_monitor is None
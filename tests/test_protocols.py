@@ -74,6 +74,9 @@ async def test_gemini_request():
     assert response.tls_version
     assert response.tls_cipher
 
+    phases = {"dns", "connect", "tls", "write", "header", "body"}
+    assert phases <= request.timings.durations.keys()
+
 
 @pytest.mark.integration
 async def test_spartan_request():
@@ -84,6 +87,10 @@ async def test_spartan_request():
     assert response.is_success()
     assert await response.get_body() == b"hello world"
 
+    phases = {"dns", "connect", "write", "header", "body"}
+    assert phases <= request.timings.durations.keys()
+    assert "tls" not in request.timings.durations
+
 
 @pytest.mark.integration
 async def test_txt_request():
@@ -0,0 +1,120 @@
+import pytest
+
+from geminiportal.handlers import base
+from geminiportal.handlers.cache import RenderCache
+from geminiportal.handlers.gemini import GeminiFlowedHandler, GeminiFlowedHandler2
+from geminiportal.handlers.text import TextHandler
+from geminiportal.protocols.cache import ResponseCache
+from geminiportal.urls import URLReference
+from tests.test_cache import build_gemini_response
+
+
+@pytest.fixture()
+def render_cache(monkeypatch):
+    cache = RenderCache()
+    monkeypatch.setattr(base, "render_cache", cache)
+    return cache
+
+
+def test_render_cache_lru_eviction():
+    cache = RenderCache(max_size=10, max_entry_size=6)
+    key_a = (b"a", "TextHandler", (), "gemini://mozz.us/", "text/plain", "UTF-8", "")
+    key_b = (b"b", "TextHandler", (), "gemini://mozz.us/", "text/plain", "UTF-8", "")
+    key_c = (b"c", "TextHandler", (), "gemini://mozz.us/", "text/plain", "UTF-8", "")
+
+    cache.store(key_a, "aaaa", 0.5)
+    cache.store(key_b, "bbbb", 0.5)
+    assert cache.get(key_a) == "aaaa"
+
+    # Too large to cache
+    cache.store(key_c, "ccccccc", 0.5)
+    assert cache.get(key_c) is None
+
+    # Evicts b, which was used least recently
+    cache.store(key_c, "cccc", 0.5)
+    assert cache.get(key_b) is None
+    assert cache.get(key_a) == "aaaa"
+    assert cache.size == 8
+
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["handlers"]["TextHandler"] == {
+        "hits": 2,
+        "misses": 2,
+        "hit_ratio": 0.5,
+        "time_saved": 1.0,
+    }
+
+
+async def test_render_cache_buffered(app, render_cache):
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    async with app.app_context():
+        body = await TextHandler(url, b"hello", "text/plain", "UTF-8").get_cached_body()
+        cached = await TextHandler(url, b"hello", "text/plain", "UTF-8").get_cached_body()
+        changed = await TextHandler(url, b"hello!", "text/plain", "UTF-8").get_cached_body()
+
+    assert cached == body == "<pre>hello</pre>\n"
+    assert changed == "<pre>hello!</pre>\n"
+    assert render_cache.get_stats()["handlers"]["TextHandler"]["hits"] == 1
+
+
+async def test_render_cache_key_options(app, render_cache):
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    other_url = URLReference("gemini://mozz.us/other/file.gmi")
+    data = b"=> image.png An image\n"
+    async with app.app_context():
+        flowed = await GeminiFlowedHandler(url, data, "text/gemini", "UTF-8").get_cached_body()
+        inline = await GeminiFlowedHandler2(url, data, "text/gemini", "UTF-8").get_cached_body()
+        other = await GeminiFlowedHandler(other_url, data, "text/gemini", "UTF-8").get_cached_body()
+
+    assert "<img" not in flowed
+    assert "<img" in inline
+    assert "/gemini/mozz.us/other/image.png" in other
+    assert render_cache.get_stats()["entries"] == 3
+
+
+async def test_render_cache_key_url_root(app, render_cache, monkeypatch):
+    monkeypatch.setitem(app.config, "SERVER_NAME", None)
+    url = URLReference("gemini://mozz.us/test/file.gmi")
+    data = b"=> /page A link\n"
+
+    async def render(path, host, root_path=""):
+        headers = {"Host": host}
+        async with app.test_request_context(path, headers=headers, root_path=root_path):
+            return await GeminiFlowedHandler(url, data, "text/gemini", "UTF-8").get_cached_body()
+
+    body = await render("/gemini/mozz.us/", "portal.mozz.us")
+    other_host = await render("/gemini/mozz.us/", "proxy.example.com")
+    prefixed = await render("/portal/gemini/mozz.us/", "portal.mozz.us", root_path="/portal")
+    assert 'href="/gemini/mozz.us/page"' in body
+    assert 'href="/portal/gemini/mozz.us/page"' in prefixed
+
+    stats = render_cache.get_stats()
+    assert stats["entries"] == 3
+    assert stats["handlers"]["GeminiFlowedHandler"]["hits"] == 0
+    assert other_host == body
+
+
+async def test_render_cache_streaming(app, render_cache):
+    response_cache = ResponseCache()
+    data = b"# Hello\n" + b"=> /page A link\n" * 100
+    response = build_gemini_response("gemini://mozz.us/", "20", "text/gemini", data)
+    response_cache.track(response)
+
+    async with app.test_request_context("/gemini/mozz.us/"):
+        handler = await GeminiFlowedHandler.from_response(response)
+        page = await (await handler.render()).get_data(as_text=True)
+
+        cached_response = response_cache.get(response.request)
+        assert cached_response is not None
+        assert cached_response.body_digest is not None
+
+        handler = await GeminiFlowedHandler.from_response(cached_response)
+        cached_page = await (await handler.render()).get_data(as_text=True)
+
+    assert cached_page == page
+    assert '<div class="gemini"><h1 id=hello>Hello</h1>' in page
+
+    stats = render_cache.get_stats()["handlers"]["GeminiFlowedHandler"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from geminiportal.protocols.scheduler import SchedulerBusyError, UpstreamScheduler
+
+
+async def test_scheduler_host_limit():
+    scheduler = UpstreamScheduler(max_host_connections=2)
+    slots = [await scheduler.acquire("mozz.us") for _ in range(2)]
+    assert not scheduler.has_capacity("mozz.us")
+    assert scheduler.has_capacity("example.com")
+
+    task = asyncio.create_task(scheduler.acquire("mozz.us"))
+    await asyncio.sleep(0)
+    assert not task.done()
+    assert scheduler.get_queue_length("mozz.us") == 1
+
+    slots[0].release()
+    slot = await task
+    assert scheduler.active_hosts["mozz.us"] == 2
+
+    # Releasing a slot more than once is harmless
+    slots[0].release()
+    assert scheduler.active_hosts["mozz.us"] == 2
+
+    slot.release()
+    slots[1].release()
+    assert scheduler.active == 0
+    assert not scheduler.active_hosts
+
+
+async def test_scheduler_global_limit_round_robin_hosts():
+    scheduler = UpstreamScheduler(max_connections=1)
+    slot = await scheduler.acquire("a.com")
+
+    order = []
+
+    async def waiter(host):
+        s = await scheduler.acquire(host)
+        order.append(host)
+        s.release()
+
+    tasks = [asyncio.create_task(waiter(host)) for host in ["a.com", "a.com", "b.com"]]
+    await asyncio.sleep(0)
+
+    slot.release()
+    await asyncio.gather(*tasks)
+    assert order == ["a.com", "b.com", "a.com"]
+
+
+async def test_scheduler_round_robin_clients():
+    scheduler = UpstreamScheduler(max_host_connections=1)
+    slot = await scheduler.acquire("mozz.us", "crawler")
+
+    order = []
+
+    async def waiter(client):
+        s = await scheduler.acquire("mozz.us", client)
+        order.append(client)
+        s.release()
+
+    clients = ["crawler", "crawler", "crawler", "human"]
+    tasks = [asyncio.create_task(waiter(client)) for client in clients]
+    await asyncio.sleep(0)
+
+    slot.release()
+    await asyncio.gather(*tasks)
+    assert order == ["crawler", "human", "crawler", "crawler"]
+
+
+async def test_scheduler_queue_timeout():
+    scheduler = UpstreamScheduler(max_host_connections=1, max_queue_wait=0.01)
+    await scheduler.acquire("mozz.us")
+    with pytest.raises(SchedulerBusyError):
+        await scheduler.acquire("mozz.us")
+
+    assert scheduler.get_queue_length("mozz.us") == 0
+    assert scheduler.get_stats()["rejected"] == 1
+
+
+async def test_scheduler_queue_full():
+    scheduler = UpstreamScheduler(max_host_connections=1, max_host_queue=1)
+    await scheduler.acquire("mozz.us")
+    task = asyncio.create_task(scheduler.acquire("mozz.us"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(SchedulerBusyError):
+        await scheduler.acquire("mozz.us")
+
+    task.cancel()
+
+
+async def test_scheduler_cancelled_waiter():
+    scheduler = UpstreamScheduler(max_host_connections=1)
+    slot = await scheduler.acquire("mozz.us")
+    task = asyncio.create_task(scheduler.acquire("mozz.us"))
+    await asyncio.sleep(0)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert scheduler.get_queue_length("mozz.us") == 0
+
+    slot.release()
+    assert scheduler.active == 0
@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+from geminiportal.protocols import SpartanRequest
+from geminiportal.protocols.base import (
+    MAX_HEADER_SIZE,
+    ProxyError,
+    ProxyTimeoutError,
+    timeout_counts,
+)
+from geminiportal.protocols.spartan import SpartanResponse
+from geminiportal.urls import URLReference
+
+
+class FakeWriter:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def build_request():
+    return SpartanRequest(URLReference("spartan://mozz.us/"))
+
+
+def build_response(reader, deadline):
+    response = SpartanResponse(build_request(), reader, None, "2", "text/plain")
+    response.deadline = asyncio.get_running_loop().time() + deadline
+    return response
+
+
+async def test_read_header():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"2 text/gemini\r\n# Hello")
+    reader.feed_eof()
+
+    request = build_request()
+    header = await request.read_header(reader, FakeWriter())
+    assert header == b"2 text/gemini\r\n"
+    assert await reader.read() == b"# Hello"
+    assert "header" in request.timings.durations
+
+
+async def test_read_header_too_large():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"2 " + b"a" * MAX_HEADER_SIZE + b"\r\n")
+    writer = FakeWriter()
+
+    with pytest.raises(ProxyError):
+        await build_request().read_header(reader, writer)
+    assert writer.closed
+
+
+async def test_read_header_max_size():
+    header = b"2 " + b"a" * (MAX_HEADER_SIZE - 4) + b"\r\n"
+    assert len(header) == MAX_HEADER_SIZE
+    reader = asyncio.StreamReader()
+    reader.feed_data(header + b"# Hello")
+    assert await build_request().read_header(reader, FakeWriter()) == header
+
+
+async def test_read_header_past_stream_limit():
+    reader = asyncio.StreamReader(limit=2**10)
+    reader.feed_data(b"2 " + b"a" * 2**12)
+    writer = FakeWriter()
+
+    with pytest.raises(ProxyError):
+        await build_request().read_header(reader, writer)
+    assert writer.closed
+
+
+async def test_read_header_no_newline():
+    reader = asyncio.StreamReader()
+    writer = FakeWriter()
+    fed = 0
+
+    async def trickle():
+        # More than the 64 KiB stream limit, a little at a time
+        nonlocal fed
+        while fed < 2**17:
+            reader.feed_data(b"a" * 256)
+            fed += 256
+            await asyncio.sleep(0)
+
+    task = asyncio.create_task(trickle())
+    try:
+        with pytest.raises(ProxyError) as e:
+            await build_request().read_header(reader, writer)
+        assert not isinstance(e.value, ProxyTimeoutError)
+        # Failed without waiting for the stream limit to fill up
+        assert fed < 2**12
+        buffered = len(await reader.read(fed))
+        assert fed - buffered <= MAX_HEADER_SIZE + 1
+        assert writer.closed
+    finally:
+        task.cancel()
+
+
+async def test_read_header_trickle():
+    reader = asyncio.StreamReader()
+
+    async def trickle():
+        for chunk in [b"2 te", b"xt/gem", b"ini\r", b"\n# Hello"]:
+            await asyncio.sleep(0)
+            reader.feed_data(chunk)
+        reader.feed_eof()
+
+    task = asyncio.create_task(trickle())
+    assert await build_request().read_header(reader, FakeWriter()) == b"2 text/gemini\r\n"
+    await task
+    assert await reader.read() == b"# Hello"
+
+
+async def test_read_header_incomplete():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"2 text/gemini")
+    reader.feed_eof()
+    assert await build_request().read_header(reader, FakeWriter()) == b"2 text/gemini"
+
+
+def test_timeout_error_not_counted():
+    count = timeout_counts["header"]
+    ProxyTimeoutError("header")
+    assert timeout_counts["header"] == count
+
+
+async def test_read_header_timeout(monkeypatch):
+    monkeypatch.setattr("geminiportal.protocols.base.HEADER_TIMEOUT", 0.01)
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"2 text/")
+    writer = FakeWriter()
+
+    count = timeout_counts["header"]
+    with pytest.raises(ProxyTimeoutError) as e:
+        await build_request().read_header(reader, writer)
+    assert e.value.kind == "header"
+    assert timeout_counts["header"] == count + 1
+    assert writer.closed
+
+
+async def test_body_idle_timeout(monkeypatch):
+    monkeypatch.setattr("geminiportal.protocols.base.READ_TIMEOUT", 0.01)
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"Hello")
+    response = build_response(reader, deadline=60)
+
+    with pytest.raises(ProxyTimeoutError) as e:
+        await response.get_body()
+    assert e.value.kind == "idle"
+
+
+async def test_body_deadline(monkeypatch):
+    monkeypatch.setattr("geminiportal.protocols.base.READ_TIMEOUT", 60)
+    reader = asyncio.StreamReader()
+    response = build_response(reader, deadline=0.05)
+
+    async def trickle():
+        # Each chunk arrives well within the idle timeout
+        while True:
+            reader.feed_data(b"a")
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(trickle())
+    try:
+        with pytest.raises(ProxyTimeoutError) as e:
+            async for _ in response.stream_body():
+                pass
+        assert e.value.kind == "deadline"
+    finally:
+        task.cancel()
+
+
+async def test_cached_body_has_no_deadline():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"Hello")
+    reader.feed_eof()
+    response = build_response(reader, deadline=-1).copy(build_request(), reader)
+
+    assert await response.get_body() == b"Hello"
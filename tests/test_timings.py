@@ -0,0 +1,33 @@
+from geminiportal.timings import RequestTimings
+
+
+def test_request_timings():
+    timings = RequestTimings()
+    timings.add("template", 0.002)
+    timings.add("dns", 0.0015)
+    timings.add("template", 0.001)
+    with timings.measure("handler"):
+        pass
+
+    phases = [phase for phase, _ in timings.get_phases()]
+    assert phases == ["dns", "handler", "template"]
+    assert timings.durations["template"] == 0.003
+
+    server_timing = timings.get_server_timing()
+    assert server_timing.startswith('dns;dur=1.5;desc="DNS lookup", handler;dur=')
+    assert 'template;dur=3.0;desc="Template render", total;dur=' in server_timing
+
+    fields = timings.get_log_fields()
+    assert list(fields) == ["dns", "handler", "template", "total"]
+    assert fields["dns"] == "1.5"
+
+
+def test_request_timings_measure_error():
+    timings = RequestTimings()
+    try:
+        with timings.measure("connect"):
+            raise OSError
+    except OSError:
+        pass
+
+    assert "connect" in timings.durations
@@ -0,0 +1,70 @@
+import ssl
+
+from geminiportal.protocols.tls import ProxySSLContext, TLSSessionCache
+
+
+def test_ssl_context_settings():
+    context = ProxySSLContext(TLSSessionCache())
+    assert context.verify_mode == ssl.CERT_NONE
+    assert not context.check_hostname
+
+
+def test_close_notify_state_per_connection():
+    context = ProxySSLContext(TLSSessionCache())
+    ssl_object_1 = context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="mozz.us")
+    ssl_object_2 = context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="mozz.us")
+
+    state_1 = context.get_close_notify_state(ssl_object_1)
+    state_2 = context.get_close_notify_state(ssl_object_2)
+    assert state_1 is not state_2
+
+    context._on_message(ssl_object_1, "read", None, None, ssl._TLSAlertType.CLOSE_NOTIFY, b"")
+    assert state_1
+    assert not state_2
+
+
+def test_session_cache_stats():
+    cache = TLSSessionCache()
+    cache.record_handshake(resumed=False, elapsed=0.2)
+    cache.record_handshake(resumed=True, elapsed=0.1)
+
+    stats = cache.get_stats()
+    assert stats["handshakes"] == 2
+    assert stats["resumed"] == 1
+    assert stats["resumption_rate"] == 0.5
+    assert stats["full_handshake_avg"] == 0.2
+
+
+def test_session_cache_ignores_missing_session():
+    cache = TLSSessionCache()
+    cache.store("mozz.us", 1965, None)
+    assert cache.get("mozz.us", 1965) is None
+
+
+class FakeSession:
+    has_ticket = True
+    id = b"id"
+
+
+def test_session_cache_keyed_by_port():
+    cache = TLSSessionCache()
+    session = FakeSession()
+    cache.store("mozz.us", 1965, session)
+    assert cache.get("mozz.us", 1965) is session
+    assert cache.get("mozz.us", 1966) is None
+
+    cache.discard("mozz.us", 1965)
+    assert cache.get("mozz.us", 1965) is None
+
+
+def test_wrap_bio_offers_session_for_port(monkeypatch):
+    context = ProxySSLContext(TLSSessionCache())
+    lookups = []
+    monkeypatch.setattr(context.session_cache, "get", lambda *key: lookups.append(key))
+
+    context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="mozz.us")
+    assert lookups == []
+
+    with context.connecting(1966):
+        context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="mozz.us")
+    assert lookups == [("mozz.us", 1966)]
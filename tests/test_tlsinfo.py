@@ -0,0 +1,85 @@
+import hashlib
+import time
+
+import pytest
+
+from geminiportal.protocols.tlsinfo import TLSInfoStore
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    return str(tmp_path / "tls.sqlite3")
+
+
+async def test_tls_info_record(db_name):
+    store = TLSInfoStore(db_name, flush_interval=60)
+    store.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", True)
+
+    info = await store.get_fresh("mozz.us", 1965)
+    assert info is not None
+    assert info.cert == b"cert"
+    assert info.version == "TLSv1.3"
+    assert info.close_notify is True
+    assert store.hits == 1
+    assert len(store.pending) == 1
+
+    await store.shutdown()
+    assert store.writes == 1
+
+
+async def test_tls_info_unknown_close_notify(db_name):
+    store = TLSInfoStore(db_name, flush_interval=60)
+    store.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", None)
+    assert await store.get_fresh("mozz.us", 1965) is None
+    assert store.misses == 1
+
+    # A later connection that didn't read the body keeps the known value
+    store.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", False)
+    store.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", None)
+    info = await store.get_fresh("mozz.us", 1965)
+    assert info is not None
+    assert info.close_notify is False
+
+    await store.shutdown()
+
+
+async def test_tls_info_expired(db_name):
+    store = TLSInfoStore(db_name, flush_interval=60)
+    store.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", True)
+    store.hosts["mozz.us", 1965].last_seen = time.time() - store.max_age
+    assert await store.get_fresh("mozz.us", 1965) is None
+    await store.shutdown()
+
+
+async def test_tls_info_shared_between_workers(db_name):
+    store_1 = TLSInfoStore(db_name, flush_interval=60)
+    store_2 = TLSInfoStore(db_name, flush_interval=60)
+
+    store_1.record("mozz.us", 1965, b"cert", "TLSv1.3", "TLS_AES_256_GCM_SHA384", True)
+    assert await store_2.get("mozz.us", 1965) is None
+
+    await store_1.flush()
+    info = await store_2.get_fresh("mozz.us", 1965)
+    assert info is not None
+    assert info.cert == b"cert"
+    assert info.close_notify is True
+
+
+async def test_tls_info_cert_history(db_name):
+    store = TLSInfoStore(db_name, flush_interval=60)
+    store.record("mozz.us", 1965, b"old", "TLSv1.3", "TLS_AES_256_GCM_SHA384", True)
+    first_seen = store.hosts["mozz.us", 1965].first_seen
+    await store.flush()
+
+    store.record("mozz.us", 1965, b"new", "TLSv1.3", "TLS_AES_256_GCM_SHA384", True)
+    info = await store.get("mozz.us", 1965)
+    assert info is not None
+    assert info.first_seen >= first_seen
+    assert store.cert_changes == 1
+
+    history = await store.get_history("mozz.us", 1965)
+    assert {record.fingerprint for record in history} == {
+        hashlib.sha256(b"old").hexdigest(),
+        hashlib.sha256(b"new").hexdigest(),
+    }
+    assert await store.get_history("mozz.us", 1966) == []
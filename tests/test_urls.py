@@ -1,4 +1,72 @@
-from geminiportal.urls import URLReference
+import copy
+import mimetypes
+import os
+import pickle
+from urllib.parse import urljoin
+
+import pytest
+
+from geminiportal.urls import (
+    CUSTOM_MIMETYPES,
+    LinkResolver,
+    MimetypeTable,
+    ProxyURLBuilder,
+    URLReference,
+    mimetype_table,
+)
+
+RESOLVER_BASES = [
+    "gemini://mozz.us",
+    "gemini://mozz.us/",
+    "gemini://mozz.us/a/b/page.gmi?query#fragment",
+    "gemini://mozz.us:1966/a/b/",
+    "spartan://mozz.us/a;params",
+    "finger://mozz.us/user",
+    "gopher://mozz.us/1/dir",
+    "mailto:user@mozz.us",
+]
+
+RESOLVER_LINKS = [
+    "",
+    ".",
+    "..",
+    "./",
+    "../",
+    "../../../..",
+    "page.gmi",
+    "./dir/../page.gmi",
+    "dir//page.gmi",
+    "/",
+    "/absolute/path/",
+    "/a/./b/../c",
+    "?query",
+    "#fragment",
+    ";params",
+    "//other.host/path",
+    "gemini://other.host",
+    "gemini://other.host/a/../b",
+    "gemini:relative",
+    "https://mozz.us/",
+    "mailto:user@mozz.us",
+    "%20Hello.gmi",
+    "téléphone.gmi",
+    "page.gmi#section",
+    "page.gmi?query=a b#sec tion/é",
+    "/x0pathx0/x0netlocx0",
+    "gemini://mozz.us:1966/",
+    "gemini://[::1]/ipv6",
+    "text://mozz.us/",
+    "finger://mozz.us/user",
+]
+
+PROXY_QUERY_PARAMS = [
+    {},
+    {"raw": True},
+    {"raw": None},
+    {"inline": 1},
+    {"crt": True},
+    {"raw": True, "crt": "1", "q": "a b&c"},
+]
 
 
 def test_deconstruct_gemini():
@@ -271,3 +339,213 @@ async def test_get_proxy_unknown_scheme(app):
     url = URLReference("telnet://mozz.us:23")
     async with app.app_context():
         assert url.get_proxy_url() == "telnet://mozz.us:23"
+
+
+def test_link_resolver_join():
+    for base in RESOLVER_BASES:
+        resolver = LinkResolver(URLReference(base))
+        for link in RESOLVER_LINKS:
+            assert resolver.join(link) == urljoin(resolver.base_url, link), (base, link)
+
+
+async def test_link_resolver_resolve(app):
+    async with app.app_context():
+        for base in RESOLVER_BASES:
+            base_url = URLReference(base)
+            resolver = LinkResolver(base_url)
+            for link in RESOLVER_LINKS:
+                url, expected = resolver.resolve(link), base_url.join(link)
+                assert url.get_url() == expected.get_url(), (base, link)
+                assert url.original == expected.original
+                assert url.base == expected.base
+                proxy_url = resolver.get_proxy_url(link)
+                assert proxy_url == expected.get_proxy_url(), (base, link)
+                proxy_url = resolver.get_proxy_url(link, raw=True)
+                assert proxy_url == expected.get_proxy_url(raw=True), (base, link)
+
+
+async def test_link_resolver_memoized(app):
+    resolver = LinkResolver(URLReference("gemini://mozz.us/test/"))
+    async with app.app_context():
+        assert resolver.resolve("a.gmi") is resolver.resolve("a.gmi")
+        assert resolver.get_proxy_url("a.gmi") == "http://portal.mozz.us/gemini/mozz.us/test/a.gmi"
+        assert resolver.get_proxy_url.cache_info().currsize == 1
+
+
+def test_link_resolver_bounded(monkeypatch):
+    monkeypatch.setattr("geminiportal.urls.LINK_CACHE_SIZE", 4)
+    resolver = LinkResolver(URLReference("gemini://mozz.us/test/"))
+    for i in range(10):
+        resolver.resolve(f"{i}.gmi")
+    assert resolver.resolve.cache_info().currsize == 4
+
+
+def check_proxy_url_builder():
+    builder = ProxyURLBuilder()
+    for base in RESOLVER_BASES:
+        for link in RESOLVER_LINKS:
+            url = URLReference(base).join(link)
+            for query_params in PROXY_QUERY_PARAMS:
+                expected = url.get_proxy_url(**query_params)
+                assert url.get_proxy_url(builder=builder, **query_params) == expected, (
+                    base,
+                    link,
+                    query_params,
+                )
+
+
+async def test_proxy_url_builder_external(app):
+    async with app.app_context():
+        check_proxy_url_builder()
+
+
+async def test_proxy_url_builder_request(app):
+    async with app.test_request_context("/gemini/mozz.us/"):
+        check_proxy_url_builder()
+
+
+async def test_proxy_url_builder_root_path(app):
+    async with app.test_request_context("/portal/gemini/mozz.us/", root_path="/portal"):
+        check_proxy_url_builder()
+        url = URLReference("gemini://mozz.us/a b")
+        assert url.get_proxy_url(builder=ProxyURLBuilder()) == "/portal/gemini/mozz.us/a%20b"
+
+
+def test_url_reference_cached():
+    url = URLReference("gemini://mozz.us/page.gmi")
+    assert URLReference("gemini://mozz.us/page.gmi") is url
+    assert URLReference("page.gmi", "gemini://mozz.us/") is not url
+    assert URLReference("page.gmi", "gemini://mozz.us/") == url
+
+
+def test_url_reference_immutable():
+    url = URLReference("gemini://mozz.us/page.gmi")
+    with pytest.raises(AttributeError):
+        url.query = "hello"
+    with pytest.raises(AttributeError):
+        url.extra = "hello"
+
+    assert copy.copy(url) is url
+    assert copy.deepcopy(url) is url
+
+    loaded = pickle.loads(pickle.dumps(url))
+    assert loaded == url
+    assert loaded.original == url.original
+
+
+def test_url_reference_hash():
+    urls = {URLReference("gemini://mozz.us:1965/"): 1}
+    assert urls[URLReference("gemini://mozz.us")] == 1
+    assert URLReference("gemini://mozz.us") != "gemini://mozz.us"
+
+
+def test_url_reference_lazy_fields():
+    url = URLReference("gemini://mozz.us/a/b/")
+    assert url.get_parent() is url.get_parent()
+    assert url.get_root() is url.get_root()
+    assert url.get_root(include_user_dirs=True) is url.get_root(include_user_dirs=True)
+    assert url.get_parent().get_url() == "gemini://mozz.us/a/"
+    assert url.get_gemini_request_url() == "gemini://mozz.us/a/b/"
+
+
+def test_url_reference_replace():
+    url = URLReference("gemini://mozz.us/search?old#frag")
+    assert url.replace(query="new%20query").get_url() == "gemini://mozz.us/search?new%20query#frag"
+    assert url.get_url() == "gemini://mozz.us/search?old#frag"
+
+    url = URLReference("gemini://mozz.us")
+    assert url.replace(query="q").get_gemini_request_url() == "gemini://mozz.us/?q"
+
+
+MIMETYPE_PATHS = [
+    "",
+    "/",
+    "/file",
+    "/file.png",
+    "/file.PNG",
+    "/file.gmi",
+    "/file.GEMINI",
+    "/docs/README.rst",
+    "/menu.goph",
+    "/archive.tar.gz",
+    "/archive.TGZ",
+    "/archive.tgz",
+    "/archive.svgz",
+    "/notes.txt.Z",
+    "/photo.jpg",
+    "/song.mid",
+    "/song.flac",
+    "/song.ogg",
+    "/song.opus",
+    "/song.m4a",
+    "/movie.mkv",
+    "/photo.jxl",
+    "/document.rtf",
+    "/.gmi",
+    "/.hidden.txt",
+    "/..dots..png",
+    "/dir.d/file",
+    "/a.b.c.unknown",
+    "/%20Hello.gmi",
+    "file.txt",
+    "foo:bar.png",
+    "data:image/png;base64,AAAA",
+    "data:nocomma",
+]
+
+
+@pytest.mark.parametrize("path", MIMETYPE_PATHS)
+@pytest.mark.parametrize("strict", [True, False])
+def test_mimetype_table_guess_type(path, strict):
+    files = [file for file in mimetypes.knownfiles if os.path.isfile(file)]
+    mime_types = mimetypes.MimeTypes(files)
+    for ext, mimetype in CUSTOM_MIMETYPES.items():
+        mime_types.add_type(mimetype, ext)
+
+    expected = mime_types.guess_type(path, strict)[0]
+    assert mimetype_table.guess_type(path, strict) == expected
+    # Again, from the suffix cache
+    assert mimetype_table.guess_type(path, strict) == expected
+
+
+def test_mimetype_table_system_types():
+    if not any(os.path.isfile(file) for file in mimetypes.knownfiles):
+        pytest.skip("No mime.types file on this system")
+
+    mimetypes.init()
+    for path in ["/photo.jxl", "/song.flac", "/song.opus"]:
+        assert mimetype_table.guess_type(path) == mimetypes.guess_type(path)[0]
+
+
+def test_mimetype_table_lazy():
+    table = MimetypeTable(CUSTOM_MIMETYPES)
+    assert "tables" not in table.__dict__
+    assert table.guess_type("/file.gmi") == "text/gemini"
+    assert "tables" in table.__dict__
+
+
+def test_mimetype_table_frozen():
+    with pytest.raises(TypeError):
+        mimetype_table.tables.types_map[".foo"] = "text/foo"
+
+
+@pytest.mark.parametrize(
+    "item_type,selector,mimetype",
+    [
+        ("1", "/file.txt", "application/gopher-menu"),
+        ("h", "/file.txt", "text/html"),
+        ("g", "/file.png", "image/gif"),
+        ("i", "/file.txt", None),
+        ("d", "/file.txt", "text/plain"),
+        ("d", "/file", "application/pdf"),
+        ("9", "/file", "application/octet-stream"),
+        ("s", "/file.mp3", "audio/mpeg"),
+        ("s", "/file.txt", "audio/wave"),
+        ("0", "/file.gmi", "text/gemini"),
+        ("0", "/file.png", "text/plain"),
+        ("I", "/file.png", "image/png"),
+        ("I", "/file", None),
+    ],
+)
+def test_mimetype_table_guess_gopher_type(item_type, selector, mimetype):
+    assert mimetype_table.guess_gopher_type(item_type, selector) == mimetype
@@ -0,0 +1,117 @@
+import datetime
+import shutil
+import subprocess
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, ExtensionOID, NameOID
+
+from geminiportal.utils import TLSCertDescriptionCache, format_hex, format_tls_cert
+
+
+def build_cert(key, algorithm) -> bytes:
+    name = x509.Name(
+        [
+            x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+            x509.NameAttribute(NameOID.COMMON_NAME, "mozz.us"),
+        ]
+    )
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(2**70 + 1)
+        .not_valid_before(datetime.datetime(2023, 1, 5, 1, 2, 3))
+        .not_valid_after(datetime.datetime(2024, 11, 25, 1, 2, 3))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName("mozz.us"), x509.DNSName("*.mozz.us")]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(
+            x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]),
+            critical=False,
+        )
+    )
+    cert = builder.sign(key, algorithm)
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+@pytest.fixture(scope="module")
+def ec_cert():
+    return build_cert(ec.generate_private_key(ec.SECP256R1()), hashes.SHA256())
+
+
+@pytest.fixture(scope="module")
+def ed25519_cert():
+    return build_cert(ed25519.Ed25519PrivateKey.generate(), None)
+
+
+@pytest.fixture(scope="module")
+def rsa_cert():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return build_cert(key, hashes.SHA256())
+
+
+def test_format_hex():
+    assert format_hex(bytes(range(5)), 4, 2) == ["    00:01:", "    02:03:", "    04"]
+
+
+def test_format_tls_cert(ec_cert):
+    description = format_tls_cert(ec_cert)
+    assert "        Issuer: C = US, CN = mozz.us\n" in description
+    assert "            Not Before: Jan  5 01:02:03 2023 GMT\n" in description
+    assert "                ASN1 OID: prime256v1\n" in description
+    assert "                DNS:mozz.us, DNS:*.mozz.us\n" in description
+    assert "            X509v3 Basic Constraints: critical\n" in description
+    assert "                TLS Web Server Authentication\n" in description
+    assert description.endswith("-----END CERTIFICATE-----\n")
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl is not installed")
+@pytest.mark.parametrize("cert", ["ec_cert", "ed25519_cert", "rsa_cert"])
+def test_format_tls_cert_matches_openssl(cert, request):
+    tls_cert = request.getfixturevalue(cert)
+    proc = subprocess.run(
+        ["openssl", "x509", "-inform", "DER", "-text"],
+        input=tls_cert,
+        capture_output=True,
+        check=True,
+    )
+    assert format_tls_cert(tls_cert) == proc.stdout.decode()
+
+
+async def test_tls_cert_description_cache(ec_cert, ed25519_cert):
+    cache = TLSCertDescriptionCache(max_size=1)
+
+    description = await cache.describe(ec_cert)
+    assert await cache.describe(ec_cert) is description
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    await cache.describe(ed25519_cert)
+    assert len(cache.descriptions) == 1
+
+    assert await cache.describe(b"not a certificate") == ""
+    assert cache.errors == 1
+
+
+def test_format_tls_cert_signature_algorithm(ec_cert, rsa_cert):
+    assert "    Signature Algorithm: ecdsa-with-SHA256\n" in format_tls_cert(ec_cert)
+    assert "    Signature Algorithm: sha256WithRSAEncryption\n" in format_tls_cert(rsa_cert)
+
+
+async def test_tls_cert_description_cache_errors(monkeypatch):
+    cache = TLSCertDescriptionCache()
+    assert await cache.describe(None) == ""
+    assert cache.misses == 0
+
+    def format_tls_cert(tls_cert):
+        raise x509.DuplicateExtension("Duplicate extension", ExtensionOID.KEY_USAGE)
+
+    monkeypatch.setattr("geminiportal.utils.format_tls_cert", format_tls_cert)
+    assert await cache.describe(b"cert") == ""
+    assert cache.errors == 1